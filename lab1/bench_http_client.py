@@ -0,0 +1,128 @@
+# compares the old one-connection-per-request fetch against the pooled keep-alive client
+# against a local TLS server that counts handshakes
+#
+#   python bench_http_client.py [requests]
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from http_client import ConnectionPool
+
+PAGE = b"<html><body>" + b"<div class='js-content product__item'>product</div>" * 400 + b"</body></html>"
+
+
+class CountingTLSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, context):
+        super().__init__(address, handler)
+        self.context = context
+        self.handshakes = 0
+        self.resumed = 0
+        self.lock = threading.Lock()
+
+    def get_request(self):
+        sock, addr = self.socket.accept()
+        tls_sock = self.context.wrap_socket(sock, server_side=True)
+        with self.lock:
+            self.handshakes += 1
+            if tls_sock.session_reused:
+                self.resumed += 1
+        return tls_sock, addr
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        # alternate framing so both Content-Length and chunked paths get exercised
+        if self.path.endswith("/chunked"):
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(PAGE), 4096):
+                piece = PAGE[i:i + 4096]
+                self.wfile.write(f"{len(piece):x}\r\n".encode() + piece + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(PAGE)))
+            self.end_headers()
+            self.wfile.write(PAGE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_certificate(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+# the way lab1 used to fetch pages: new socket + handshake, Connection: close, read until EOF
+def fetch_connection_close(host, port, path, cafile):
+    context = ssl.create_default_context(cafile=cafile)
+    sock = context.wrap_socket(socket.socket(socket.AF_INET, socket.SOCK_STREAM), server_hostname=host)
+    sock.connect((host, port))
+    sock.send(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+    response = b""
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        response += chunk
+    sock.close()
+    return response
+
+
+def run(name, server, fetch, count):
+    server.handshakes = server.resumed = 0
+    start = time.perf_counter()
+    for i in range(count):
+        fetch(f"/product/{i}" + ("/chunked" if i % 2 else ""))
+    elapsed = time.perf_counter() - start
+    print(f"{name:<22} {count / elapsed:>9.1f} req/s   handshakes: {server.handshakes:<5} resumed: {server.resumed}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(directory)
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(cert, key)
+
+        server = CountingTLSServer(("127.0.0.1", 0), PageHandler, server_context)
+        port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        run("connection: close", server, lambda path: fetch_connection_close("localhost", port, path, cert), count)
+
+        pool = ConnectionPool(ssl.create_default_context(cafile=cert))
+        run("pooled keep-alive", server, lambda path: pool.request("localhost", port, path), count)
+
+        # drop the idle connection but keep the stored session -> every reconnect should resume
+        def reconnect_each_time(path):
+            pool.request("localhost", port, path)
+            pool.close()
+        run("pooled, reconnecting", server, reconnect_each_time, count)
+
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
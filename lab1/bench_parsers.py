@@ -0,0 +1,57 @@
+# parses saved listing / product pages with every installed extraction engine and reports pages/sec
+#
+#   python bench_parsers.py [seconds per run] [listing.html product.html]
+#
+# save real pages with e.g. curl -A Mozilla https://maximum.md/ro/... > fixtures/listing.html
+import os
+import sys
+import time
+
+from parsers import ENGINES, available_engines
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def pages_per_second(parse, html, seconds):
+    count = 0
+    start = time.perf_counter()
+    while True:
+        parse(html)
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return count / elapsed
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    listing_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(FIXTURES, 'listing.html')
+    product_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(FIXTURES, 'product.html')
+    with open(listing_path, encoding='utf-8') as f:
+        listing_html = f.read()
+    with open(product_path, encoding='utf-8') as f:
+        product_html = f.read()
+
+    engines = [ENGINES[name]() for name in available_engines()]
+    missing = [name for name in ENGINES if name not in available_engines()]
+    if missing:
+        print(f"not installed: {', '.join(missing)}")
+
+    # every engine has to agree with the first one before its numbers mean anything
+    reference = engines[0]
+    expected = (reference.parse_listing(listing_html).entries, reference.parse_product_weight(product_html))
+    print(f"listing: {len(expected[0])} products, weight: {expected[1]!r}")
+
+    print(f"{'engine':<8} {'listing pages/s':>16} {'product pages/s':>16}")
+    for engine in engines:
+        result = (engine.parse_listing(listing_html).entries, engine.parse_product_weight(product_html))
+        if result != expected:
+            print(f"{engine.name:<8} results differ from {reference.name}")
+            continue
+        listing_rate = pages_per_second(engine.parse_listing, listing_html, seconds)
+        product_rate = pages_per_second(engine.parse_product_weight, product_html, seconds)
+        print(f"{engine.name:<8} {listing_rate:>16.1f} {product_rate:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
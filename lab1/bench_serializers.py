@@ -0,0 +1,183 @@
+# times the lab1 serializers against the old string-building ones, json.dumps and xml.etree
+# on a synthetic result
+#
+#   python bench_serializers.py [products]
+import io
+import json
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from serializers import (CustomDecoder, dumps_custom, dumps_custom_binary, dumps_json, dumps_xml, loads_custom,
+                         loads_custom_binary, write_json, write_xml)
+
+
+def make_result(count):
+    products = [
+        {
+            "name": f'Karcher K{i} "Compact" & Home <{i % 7}>',
+            "weight": f"{i % 9}.{i % 10}",
+            "price_mdl": 1000 + i % 700,
+            "link": f"https://maximum.md/ro/p/{i}/?ref=list&page={i % 5}",
+            "price_eur": round((1000 + i % 700) / 19.242, 2),
+        }
+        for i in range(count)
+    ]
+    return {
+        "total_sum_mdl": sum(p["price_mdl"] for p in products),
+        "timestamp_utc": "2024-10-01T12:00:00",
+        "filtered_products": products,
+    }
+
+
+# the way lab1 used to serialize
+def old_dict_to_json(dictionary):
+    return str(dictionary).replace("'", "\"")
+
+
+def old_dict_to_xml(dictionary):
+    xml_str = "<result>\n"
+    xml_str += f"  <total_sum_mdl>{dictionary['total_sum_mdl']}</total_sum_mdl>\n"
+    xml_str += f"  <timestamp_utc>{dictionary['timestamp_utc']}</timestamp_utc>\n"
+    xml_str += "  <filtered_products>\n"
+    for product in dictionary['filtered_products']:
+        xml_str += "    <product>\n"
+        xml_str += f"      <name>{product['name']}</name>\n"
+        xml_str += f"      <price_mdl>{product['price_mdl']}</price_mdl>\n"
+        xml_str += f"      <price_eur>{product['price_eur']}</price_eur>\n"
+        xml_str += f"      <link>{product['link']}</link>\n"
+        xml_str += "    </product>\n"
+    xml_str += "  </filtered_products>\n"
+    xml_str += "</result>"
+    return xml_str
+
+
+def old_custom_serialization(data):
+    lines = []
+
+    def helper(data, indent=0):
+        prefix = '  ' * indent
+        if isinstance(data, dict):
+            lines.append(prefix + 'DICT:')
+            for key, value in data.items():
+                lines.append(prefix + '  ' + str(key) + '=')
+                helper(value, indent + 2)
+            lines.append(prefix + ':ENDDICT')
+        elif isinstance(data, list):
+            lines.append(prefix + 'LIST:')
+            for item in data:
+                helper(item, indent + 1)
+            lines.append(prefix + ':ENDLIST')
+        elif isinstance(data, str):
+            lines.append(prefix + 'STR:' + data)
+        elif isinstance(data, int):
+            lines.append(prefix + 'INT:' + str(data))
+        elif isinstance(data, float):
+            lines.append(prefix + 'FLOAT:' + str(data))
+    helper(data)
+    return '\n'.join(lines)
+
+
+def old_custom_deserialization(s):
+    lines = s.split('\n')
+    pos = [0]
+
+    def process():
+        line = lines[pos[0]].strip()
+        pos[0] += 1
+        if line == 'DICT:':
+            result = {}
+            while True:
+                line = lines[pos[0]].strip()
+                if line == ':ENDDICT':
+                    pos[0] += 1
+                    break
+                key = line.rstrip('=').strip()
+                pos[0] += 1
+                result[key] = process()
+            return result
+        elif line == 'LIST:':
+            result = []
+            while True:
+                line = lines[pos[0]].strip()
+                if line == ':ENDLIST':
+                    pos[0] += 1
+                    break
+                result.append(process())
+            return result
+        elif line.startswith('STR:'):
+            return line[4:]
+        elif line.startswith('INT:'):
+            return int(line[4:])
+        elif line.startswith('FLOAT:'):
+            return float(line[6:])
+    return process()
+
+
+def etree_xml(dictionary):
+    root = ET.Element("result")
+    ET.SubElement(root, "total_sum_mdl").text = str(dictionary['total_sum_mdl'])
+    ET.SubElement(root, "timestamp_utc").text = str(dictionary['timestamp_utc'])
+    products = ET.SubElement(root, "filtered_products")
+    for product in dictionary['filtered_products']:
+        element = ET.SubElement(products, "product")
+        for field in ("name", "price_mdl", "price_eur", "link"):
+            ET.SubElement(element, field).text = str(product[field])
+    return ET.tostring(root, encoding="unicode")
+
+
+def run(name, serialize, result):
+    start = time.perf_counter()
+    output = serialize(result)
+    elapsed = time.perf_counter() - start
+    size = f"{len(output) / 1e6:>7.2f} MB" if isinstance(output, (str, bytes)) else ""
+    print(f"{name:<26} {elapsed * 1000:>9.1f} ms   {size}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    result = make_result(count)
+
+    # the new json has to be what json.dumps makes, and the new xml has to be well formed
+    assert json.loads(dumps_json(result)) == result
+    assert dumps_json(result) == json.dumps(result, ensure_ascii=False)
+    ET.fromstring(dumps_xml(result))
+    assert dumps_custom(result) == old_custom_serialization(result)
+
+    print(f"{count} products")
+    run("json: old str().replace", old_dict_to_json, result)
+    run("json: json.dumps", lambda r: json.dumps(r, ensure_ascii=False), result)
+    run("json: dumps_json", dumps_json, result)
+    run("json: write_json", lambda r: write_json(r, io.StringIO()), result)
+    run("xml: old +=", old_dict_to_xml, result)
+    run("xml: xml.etree", etree_xml, result)
+    run("xml: dumps_xml", dumps_xml, result)
+    run("xml: write_xml", lambda r: write_xml(r, io.StringIO()), result)
+    run("custom: old", old_custom_serialization, result)
+    run("custom: dumps_custom", dumps_custom, result)
+    run("custom: dumps_custom_binary", dumps_custom_binary, result)
+
+    text = dumps_custom(result)
+    binary = dumps_custom_binary(result)
+    assert loads_custom(text) == result and loads_custom_binary(binary) == result
+    print(f"custom text {len(text) / 1e6:.2f} MB, binary {len(binary) / 1e6:.2f} MB")
+    run("parse: old recursive", old_custom_deserialization, text)
+    run("parse: loads_custom", loads_custom, text)
+    run("parse: loads_custom_binary", loads_custom_binary, binary)
+
+    def decode_in_chunks(data):
+        decoder = CustomDecoder()
+        for i in range(0, len(data), 16384):
+            decoder.feed(data[i:i + 16384])
+        return decoder.close()
+    run("parse: CustomDecoder 16k", decode_in_chunks, text)
+
+    # streaming: a generator of products is written without ever holding the list or the output
+    products = (p for p in make_result(count)["filtered_products"])
+    streamed = {**result, "filtered_products": products}
+    with open('/dev/null', 'w') as out:
+        run("json: write_json generator", lambda r: write_json(r, out), streamed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class HostRateLimiter:
+    # spaces out request starts to the same host by at least min_interval seconds
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        if self.min_interval <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.min_interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def fetch_all(fetch, host, port, paths, concurrency=8, min_interval=0.0):
+    # fetch(host, port, path) is called from worker threads, results come back in the order of paths
+    limiter = HostRateLimiter(min_interval)
+
+    def fetch_one(path):
+        limiter.wait(host)
+        return fetch(host, port, path)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        return list(executor.map(fetch_one, paths))
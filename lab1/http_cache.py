@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from http_client import HTTPResponse
+
+# on-disk response cache keyed by url
+#
+#   <directory>/index.json    url -> metadata, in least -> most recently used order
+#   <directory>/<sha1>.body   raw response body
+#
+# entries younger than their ttl are served without touching the network, older ones are
+# revalidated with If-None-Match / If-Modified-Since so an unchanged page costs a 304.
+
+
+class CacheEntry:
+    def __init__(self, url, key, status, headers, stored_at, ttl, size):
+        self.url = url
+        self.key = key
+        self.status = status
+        self.headers = headers  # only the headers we need: etag, last-modified, content-type
+        self.stored_at = stored_at
+        self.ttl = ttl
+        self.size = size
+        self.body = None  # read from disk lazily
+
+    def is_fresh(self, now=None):
+        return (now if now is not None else time.time()) - self.stored_at < self.ttl
+
+    def validators(self):
+        headers = {}
+        if 'etag' in self.headers:
+            headers['If-None-Match'] = self.headers['etag']
+        if 'last-modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['last-modified']
+        return headers
+
+    def response(self):
+        return HTTPResponse(self.status, "OK", dict(self.headers), self.body)
+
+    def to_json(self):
+        return {
+            "status": self.status,
+            "headers": self.headers,
+            "stored_at": self.stored_at,
+            "ttl": self.ttl,
+            "size": self.size,
+        }
+
+
+def cache_control(headers):
+    # Cache-Control as {directive: value or True}
+    directives = {}
+    for part in headers.get('cache-control', '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"') if value else True
+    return directives
+
+
+class HTTPCache:
+    KEPT_HEADERS = ('etag', 'last-modified', 'content-type')
+
+    def __init__(self, directory, ttl=3600, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"fresh": 0, "revalidated": 0, "stored": 0, "evicted": 0}
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def body_path(self, key):
+        return os.path.join(self.directory, f"{key}.body")
+
+    def load(self):
+        try:
+            with open(self.index_path(), encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        for url, data in index.items():
+            key = hashlib.sha1(url.encode()).hexdigest()
+            # an index entry without its body file is useless, e.g. after a crash mid-write
+            if not os.path.exists(self.body_path(key)):
+                continue
+            entry = CacheEntry(url, key, data["status"], data["headers"], data["stored_at"], data["ttl"], data["size"])
+            self.entries[url] = entry
+            self.total_bytes += entry.size
+
+        # bodies written after the last save have no index entry, drop them
+        known = {entry.key for entry in self.entries.values()}
+        for name in os.listdir(self.directory):
+            if name.endswith('.body') and name[:-len('.body')] not in known:
+                os.remove(os.path.join(self.directory, name))
+
+    def save(self):
+        # write to a temp file and rename, so a crash never leaves a half-written index
+        with self.lock:
+            index = {url: entry.to_json() for url, entry in self.entries.items()}
+        temp_path = self.index_path() + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(temp_path, self.index_path())
+
+    def lookup(self, url):
+        # returns the cached entry with its body loaded, or None
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            self.entries.move_to_end(url)
+        if entry.body is None:
+            try:
+                with open(self.body_path(entry.key), 'rb') as f:
+                    entry.body = f.read()
+            except OSError:
+                self.remove(url)
+                return None
+        return entry
+
+    def store(self, url, response):
+        # keeps a 200 response unless the server forbids it, returns the new entry or None
+        directives = cache_control(response.headers)
+        if response.status != 200 or 'no-store' in directives:
+            self.remove(url)
+            return None
+
+        ttl = self.ttl
+        if 'no-cache' in directives:
+            ttl = 0
+        elif isinstance(directives.get('max-age'), str) and directives['max-age'].isdigit():
+            ttl = int(directives['max-age'])
+
+        key = hashlib.sha1(url.encode()).hexdigest()
+        headers = {name: response.headers[name] for name in self.KEPT_HEADERS if name in response.headers}
+        entry = CacheEntry(url, key, response.status, headers, time.time(), ttl, len(response.body))
+        entry.body = response.body
+        if entry.size > self.max_bytes:
+            return entry
+
+        temp_path = self.body_path(key) + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(response.body)
+        os.replace(temp_path, self.body_path(key))
+
+        with self.lock:
+            previous = self.entries.pop(url, None)
+            if previous is not None:
+                self.total_bytes -= previous.size
+            self.entries[url] = entry
+            self.total_bytes += entry.size
+            self.stats["stored"] += 1
+        self.evict()
+        return entry
+
+    def revalidated(self, entry, response):
+        # a 304 restarts the entry's ttl, and may carry updated validators
+        with self.lock:
+            for name in ('etag', 'last-modified'):
+                if name in response.headers:
+                    entry.headers[name] = response.headers[name]
+            entry.stored_at = time.time()
+            self.stats["revalidated"] += 1
+        return entry
+
+    def remove(self, url):
+        with self.lock:
+            entry = self.entries.pop(url, None)
+            if entry is None:
+                return
+            self.total_bytes -= entry.size
+        try:
+            os.remove(self.body_path(entry.key))
+        except OSError:
+            pass
+
+    def evict(self):
+        # least recently used entries go first until the cache fits in max_bytes
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes or not self.entries:
+                    return
+                url = next(iter(self.entries))
+                self.stats["evicted"] += 1
+            self.remove(url)
+
+    def request(self, pool, host, port, path, on_chunk=None):
+        # GET through the cache: fresh hit -> no request, stale hit -> conditional GET
+        # on_chunk gets the body like ConnectionPool.request passes it, a cached body in one piece
+        url = f"{'http' if port == 80 else 'https'}://{host}:{port}{path}"
+        entry = self.lookup(url)
+        if entry is not None and entry.is_fresh():
+            with self.lock:
+                self.stats["fresh"] += 1
+            return self.replay(entry, on_chunk)
+
+        response = pool.request(host, port, path, headers=entry.validators() if entry is not None else None,
+                                on_chunk=on_chunk)
+        if response.status == 304 and entry is not None:
+            return self.replay(self.revalidated(entry, response), on_chunk)
+
+        self.store(url, response)
+        return response
+
+    @staticmethod
+    def replay(entry, on_chunk):
+        if on_chunk is not None and entry.body:
+            on_chunk(entry.body, entry.headers)
+        return entry.response()
+
+    def close(self):
+        self.save()
@@ -0,0 +1,345 @@
+import codecs
+import socket
+import ssl
+import threading
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+# only advertise br when the brotli package is installed
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli is not None else "gzip, deflate"
+# body bytes are read from the socket into one reused buffer of this size
+READ_SIZE = 64 * 1024
+
+
+class HTTPError(Exception):
+    pass
+
+
+def content_charset(headers, default='utf-8'):
+    # charset parameter of Content-Type, if python knows the codec
+    for param in headers.get('content-type', '').split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'charset' and value:
+            charset = value.strip('"\' ').lower()
+            try:
+                codecs.lookup(charset)
+            except LookupError:
+                break
+            return charset
+    return default
+
+
+class HTTPResponse:
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers  # header names are lowercased
+        self.body = body  # already decompressed, bytes or bytearray
+
+    def header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    @property
+    def charset(self):
+        return content_charset(self.headers)
+
+    def text(self):
+        return self.body.decode(self.charset, errors='replace')
+
+
+class ContentDecoder:
+    # incremental Content-Encoding decompression, one decompressor per response
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding in ('gzip', 'x-gzip'):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self.decompressor = zlib.decompressobj()
+        elif encoding == 'br' and brotli is not None:
+            self.decompressor = brotli.Decompressor()
+        else:
+            raise HTTPError(f"unsupported content encoding {encoding!r}")
+
+    def decompress(self, data):
+        if self.encoding == 'br':
+            # brotli renamed process() to decompress() at some point
+            process = getattr(self.decompressor, 'process', None) or self.decompressor.decompress
+            return process(data)
+        return self.decompressor.decompress(data)
+
+    def flush(self):
+        if self.encoding == 'br':
+            return b""
+        return self.decompressor.flush()
+
+
+class HTTPConnection:
+    # one persistent HTTP/1.1 connection (TLS when ssl_context is given)
+    def __init__(self, host, port, ssl_context=None, session=None, timeout=10):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.session = session
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.requests_sent = 0
+        self.response_started = False  # whether any of the current response has been read
+        self.last_used = 0.0
+        self.buffer = None  # READ_SIZE scratch buffer, allocated on first body read
+
+    def connect(self):
+        raw_socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        raw_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.ssl_context is not None:
+            # passing the previous session lets the server skip the full handshake
+            self.sock = self.ssl_context.wrap_socket(raw_socket, server_hostname=self.host, session=self.session)
+        else:
+            self.sock = raw_socket
+        self.reader = self.sock.makefile('rb')
+        self.requests_sent = 0
+
+    @property
+    def session_reused(self):
+        return bool(getattr(self.sock, 'session_reused', False))
+
+    def close(self):
+        # keep the TLS session so a new connection to the same host can resume it
+        if self.sock is not None and self.ssl_context is not None:
+            self.session = self.sock.session or self.session
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def request(self, method, path, headers=None, on_chunk=None):
+        # on_chunk(data, headers) sees every decompressed piece of the body as it arrives,
+        # data is only valid during the call
+        if self.sock is None:
+            self.connect()
+
+        request_headers = {
+            "Host": self.host,
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": ACCEPT_ENCODING,
+            "Connection": "keep-alive",
+        }
+        if headers:
+            request_headers.update(headers)
+
+        lines = [f"{method} {path} HTTP/1.1"]
+        lines += [f"{name}: {value}" for name, value in request_headers.items()]
+        self.response_started = False
+        self.sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode())
+        self.requests_sent += 1
+
+        response = self.read_response(method, on_chunk)
+        self.last_used = time.monotonic()
+        return response
+
+    def read_response(self, method, on_chunk=None):
+        # interim responses (100 Continue, 103 Early Hints) come before the real one on the same
+        # connection, they have no body and are skipped; 101 is final, the connection is not http any more
+        while True:
+            version, status, reason, headers = self.read_head()
+            if not 100 <= status < 200 or status == 101:
+                break
+
+        if status == 101:
+            pieces = iter(())
+            headers['connection'] = 'close'  # not reusable for another request
+        elif method == 'HEAD' or status in (204, 304):
+            pieces = iter(())
+        elif 'chunked' in headers.get('transfer-encoding', '').lower():
+            pieces = self.read_chunked()
+        elif 'content-length' in headers:
+            pieces = self.read_exact(int(headers['content-length']))
+        else:
+            # no framing information - the body ends when the server closes
+            pieces = self.read_until_close()
+            headers['connection'] = 'close'
+
+        # the body is decompressed on the fly and kept once, callers never see the encoded bytes
+        encoding = headers.pop('content-encoding', 'identity').strip().lower()
+        decoder = ContentDecoder(encoding) if encoding not in ('', 'identity') else None
+        body = bytearray()
+        for piece in pieces:
+            data = decoder.decompress(piece) if decoder is not None else piece
+            if data:
+                body += data
+                if on_chunk is not None:
+                    on_chunk(data, headers)
+        if decoder is not None:
+            data = decoder.flush()
+            if data:
+                body += data
+                if on_chunk is not None:
+                    on_chunk(data, headers)
+            headers['content-length'] = str(len(body))
+
+        connection = headers.get('connection', '').lower()
+        if connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive'):
+            self.close()
+
+        return HTTPResponse(status, reason, headers, body)
+
+    def read_head(self):
+        # status line and headers of one response
+        status_line = self.reader.readline()
+        if not status_line:
+            raise HTTPError("connection closed before response")
+        self.response_started = True
+
+        parts = status_line.decode('iso-8859-1').rstrip('\r\n').split(' ', 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise HTTPError(f"malformed status line: {status_line!r}")
+        version = parts[0]
+        status = int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ""
+
+        headers = {}
+        while True:
+            line = self.reader.readline()
+            if not line:
+                raise HTTPError("connection closed while reading headers")
+            if line in (b'\r\n', b'\n'):
+                break
+            name, _, value = line.decode('iso-8859-1').partition(':')
+            name = name.strip().lower()
+            value = value.strip()
+            # repeated headers are joined like the spec allows (set-cookie aside, we don't care)
+            headers[name] = f"{headers[name]}, {value}" if name in headers else value
+        return version, status, reason, headers
+
+    def read_into_buffer(self, size):
+        # reads up to size (<= READ_SIZE) bytes into the scratch buffer, returns a view of them
+        if self.buffer is None:
+            self.buffer = memoryview(bytearray(READ_SIZE))
+        return self.buffer[:self.reader.readinto(self.buffer[:size])]
+
+    def read_exact(self, length):
+        remaining = length
+        while remaining:
+            data = self.read_into_buffer(min(remaining, READ_SIZE))
+            if not data:
+                raise HTTPError(f"expected {length} bytes, got {length - remaining}")
+            remaining -= len(data)
+            yield data
+
+    def read_until_close(self):
+        while True:
+            data = self.read_into_buffer(READ_SIZE)
+            if not data:
+                return
+            yield data
+
+    def read_chunked(self):
+        while True:
+            size_line = self.reader.readline()
+            if not size_line:
+                raise HTTPError("connection closed inside chunked body")
+            # chunk extensions after ';' are ignored
+            size = int(size_line.split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                # skip trailers up to the empty line
+                while True:
+                    line = self.reader.readline()
+                    if not line or line in (b'\r\n', b'\n'):
+                        break
+                return
+            yield from self.read_exact(size)
+            self.reader.readline()  # CRLF after every chunk
+
+
+class ConnectionPool:
+    # keeps idle keep-alive connections per (host, port) and remembers TLS sessions
+    def __init__(self, ssl_context=None, max_idle_per_host=4, idle_timeout=30, timeout=10):
+        self.ssl_context = ssl_context if ssl_context is not None else ssl.create_default_context()
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.idle = {}
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "connections": 0, "resumed": 0, "reused": 0}
+
+    def acquire(self, host, port):
+        key = (host, port)
+        now = time.monotonic()
+        with self.lock:
+            connections = self.idle.get(key, [])
+            while connections:
+                connection = connections.pop()
+                if now - connection.last_used < self.idle_timeout:
+                    self.stats["reused"] += 1
+                    return connection
+                connection.close()
+        return self.new_connection(host, port)
+
+    def new_connection(self, host, port):
+        with self.lock:
+            session = self.sessions.get((host, port))
+        # plain http only on port 80, everything else goes over TLS
+        context = None if port == 80 else self.ssl_context
+        connection = HTTPConnection(host, port, context, session=session, timeout=self.timeout)
+        connection.connect()
+        with self.lock:
+            self.stats["connections"] += 1
+            if connection.session_reused:
+                self.stats["resumed"] += 1
+        return connection
+
+    def release(self, connection):
+        key = (connection.host, connection.port)
+        with self.lock:
+            # tls 1.3 tickets only show up after the first read, so grab the session on release
+            if connection.sock is not None and connection.ssl_context is not None:
+                connection.session = connection.sock.session or connection.session
+            if connection.session is not None:
+                self.sessions[key] = connection.session
+            if connection.sock is None:
+                return
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle_per_host:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def request(self, host, port, path, method='GET', headers=None, on_chunk=None):
+        connection = self.acquire(host, port)
+        reused = connection.requests_sent > 0
+        try:
+            try:
+                response = connection.request(method, path, headers, on_chunk)
+            except (HTTPError, OSError):
+                # the server may have dropped an idle keep-alive connection, retry once on a fresh
+                # one - but not once part of the response arrived, on_chunk may have seen the body
+                if not reused or connection.response_started:
+                    raise
+                connection.close()
+                connection = self.new_connection(host, port)
+                response = connection.request(method, path, headers, on_chunk)
+        except BaseException:
+            # whatever failed, including on_chunk, the connection is in an unknown state
+            connection.close()
+            raise
+
+        with self.lock:
+            self.stats["requests"] += 1
+        self.release(connection)
+        return response
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
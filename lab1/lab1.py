@@ -1,126 +1,281 @@
-import socket
-import ssl
-from bs4 import BeautifulSoup
-import re
+import codecs
+import os
+import sys
 from functools import reduce
 from datetime import datetime
+from urllib.parse import parse_qs, urljoin, urlsplit
+
+from fetcher import fetch_all
+from http_cache import HTTPCache
+from http_client import ConnectionPool, HTTPError, content_charset
+from parsers import get_engine
+from product_index import ProductIndex
+from serializers import dumps_custom, dumps_json, dumps_xml, loads_custom, write_custom, write_json, write_xml
 
 min_price = 1000
 max_price = 1700
 
+# product pages fetched in parallel, with at most one request start per interval to the shop
+fetch_concurrency = 8
+min_request_interval = 0.05
+
+# responses are kept on disk between runs; fresh pages are not requested again, stale ones are
+# revalidated with a conditional GET, least recently used pages go once the cache is over its size
+cache_directory = os.environ.get('LAB1_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.http_cache'))
+cache_ttl = 3600
+cache_max_bytes = 64 * 1024 * 1024
+
+# incremental mode keeps link -> (price, weight, last seen) here, weights older than the max age get refetched
+index_path = os.environ.get('LAB1_INDEX', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.product_index.json'))
+index_max_age = 7 * 24 * 3600
+
+default_listing_path = "/ro/electrocasnice-mari/aspiratoare/aparate-de-spalat-pentru-auto/"
+
+# html extraction backend, see parsers.py (LAB1_PARSER=stream|lxml|bs4)
+parser_engine = get_engine()
+
 def convert_price_to_eur(mdl):
     conversion_rate = 19.242
     return round(mdl / conversion_rate, 2)
 
 
-def retrieve_page_body(host, port, path):
-    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+# one pool for the whole run, so listing + product pages share keep-alive TLS connections
+connection_pool = ConnectionPool(max_idle_per_host=fetch_concurrency)
+page_cache = HTTPCache(cache_directory, ttl=cache_ttl, max_bytes=cache_max_bytes)
+
+
+def retrieve_page_body(host, port, path, feed=None):
+    # send HTTPS GET request over a pooled keep-alive connection, unless the cached copy is still fresh
+    # without a feed the decoded page is returned; with one (see parsers.py) the body is decoded
+    # and parsed while it downloads, the whole page never exists as a string, and feed.result() is returned.
+    # None when the page couldn't be fetched, so a failure is never mistaken for an empty page
+    text_decoder = None
+
+    def on_chunk(data, headers):
+        nonlocal text_decoder
+        if feed.done:
+            return
+        if text_decoder is None:
+            text_decoder = codecs.getincrementaldecoder(content_charset(headers))(errors='replace')
+        feed.feed(text_decoder.decode(data))
+
+    try:
+        response = page_cache.request(connection_pool, host, port, path, on_chunk=on_chunk if feed else None)
+    except (HTTPError, OSError) as e:
+        print(f"Could not retrieve {path}: {e}")
+        return None
+
+    if response.status != 200:
+        print(f"Unexpected status {response.status} for {path}")
+        return None
+
+    if feed is None:
+        # body is already framed by Content-Length / chunked encoding and decompressed
+        return response.text()
+    if text_decoder is not None and not feed.done:
+        feed.feed(text_decoder.decode(b"", final=True))
+    return feed.result()
+
+
+def fetch_product_weights(entries):
+    # fetch all in-range product pages concurrently, returns {path: weight}, None for pages that failed
+    candidate_paths = [
+        path for name, price, path in entries
+        if path is not None and price is not None and min_price <= price <= max_price
+    ]
+    weights = fetch_all(
+        lambda host, port, path: retrieve_page_body(host, port, path, parser_engine.weight_feed()),
+        'maximum.md',
+        443,
+        candidate_paths,
+        concurrency=fetch_concurrency,
+        min_interval=min_request_interval
+    )
+    return dict(zip(candidate_paths, weights))
+
+
+def build_products(entries, weights):
+    for name, price, path in entries:
+        product_link = f"https://maximum.md{path}" if path else None
+
+        # validate data before yielding
+        if name and price is not None and product_link:
+            yield {
+                "name": name,
+                "weight": weights.get(path) or 0,
+                "price_mdl": price,
+                "link": product_link
+            }
+
+
+def find_next_page(listing, current_path):
+    # prefer rel="next", fall back to the pagination link numbered one past the current page
+    next_href = listing.next_href
+    if not next_href:
+        query = parse_qs(urlsplit(current_path).query)
+        next_number = str(int(query.get('page', ['1'])[0]) + 1)
+        next_href = listing.pagination.get(next_number)
+    if not next_href:
+        return None
+
+    # links may be absolute, we only need the path + query
+    next_url = urlsplit(urljoin(current_path, next_href))
+    return next_url.path + (f"?{next_url.query}" if next_url.query else "")
+
+
+def crawl_listing_pages(roots, finished=None):
+    # yields the entries of one listing page at a time, following pagination for every root;
+    # roots whose pagination was followed to the end (no page failed to load) are added to finished
+    for root in roots:
+        path = root
+        visited = set()
+        failed = False
+        while path and path not in visited:
+            visited.add(path)
+            listing = retrieve_page_body("maximum.md", 443, path, parser_engine.listing_feed())
+            if listing is None:
+                failed = True
+                break
+            if not listing.entries:
+                break
+            yield listing.entries
+            path = find_next_page(listing, path)
+        if not failed and finished is not None:
+            finished.add(root)
+
+
+def crawl_products(roots):
+    # fetch -> parse one listing page at a time, so only a page worth of products is held in memory
+    for entries in crawl_listing_pages(roots):
+        yield from build_products(entries, fetch_product_weights(entries))
+
+
+def crawl(roots):
+    # lazy pipeline: crawl -> map to eur -> filter -> serialize, one product at a time
+    products = crawl_products(roots)
+    mapped = map(lambda p: {
+        **p,
+        "price_eur": convert_price_to_eur(p["price_mdl"])
+    }, products)
+    filtered = filter(lambda p: min_price <= p["price_mdl"] <= max_price, mapped)
+    return map(dict_to_json, filtered)
+
+
+def price_in_range(price):
+    return price is not None and min_price <= price <= max_price
+
+
+def indexed_product(link, entry):
+    return {
+        "name": entry["name"],
+        "weight": entry["weight"],
+        "price_mdl": entry["price_mdl"],
+        "link": link,
+        "price_eur": convert_price_to_eur(entry["price_mdl"])
+    }
+
+
+def incremental(roots, product_index):
+    # crawl the listings, fetch only the product pages the index can't answer, return the delta
+    # of the in-range products against the previous run
+    previous = {link: dict(product_index.get(link)) for link in product_index.links_under(roots)}
+    seen = {}  # link -> root, in listing order
+    finished = set()  # roots crawled to their last page
+
+    for root in roots:
+        for entries in crawl_listing_pages([root], finished):
+            valid = [(name, price, path) for name, price, path in entries if name and price is not None and path]
+            stale = [
+                (name, price, path) for name, price, path in valid
+                if product_index.needs_weight(f"https://maximum.md{path}", price, price_in_range)
+            ]
+            weights = fetch_product_weights(stale)
+            for name, price, path in valid:
+                link = f"https://maximum.md{path}"
+                seen[link] = root
+                # a product page that failed to load leaves the weight in the index as it was
+                product_index.update(link, name, price, root, weight=weights.get(path))
+
+    added, changed, removed = [], [], []
+    for link in seen:
+        entry = product_index.get(link)
+        if not price_in_range(entry["price_mdl"]):
+            continue
+        old = previous.get(link)
+        if old is None or not price_in_range(old["price_mdl"]):
+            added.append(indexed_product(link, entry))
+        elif any(old[field] != entry[field] for field in ("name", "price_mdl", "weight")):
+            changed.append(indexed_product(link, entry))
+
+    for link, old in previous.items():
+        if link not in seen:
+            if old.get("root") not in finished:
+                continue  # the listing broke off before its page, the product may well still be there
+            product_index.remove(link)
+        elif price_in_range(product_index.get(link)["price_mdl"]):
+            continue
+        if price_in_range(old["price_mdl"]):
+            removed.append(indexed_product(link, old))
+
+    product_index.save()
+    return {
+        "timestamp_utc": datetime.utcnow().isoformat(),
+        "added": added,
+        "changed": changed,
+        "removed": removed,
+    }
 
-    # wrap the socket for SSL to handle HTTPS
-    context = ssl.create_default_context()
-    ssl_client_socket = context.wrap_socket(client_socket, server_hostname=host)
 
-    ssl_client_socket.connect((host, port))
+def dict_to_json(dictionary):
+    return dumps_json(dictionary)
 
-    # send HTTPS GET request to server
-    http_request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36\r\nConnection: close\r\n\r\n"
-    ssl_client_socket.send(http_request.encode())
 
-    # receive the response
-    response = b""
-    while True:
-        chunk = ssl_client_socket.recv(4096)  # read in chunks of 4KB
-        if not chunk:
-            break
-        response += chunk
+def dict_to_xml(dictionary):
+    return dumps_xml(dictionary)
 
-    # close socket
-    ssl_client_socket.close()
 
-    # decode response to a string
-    response_str = response.decode()
+def custom_serialization(data):
+    return dumps_custom(data)
 
-    # find beginning of response body
-    body_index = response_str.find('\r\n\r\n')
-    if body_index != -1:
-        response_text = response_str[body_index + 4:]  # extract the body of the response
-    else:
-        print("Could not find the body of the response.")
-        response_text = ""
 
-    return response_text
+def custom_deserialization(s):
+    return loads_custom(s)
 
 
-def parse_product_weight(soup):
-    product_weight = 0
-    feature_items = soup.find_all('li', class_='feature-list-item')
+# crawler mode: python lab1.py crawl <category path> [<category path> ...]
+# prints one json line per product as soon as it is scraped
+if len(sys.argv) > 2 and sys.argv[1] == 'crawl':
+    for line in crawl(sys.argv[2:]):
+        print(line, flush=True)
+    connection_pool.close()
+    page_cache.close()
+    sys.exit(0)
 
-    for item in feature_items:
-        left_side = item.find('span', class_='feature-list-item_left')
-        if left_side and 'Greutate, kg' in left_side.get_text(strip=True):
-            right_side = item.find('span', class_='feature-list-item_right')
-            if right_side:
-                product_weight = right_side.get_text(strip=True)
-                break
 
-    return product_weight
+# incremental mode: python lab1.py incremental [<category path> ...]
+# prints only the added / changed / removed in-range products since the previous incremental run
+if len(sys.argv) > 1 and sys.argv[1] == 'incremental':
+    delta = incremental(sys.argv[2:] or [default_listing_path], ProductIndex(index_path, max_age=index_max_age))
+    print(dict_to_json(delta))
+    connection_pool.close()
+    page_cache.close()
+    sys.exit(0)
 
 
 products_list = []
 
-productlist_content = retrieve_page_body(
-    "maximum.md",
-    443,
-    "/ro/electrocasnice-mari/aspiratoare/aparate-de-spalat-pentru-auto/"
-)
-
-if productlist_content:
-    # parse html using bs4 parser
-    soup = BeautifulSoup(productlist_content, 'html.parser')
-
-    # extract product div
-    products = soup.find_all('div', class_='js-content product__item')
-
-    for product in products:
-        # extract name
-        name_tag = product.find('div', class_='product__item__title')
-        name = name_tag.a.text.strip() if name_tag else None
-        if name:
-            name = re.sub(r'\s+', ' ', name)  # remove extra whitespaces from name
-
-        # extract price
-        price_tag = product.find('div', class_='product__item__price-current')
-        price = price_tag.text.strip() if price_tag else None
-        if price:
-            price = re.sub(r'[^0-9]', '', price)  # remove any non-numeric characters from price
-            if price.isdigit():
-                price = int(price)  # convert price to integer
-            else:
-                price = None  # set to None if price is not a valid integer
-
-        # extract link
-        link_tag = name_tag.find('a') if name_tag else None
-        product_link = f"https://maximum.md{link_tag['href']}" if link_tag else None
-
-        weight = 0
-        if link_tag is not None and (min_price <= price <= max_price):
-            productpage_content = retrieve_page_body(
-                'maximum.md',
-                443,
-                link_tag['href']
-            )
-            product_soup = BeautifulSoup(productpage_content, 'html.parser')
-            weight = parse_product_weight(product_soup)
-            print(weight)
-
-        # validate data before appending
-        if name and price is not None and product_link:
-            products_list.append({
-                "name": name,
-                "weight": weight,
-                "price_mdl": price,
-                "link": product_link
-            })
+listing = retrieve_page_body("maximum.md", 443, default_listing_path, parser_engine.listing_feed())
+listing_entries = listing.entries if listing is not None else []
+
+if listing_entries:
+    product_weights = fetch_product_weights(listing_entries)
+    for weight in product_weights.values():
+        print(weight)
+
+    products_list.extend(build_products(listing_entries, product_weights))
+
+connection_pool.close()
+page_cache.close()
 
 # convert mdl to eur
 mapped_products = list(map(lambda p: {
@@ -142,108 +297,13 @@ result = {
 }
 
 
-def dict_to_json(dictionary):
-    return str(dictionary).replace("'", "\"")
-
-
-def dict_to_xml(dictionary):
-    xml_str = "<result>\n"
-    xml_str += f"  <total_sum_mdl>{dictionary['total_sum_mdl']}</total_sum_mdl>\n"
-    xml_str += f"  <timestamp_utc>{dictionary['timestamp_utc']}</timestamp_utc>\n"
-    xml_str += "  <filtered_products>\n"
-    for product in dictionary['filtered_products']:
-        xml_str += "    <product>\n"
-        xml_str += f"      <name>{product['name']}</name>\n"
-        xml_str += f"      <price_mdl>{product['price_mdl']}</price_mdl>\n"
-        xml_str += f"      <price_eur>{product['price_eur']}</price_eur>\n"
-        xml_str += f"      <link>{product['link']}</link>\n"
-        xml_str += "    </product>\n"
-    xml_str += "  </filtered_products>\n"
-    xml_str += "</result>"
-    return xml_str
-
-
-def custom_serialization(data):
-    lines = []
-
-    def helper(data, indent=0):
-        prefix = '  ' * indent
-        if isinstance(data, dict):
-            lines.append(prefix + 'DICT:')
-            for key, value in data.items():
-                lines.append(prefix + '  ' + str(key) + '=')
-                helper(value, indent + 2)
-            lines.append(prefix + ':ENDDICT')
-        elif isinstance(data, list):
-            lines.append(prefix + 'LIST:')
-            for item in data:
-                helper(item, indent + 1)
-            lines.append(prefix + ':ENDLIST')
-        elif isinstance(data, str):
-            lines.append(prefix + 'STR:' + data)
-        elif isinstance(data, int):
-            lines.append(prefix + 'INT:' + str(data))
-        elif isinstance(data, float):
-            lines.append(prefix + 'FLOAT:' + str(data))
-        else:
-            raise ValueError('Unsupported data type: {}'.format(type(data)))
-    helper(data)
-    return '\n'.join(lines)
-
-
-def custom_deserialization(s):
-    lines = s.split('\n')
-    pos = [0]
-
-    def process():
-        if pos[0] >= len(lines):
-            raise ValueError('unexpected end of input')
-        line = lines[pos[0]].strip()
-        pos[0] += 1
-        if line == 'DICT:':
-            result = {}
-            while True:
-                if pos[0] >= len(lines):
-                    raise ValueError('expected :ENDDICT')
-                line = lines[pos[0]].strip()
-                if line == ':ENDDICT':
-                    pos[0] += 1
-                    break
-                if '=' in line: # it's a key/value pair
-                    key = line.rstrip('=').strip()
-                    pos[0] += 1   # move to the value
-                    value = process()
-                    result[key] = value
-                else:
-                    raise ValueError('invalid dictionary entry: ' + line)
-            return result
-        elif line == 'LIST:':
-            result = []
-            while True:
-                if pos[0] >= len(lines):
-                    raise ValueError('expected :ENDLIST')
-                line = lines[pos[0]].strip()
-                if line == ':ENDLIST':
-                    pos[0] += 1
-                    break
-                # non incrementing pos[0] here - process() will do it
-                value = process()
-                result.append(value)
-            return result
-        elif line.startswith('STR:'):
-            return line[4:]
-        elif line.startswith('INT:'):
-            return int(line[4:])
-        elif line.startswith('FLOAT:'):
-            return float(line[6:])
-        else:
-            raise ValueError('unknown type or invalid line:  ' + line)
-    return process()
-
-
-print(dict_to_json(result))
-print(dict_to_xml(result))
-print(custom_serialization(result))
+# written straight to stdout, the documents are never built as one string
+write_json(result, sys.stdout)
+print()
+write_xml(result, sys.stdout)
+print()
+write_custom(result, sys.stdout)
+print()
 print(dict_to_json(custom_deserialization(custom_serialization(result))))
 
 
@@ -0,0 +1,421 @@
+import os
+import re
+from html.parser import HTMLParser
+
+# pluggable page extraction: every engine turns raw html into the same plain python values
+#
+#   engine.parse_listing(html) -> Listing
+#   engine.parse_product_weight(html) -> weight text, or 0 when the page has no weight row
+#
+# listing_feed() / weight_feed() do the same on html that arrives in pieces: feed(text) as the
+# page downloads, result() at the end. feed.done turns true once the rest of the page is not needed.
+#
+# "stream" only needs the standard library, "lxml" and "bs4" are used when installed.
+
+WEIGHT_LABEL = 'Greutate, kg'
+PRODUCT_CLASSES = {'js-content', 'product__item'}
+
+# elements that never get an end tag, so they must not be pushed on the open element stack
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr',
+}
+
+
+class Listing:
+    def __init__(self, entries, next_href=None, pagination=None):
+        self.entries = entries  # [(name, price, product path)]
+        self.next_href = next_href  # href of rel="next", if the page has one
+        self.pagination = pagination or {}  # link text -> href inside the pagination block
+
+
+def clean_name(text):
+    # collapse whitespace runs inside the product title
+    name = re.sub(r'\s+', ' ', text.strip())
+    return name or None
+
+
+def clean_price(text):
+    # keep only the digits, None when nothing numeric is left
+    price = re.sub(r'[^0-9]', '', text)
+    return int(price) if price.isdigit() else None
+
+
+def stripped_text(parts):
+    # same result as bs4's get_text(strip=True)
+    return ''.join(part.strip() for part in parts)
+
+
+def has_classes(class_attr, wanted):
+    return wanted.issubset((class_attr or '').split())
+
+
+class BufferedFeed:
+    # for engines that need the whole document: collect the pieces, parse once at the end
+    done = False
+
+    def __init__(self, parse):
+        self.parse = parse
+        self.parts = []
+
+    def feed(self, text):
+        self.parts.append(text)
+
+    def result(self):
+        return self.parse(''.join(self.parts))
+
+
+class TreeEngine:
+    def listing_feed(self):
+        return BufferedFeed(self.parse_listing)
+
+    def weight_feed(self):
+        return BufferedFeed(self.parse_product_weight)
+
+
+class StreamEngine:
+    # single pass over the html with html.parser, no tree is built
+    name = 'stream'
+
+    def listing_feed(self):
+        return ListingFeed()
+
+    def weight_feed(self):
+        return WeightFeed()
+
+    def parse_listing(self, html):
+        feed = ListingFeed()
+        feed.feed(html)
+        return feed.result()
+
+    def parse_product_weight(self, html):
+        feed = WeightFeed()
+        feed.feed(html)
+        return feed.result()
+
+
+class ListingFeed:
+    done = False
+
+    def __init__(self):
+        self.parser = ListingParser()
+
+    def feed(self, text):
+        self.parser.feed(text)
+
+    def result(self):
+        self.parser.close()
+        self.parser.finish_product()
+        return Listing(self.parser.entries, self.parser.next_href, self.parser.pagination)
+
+
+class WeightFeed:
+    def __init__(self):
+        self.parser = WeightParser()
+        self.done = False
+
+    def feed(self, text):
+        if self.done:
+            return
+        try:
+            self.parser.feed(text)
+        except WeightFound:
+            self.done = True
+
+    def result(self):
+        if not self.done:
+            try:
+                self.parser.close()
+            except WeightFound:
+                self.done = True
+        return self.parser.weight
+
+
+class OpenElementParser(HTMLParser):
+    # tracks the open element stack, so subclasses know when a region they entered is closed again
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+
+    def handle_starttag(self, tag, attrs):
+        self.start(tag, dict(attrs))
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.start(tag, dict(attrs))
+
+    def handle_endtag(self, tag):
+        # unbalanced markup: close everything up to the matching tag, ignore stray end tags
+        if tag not in self.stack:
+            return
+        while self.stack:
+            if self.stack.pop() == tag:
+                break
+        self.closed(len(self.stack))
+
+    def start(self, tag, attrs):
+        pass
+
+    def closed(self, depth):
+        pass
+
+
+class ListingParser(OpenElementParser):
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+        self.next_href = None
+        self.pagination = {}
+
+        self.product_depth = None  # stack depth of the open product div
+        self.title_depth = None
+        self.name_depth = None
+        self.price_depth = None
+        self.pagination_depth = None
+        self.pagination_seen = False
+        self.link_depth = None
+
+        self.name_parts = None  # None until the title link is entered
+        self.price_parts = None
+        self.href = None
+        self.link_parts = []
+        self.link_href = None
+
+    def start(self, tag, attrs):
+        class_attr = attrs.get('class')
+        depth = len(self.stack)
+
+        if self.next_href is None and tag in ('link', 'a') and 'next' in (attrs.get('rel') or '').split():
+            self.next_href = attrs.get('href')
+
+        if tag == 'div' and has_classes(class_attr, PRODUCT_CLASSES):
+            self.finish_product()
+            self.product_depth = depth
+            return
+
+        if self.product_depth is not None:
+            # like find(), only the first title / price div of a product is read
+            if tag == 'div' and has_classes(class_attr, {'product__item__title'}) and self.name_parts is None:
+                self.title_depth = depth
+            elif tag == 'div' and has_classes(class_attr, {'product__item__price-current'}) and self.price_parts is None:
+                self.price_depth = depth
+                self.price_parts = []
+            elif tag == 'a' and self.title_depth is not None and self.name_parts is None:
+                # the product name is the text of the first link in the title
+                self.name_depth = depth
+                self.name_parts = []
+                self.href = attrs.get('href')
+
+        # only the first element with a *pagination* class counts, like soup.find does
+        if not self.pagination_seen and class_attr and 'pagination' in class_attr:
+            self.pagination_seen = True
+            self.pagination_depth = depth
+        elif tag == 'a' and self.pagination_depth is not None:
+            self.link_depth = depth
+            self.link_parts = []
+            self.link_href = attrs.get('href')
+
+    def handle_data(self, data):
+        if self.name_depth is not None:
+            self.name_parts.append(data)
+        if self.price_depth is not None:
+            self.price_parts.append(data)
+        if self.link_depth is not None:
+            self.link_parts.append(data)
+
+    def closed(self, depth):
+        if self.link_depth is not None and depth <= self.link_depth:
+            text = ''.join(self.link_parts).strip()
+            if text and self.link_href and text not in self.pagination:
+                self.pagination[text] = self.link_href
+            self.link_depth = None
+        if self.pagination_depth is not None and depth <= self.pagination_depth:
+            self.pagination_depth = None
+        if self.name_depth is not None and depth <= self.name_depth:
+            self.name_depth = None
+        if self.title_depth is not None and depth <= self.title_depth:
+            self.title_depth = None
+        if self.price_depth is not None and depth <= self.price_depth:
+            self.price_depth = None
+        if self.product_depth is not None and depth <= self.product_depth:
+            self.finish_product()
+
+    def finish_product(self):
+        if self.product_depth is None:
+            return
+        name = clean_name(''.join(self.name_parts)) if self.name_parts is not None else None
+        price = clean_price(''.join(self.price_parts).strip()) if self.price_parts is not None else None
+        self.entries.append((name, price, self.href))
+
+        self.product_depth = self.title_depth = self.name_depth = self.price_depth = None
+        self.name_parts = self.price_parts = self.href = None
+
+
+class WeightFound(Exception):
+    pass
+
+
+class WeightParser(OpenElementParser):
+    # reads feature rows until the weight row is complete, then stops the parse
+    def __init__(self):
+        super().__init__()
+        self.weight = 0
+        self.item_depth = None
+        self.left_depth = None
+        self.right_depth = None
+        self.left_parts = None
+        self.right_parts = None
+
+    def start(self, tag, attrs):
+        class_attr = attrs.get('class')
+        depth = len(self.stack)
+        if tag == 'li' and has_classes(class_attr, {'feature-list-item'}):
+            self.item_depth = depth
+            self.left_parts = self.right_parts = None
+        elif self.item_depth is not None and tag == 'span':
+            if has_classes(class_attr, {'feature-list-item_left'}) and self.left_parts is None:
+                self.left_depth = depth
+                self.left_parts = []
+            elif has_classes(class_attr, {'feature-list-item_right'}) and self.right_parts is None:
+                self.right_depth = depth
+                self.right_parts = []
+
+    def handle_data(self, data):
+        if self.left_depth is not None:
+            self.left_parts.append(data)
+        if self.right_depth is not None:
+            self.right_parts.append(data)
+
+    def closed(self, depth):
+        if self.left_depth is not None and depth <= self.left_depth:
+            self.left_depth = None
+        if self.right_depth is not None and depth <= self.right_depth:
+            self.right_depth = None
+        if self.item_depth is not None and depth <= self.item_depth:
+            self.item_depth = self.left_depth = self.right_depth = None
+            if self.left_parts is not None and WEIGHT_LABEL in stripped_text(self.left_parts) \
+                    and self.right_parts is not None:
+                self.weight = stripped_text(self.right_parts)
+                raise WeightFound()
+
+
+class LxmlEngine(TreeEngine):
+    # libxml2 builds the tree in C, the lookups are xpath
+    name = 'lxml'
+
+    def __init__(self):
+        from lxml import html as lxml_html
+        self.fromstring = lxml_html.fromstring
+
+    @staticmethod
+    def class_test(name):
+        return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+    def parse_listing(self, html):
+        if not html.strip():
+            return Listing([])
+        root = self.fromstring(html)
+        entries = []
+        product_test = ' and '.join(self.class_test(name) for name in sorted(PRODUCT_CLASSES))
+        for product in root.xpath(f"//div[{product_test}]"):
+            titles = product.xpath(f".//div[{self.class_test('product__item__title')}]")
+            links = titles[0].xpath('.//a') if titles else []
+            name = clean_name(links[0].text_content()) if links else None
+
+            prices = product.xpath(f".//div[{self.class_test('product__item__price-current')}]")
+            price = clean_price(prices[0].text_content().strip()) if prices else None
+
+            entries.append((name, price, links[0].get('href') if links else None))
+
+        next_tags = root.xpath("//link[contains(concat(' ', @rel, ' '), ' next ')] | //a[contains(concat(' ', @rel, ' '), ' next ')]")
+        pagination = {}
+        blocks = root.xpath("//*[contains(@class, 'pagination')]")
+        if blocks:
+            for link in blocks[0].xpath('.//a[@href]'):
+                pagination.setdefault(link.text_content().strip(), link.get('href'))
+        return Listing(entries, next_tags[0].get('href') if next_tags else None, pagination)
+
+    def parse_product_weight(self, html):
+        if not html.strip():
+            return 0
+        root = self.fromstring(html)
+        for item in root.xpath(f"//li[{self.class_test('feature-list-item')}]"):
+            left = item.xpath(f".//span[{self.class_test('feature-list-item_left')}]")
+            if left and WEIGHT_LABEL in stripped_text(left[0].itertext()):
+                right = item.xpath(f".//span[{self.class_test('feature-list-item_right')}]")
+                if right:
+                    return stripped_text(right[0].itertext())
+        return 0
+
+
+class Bs4Engine(TreeEngine):
+    # the original BeautifulSoup + html.parser extraction, kept as the reference implementation
+    name = 'bs4'
+
+    def __init__(self):
+        from bs4 import BeautifulSoup
+        self.BeautifulSoup = BeautifulSoup
+
+    def parse_listing(self, html):
+        soup = self.BeautifulSoup(html, 'html.parser')
+        entries = []
+
+        for product in soup.find_all('div', class_='js-content product__item'):
+            name_tag = product.find('div', class_='product__item__title')
+            name = clean_name(name_tag.a.text) if name_tag and name_tag.a else None
+
+            price_tag = product.find('div', class_='product__item__price-current')
+            price = clean_price(price_tag.text.strip()) if price_tag else None
+
+            link_tag = name_tag.find('a') if name_tag else None
+            entries.append((name, price, link_tag['href'] if link_tag else None))
+
+        next_tag = soup.find('link', rel='next') or soup.find('a', rel='next')
+        pagination = {}
+        block = soup.find(class_=re.compile('pagination'))
+        if block is not None:
+            for link in block.find_all('a', href=True):
+                pagination.setdefault(link.get_text().strip(), link['href'])
+        return Listing(entries, next_tag.get('href') if next_tag else None, pagination)
+
+    def parse_product_weight(self, html):
+        soup = self.BeautifulSoup(html, 'html.parser')
+        for item in soup.find_all('li', class_='feature-list-item'):
+            left_side = item.find('span', class_='feature-list-item_left')
+            if left_side and WEIGHT_LABEL in left_side.get_text(strip=True):
+                right_side = item.find('span', class_='feature-list-item_right')
+                if right_side:
+                    return right_side.get_text(strip=True)
+        return 0
+
+
+ENGINES = {
+    'stream': StreamEngine,
+    'lxml': LxmlEngine,
+    'bs4': Bs4Engine,
+}
+
+
+def available_engines():
+    names = []
+    for name, engine_class in ENGINES.items():
+        try:
+            engine_class()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_engine(name=None):
+    # LAB1_PARSER=stream|lxml|bs4 picks a backend, default is lxml when installed, otherwise stream
+    name = name or os.environ.get('LAB1_PARSER')
+    if name:
+        if name not in ENGINES:
+            raise ValueError(f"unknown parser engine {name!r}, expected one of {', '.join(ENGINES)}")
+        return ENGINES[name]()
+    try:
+        return LxmlEngine()
+    except ImportError:
+        return StreamEngine()
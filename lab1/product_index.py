@@ -0,0 +1,61 @@
+import json
+import os
+import time
+
+# local record of every product seen by the incremental mode, persisted as json
+#
+#   link -> {"name", "price_mdl", "weight", "root", "last_seen", "weight_checked"}
+#
+# weight_checked is when the product page was last fetched, that is what makes an entry stale.
+
+
+class ProductIndex:
+    def __init__(self, path, max_age=7 * 24 * 3600):
+        self.path = path
+        self.max_age = max_age
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        # write to a temp file and rename, so a crash never leaves a half-written index
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.path)
+
+    def get(self, link):
+        return self.entries.get(link)
+
+    def needs_weight(self, link, price, in_range, now=None):
+        # only in-range products need a weight; refetch when the price just moved into range,
+        # when we never saw a weight for it, or when the last product page fetch is too old
+        if not in_range(price):
+            return False
+        entry = self.entries.get(link)
+        if entry is None or entry.get("weight") is None or not in_range(entry["price_mdl"]):
+            return True
+        now = now if now is not None else time.time()
+        return now - entry.get("weight_checked", 0) >= self.max_age
+
+    def update(self, link, name, price, root, weight=None, now=None):
+        # records a listing sighting; weight is only passed when the product page was fetched
+        now = now if now is not None else time.time()
+        entry = self.entries.setdefault(link, {"weight": None, "weight_checked": 0})
+        entry.update(name=name, price_mdl=price, root=root, last_seen=now)
+        if weight is not None:
+            entry["weight"] = weight
+            entry["weight_checked"] = now
+        return entry
+
+    def remove(self, link):
+        return self.entries.pop(link, None)
+
+    def links_under(self, roots):
+        return [link for link, entry in self.entries.items() if entry.get("root") in roots]
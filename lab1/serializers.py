@@ -0,0 +1,490 @@
+import codecs
+import json
+import struct
+from itertools import islice
+from json.encoder import encode_basestring
+from xml.sax.saxutils import escape
+
+# serializers for the lab1 result, every format comes in three flavours:
+#
+#   iter_<format>(value)            generator of string pieces, nothing is held beyond the current value
+#   write_<format>(value, out)      writes the pieces to any object with write(), in batches
+#   dumps_<format>(value)           the whole document as one string
+#
+# lists may also be given as any other iterable (e.g. a generator of products), they are consumed
+# lazily, which is what lets a huge result go straight to a file.
+#
+# the custom format can be read back with loads_custom / CustomDecoder, and has a binary variant
+# (dumps_custom_binary / loads_custom_binary / CustomBinaryDecoder) further down.
+
+# pieces are joined and written in batches of this many, one write() per piece is too slow
+WRITE_BATCH = 512
+
+# values are encoded by the C encoder of the json module, a list at a time at most
+JSON_BATCH = 256
+
+
+def materialize(value):
+    # iterators nested inside a value handed to the encoder are written as lists
+    if is_sequence(value):
+        return list(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+encode = json.JSONEncoder(ensure_ascii=False, check_circular=False, allow_nan=False, default=materialize).encode
+
+
+def write_pieces(pieces, out):
+    batch = []
+    for piece in pieces:
+        batch.append(piece)
+        if len(batch) >= WRITE_BATCH:
+            out.write(''.join(batch))
+            batch.clear()
+    if batch:
+        out.write(''.join(batch))
+
+
+def is_sequence(value):
+    # anything iterable that is not a string / mapping / bytes is written as a list
+    return not isinstance(value, (str, bytes, bytearray, dict)) and hasattr(value, '__iter__')
+
+
+def iter_json(value):
+    # same output as json.dumps(value, ensure_ascii=False); the top level dicts and lists are walked
+    # here so a long list (or a generator) is encoded and written JSON_BATCH items at a time
+    if isinstance(value, dict):
+        yield '{'
+        first = True
+        for key, item in value.items():
+            yield ('{}: ' if first else ', {}: ').format(encode_basestring(key if isinstance(key, str) else str(key)))
+            first = False
+            yield from iter_json(item)
+        yield '}'
+    elif is_sequence(value):
+        yield '['
+        items = iter(value)
+        first = True
+        while True:
+            batch = list(islice(items, JSON_BATCH))
+            if not batch:
+                break
+            # encode the batch as one list and drop its brackets
+            yield ('' if first else ', ') + encode(batch)[1:-1]
+            first = False
+        yield ']'
+    else:
+        yield encode(value)
+
+
+def write_json(value, out):
+    write_pieces(iter_json(value), out)
+
+
+def dumps_json(value):
+    return ''.join(iter_json(value))
+
+
+def escape_xml(value):
+    text = str(value)
+    # most values have nothing to escape, checking is cheaper than three replace() calls
+    if '&' in text or '<' in text or '>' in text:
+        return escape(text)
+    return text
+
+
+def iter_xml(result):
+    # the lab1 result document, text content is escaped
+    yield '<result>\n'
+    yield f"  <total_sum_mdl>{escape_xml(result['total_sum_mdl'])}</total_sum_mdl>\n"
+    yield f"  <timestamp_utc>{escape_xml(result['timestamp_utc'])}</timestamp_utc>\n"
+    yield '  <filtered_products>\n'
+    for product in result['filtered_products']:
+        yield (
+            '    <product>\n'
+            f"      <name>{escape_xml(product['name'])}</name>\n"
+            f"      <price_mdl>{escape_xml(product['price_mdl'])}</price_mdl>\n"
+            f"      <price_eur>{escape_xml(product['price_eur'])}</price_eur>\n"
+            f"      <link>{escape_xml(product['link'])}</link>\n"
+            '    </product>\n'
+        )
+    yield '  </filtered_products>\n'
+    yield '</result>'
+
+
+def write_xml(result, out):
+    write_pieces(iter_xml(result), out)
+
+
+def dumps_xml(result):
+    return ''.join(iter_xml(result))
+
+
+CUSTOM_TAGS = {str: 'STR:', int: 'INT:', float: 'FLOAT:'}
+
+
+def iter_custom(data, indent=0):
+    # DICT:/LIST:/STR:/INT:/FLOAT: lines, without the line break after the last one of a piece
+    prefix = '  ' * indent
+    if isinstance(data, dict) and all(type(value) in (str, int, float) for value in data.values()):
+        # flat dicts (a product) come out as one multi-line piece
+        lines = [prefix + 'DICT:']
+        for key, value in data.items():
+            lines.append(f"{prefix}  {key}=")
+            lines.append(f"{prefix}    {CUSTOM_TAGS[type(value)]}{value}")
+        lines.append(prefix + ':ENDDICT')
+        yield '\n'.join(lines)
+    elif isinstance(data, dict):
+        yield prefix + 'DICT:'
+        for key, value in data.items():
+            yield prefix + '  ' + str(key) + '='
+            yield from iter_custom(value, indent + 2)
+        yield prefix + ':ENDDICT'
+    elif isinstance(data, str):
+        yield prefix + 'STR:' + data
+    elif isinstance(data, int):
+        yield prefix + 'INT:' + str(data)
+    elif isinstance(data, float):
+        yield prefix + 'FLOAT:' + str(data)
+    elif is_sequence(data):
+        yield prefix + 'LIST:'
+        for item in data:
+            yield from iter_custom(item, indent + 1)
+        yield prefix + ':ENDLIST'
+    else:
+        raise ValueError('Unsupported data type: {}'.format(type(data)))
+
+
+def write_custom(data, out):
+    # lines are joined per batch, the batches themselves need a line break between them
+    first = True
+    batch = []
+    for line in iter_custom(data):
+        batch.append(line)
+        if len(batch) >= WRITE_BATCH:
+            out.write(('' if first else '\n') + '\n'.join(batch))
+            first = False
+            batch.clear()
+    if batch:
+        out.write(('' if first else '\n') + '\n'.join(batch))
+
+
+def dumps_custom(data):
+    return '\n'.join(iter_custom(data))
+
+
+class CustomDecoder:
+    # incremental, iterative parser for the custom format: feed() text (or utf-8 bytes) in any pieces,
+    # every complete top-level value is returned as soon as its last line has arrived
+    def __init__(self):
+        self.containers = []  # open DICT: / LIST: values, innermost last
+        self.keys = []  # per open container: the dict key waiting for its value, None otherwise
+        # parse_lines keeps the innermost one in locals and puts it back here when it returns
+        self.values = []
+        self.partial = ''  # the last line, until its line break arrives
+        self.bytes_decoder = None
+
+    def feed(self, data):
+        if not isinstance(data, str):
+            if self.bytes_decoder is None:
+                self.bytes_decoder = codecs.getincrementaldecoder('utf-8')()
+            data = self.bytes_decoder.decode(data)
+        lines = (self.partial + data).split('\n') if self.partial else data.split('\n')
+        self.partial = lines.pop()
+        self.parse_lines(lines)
+        return self.take()
+
+    def take(self):
+        values, self.values = self.values, []
+        return values
+
+    def close(self):
+        if self.bytes_decoder is not None:
+            self.partial += self.bytes_decoder.decode(b'', final=True)
+        if self.partial:
+            self.parse_lines([self.partial])
+            self.partial = ''
+        if self.containers:
+            raise ValueError('expected :ENDDICT' if type(self.containers[-1]) is dict else 'expected :ENDLIST')
+        return self.take()
+
+    def parse_lines(self, lines):
+        # one flat loop with the innermost container and its pending key in locals, this is the hot path
+        containers, keys, values = self.containers, self.keys, self.values
+        current = containers.pop() if containers else None
+        key = keys.pop() if keys else None
+        in_dict = type(current) is dict
+        for line in lines:
+            line = line.strip()
+            if in_dict and key is None:
+                if '=' in line and line != ':ENDDICT':  # it's a key/value pair
+                    key = line.rstrip('=').strip()
+                    continue
+                if line != ':ENDDICT':
+                    raise ValueError('invalid dictionary entry: ' + line)
+                # the container is finished, the enclosing one becomes current again
+                value = current
+                current = containers.pop() if containers else None
+                key = keys.pop() if keys else None
+                in_dict = type(current) is dict
+            elif line.startswith('STR:'):
+                value = line[4:]
+            elif line.startswith('INT:'):
+                value = int(line[4:])
+            elif line.startswith('FLOAT:'):
+                value = float(line[6:])
+            elif line == 'DICT:' or line == 'LIST:':
+                if current is not None:
+                    containers.append(current)
+                    keys.append(key)
+                current = {} if line == 'DICT:' else []
+                in_dict = line == 'DICT:'
+                key = None
+                continue
+            elif line == ':ENDLIST' and current is not None and not in_dict:
+                value = current
+                current = containers.pop() if containers else None
+                key = keys.pop() if keys else None
+                in_dict = type(current) is dict
+            else:
+                raise ValueError('unknown type or invalid line:  ' + line)
+
+            # the finished value goes into the current container, or out as a top-level value
+            if current is None:
+                values.append(value)
+            elif in_dict:
+                current[key] = value
+                key = None
+            else:
+                current.append(value)
+
+        if current is not None:
+            containers.append(current)
+            keys.append(key)
+
+
+def loads_custom(data):
+    decoder = CustomDecoder()
+    values = decoder.feed(data)
+    values += decoder.close()
+    if not values:
+        raise ValueError('unexpected end of input')
+    return values[0]
+
+
+# compact binary variant of the custom format, every value is a one byte tag:
+#
+#   D <S key> <value> ... E   dict, keys are strings
+#   L <value> ... E           list
+#   S <varint length><utf-8>  string
+#   I <zigzag varint>         int of any size
+#   F <8 byte big endian>     float
+#
+# lengths are prefixed, so decoding never searches for a terminator
+
+BINARY_DICT, BINARY_LIST, BINARY_END = b'D'[0], b'L'[0], b'E'[0]
+BINARY_STR, BINARY_INT, BINARY_FLOAT = b'S'[0], b'I'[0], b'F'[0]
+BINARY_PIECE = 64 * 1024
+pack_float = struct.Struct('>d').pack
+unpack_float = struct.Struct('>d').unpack_from
+
+
+def encode_varint(value, out):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_binary_str(text, out):
+    data = text.encode('utf-8')
+    encode_varint(len(data), out)
+    out += data
+
+
+END_OF_ITEMS = object()
+
+
+def iter_custom_binary(data):
+    # bytes pieces of about BINARY_PIECE bytes; containers are walked with an explicit stack of
+    # iterators, so nesting depth is not limited by recursion and generators are streamed
+    out = bytearray()
+    stack = [(iter((data,)), False)]
+    while stack:
+        items, is_dict = stack[-1]
+        entry = next(items, END_OF_ITEMS)
+        if entry is END_OF_ITEMS:
+            stack.pop()
+            if stack:
+                out.append(BINARY_END)
+            continue
+        if is_dict:
+            key, item = entry
+            out.append(BINARY_STR)
+            encode_binary_str(str(key), out)
+        else:
+            item = entry
+
+        if isinstance(item, dict):
+            out.append(BINARY_DICT)
+            stack.append((iter(item.items()), True))
+        elif isinstance(item, str):
+            out.append(BINARY_STR)
+            encode_binary_str(item, out)
+        elif isinstance(item, int):
+            out.append(BINARY_INT)
+            encode_varint(item << 1 if item >= 0 else ((-item) << 1) - 1, out)
+        elif isinstance(item, float):
+            out.append(BINARY_FLOAT)
+            out += pack_float(item)
+        elif is_sequence(item):
+            out.append(BINARY_LIST)
+            stack.append((iter(item), False))
+        else:
+            raise ValueError('Unsupported data type: {}'.format(type(item)))
+
+        if len(out) >= BINARY_PIECE:
+            yield bytes(out)
+            out.clear()
+    if out:
+        yield bytes(out)
+
+
+def write_custom_binary(data, out):
+    for piece in iter_custom_binary(data):
+        out.write(piece)
+
+
+def dumps_custom_binary(data):
+    return b''.join(iter_custom_binary(data))
+
+
+class CustomBinaryDecoder:
+    # incremental decoder for the binary variant, same interface as CustomDecoder
+    def __init__(self):
+        self.containers = []
+        self.keys = []
+        self.values = []
+        self.buffer = b''  # the unfinished token at the end of the last feed
+
+    def feed(self, data):
+        buffer = self.buffer + bytes(data) if self.buffer else bytes(data)
+        pos = self.parse(buffer)
+        # only the unfinished token is kept
+        self.buffer = buffer[pos:]
+        return self.take()
+
+    def take(self):
+        values, self.values = self.values, []
+        return values
+
+    def close(self):
+        if self.buffer:
+            raise ValueError('truncated input')
+        if self.containers:
+            raise ValueError('expected end of dict' if type(self.containers[-1]) is dict else 'expected end of list')
+        return self.take()
+
+    def parse(self, buffer):
+        # decodes every complete token, returns where the first incomplete one starts
+        containers, keys, values = self.containers, self.keys, self.values
+        current = containers.pop() if containers else None
+        key = keys.pop() if keys else None
+        in_dict = type(current) is dict
+        end = len(buffer)
+        pos = 0
+        try:
+            while pos < end:
+                start = pos
+                tag = buffer[pos]
+                pos += 1
+
+                if tag == BINARY_STR:
+                    # one byte lengths are by far the most common, skip the varint loop for them
+                    length = buffer[pos] if pos < end else 0x80
+                    if length < 0x80:
+                        pos += 1
+                    else:
+                        length, pos = read_varint(buffer, pos, end)
+                        if length is None:
+                            return start
+                    if pos + length > end:
+                        return start
+                    value = buffer[pos:pos + length].decode('utf-8')
+                    pos += length
+                    if in_dict and key is None:
+                        key = value
+                        continue
+                elif in_dict and key is None:
+                    if tag != BINARY_END:
+                        raise ValueError(f'expected a dict key at byte {start}')
+                    value = current
+                    current = containers.pop() if containers else None
+                    key = keys.pop() if keys else None
+                    in_dict = type(current) is dict
+                elif tag == BINARY_INT:
+                    value = buffer[pos] if pos < end else 0x80
+                    if value < 0x80:
+                        pos += 1
+                    else:
+                        value, pos = read_varint(buffer, pos, end)
+                        if value is None:
+                            return start
+                    value = value >> 1 if not value & 1 else -((value + 1) >> 1)
+                elif tag == BINARY_FLOAT:
+                    if pos + 8 > end:
+                        return start
+                    value = unpack_float(buffer, pos)[0]
+                    pos += 8
+                elif tag == BINARY_DICT or tag == BINARY_LIST:
+                    if current is not None:
+                        containers.append(current)
+                        keys.append(key)
+                    current = {} if tag == BINARY_DICT else []
+                    in_dict = tag == BINARY_DICT
+                    key = None
+                    continue
+                elif tag == BINARY_END and current is not None:
+                    value = current
+                    current = containers.pop() if containers else None
+                    key = keys.pop() if keys else None
+                    in_dict = type(current) is dict
+                else:
+                    raise ValueError(f'unknown tag {tag!r} at byte {start}')
+
+                if current is None:
+                    values.append(value)
+                elif in_dict:
+                    current[key] = value
+                    key = None
+                else:
+                    current.append(value)
+            return pos
+        finally:
+            if current is not None:
+                containers.append(current)
+                keys.append(key)
+
+
+def read_varint(buffer, pos, end):
+    # (value, position after it), value is None when the varint is cut off
+    if pos < end and buffer[pos] < 0x80:
+        return buffer[pos], pos + 1
+    value = shift = 0
+    while pos < end:
+        byte = buffer[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+    return None, pos
+
+
+def loads_custom_binary(data):
+    decoder = CustomBinaryDecoder()
+    values = decoder.feed(data)
+    values += decoder.close()
+    if not values:
+        raise ValueError('unexpected end of input')
+    return values[0]
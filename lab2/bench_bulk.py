@@ -0,0 +1,62 @@
+# rows/sec of the single-row POST /product against POST /products/bulk (JSON array and NDJSON)
+# on a throwaway SQLite database, or on the database in DATABASE_URL when it is set
+#
+#   python bench_bulk.py [rows]
+import json
+import os
+import sys
+import tempfile
+import time
+
+directory = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(directory, 'bench.db')}")
+
+from lab2 import app  # noqa: E402  (the app reads DATABASE_URL at import)
+
+
+def make_rows(count):
+    return [
+        {
+            "name": f"Karcher K{i} Compact",
+            "weight": 4.1 + i % 5,
+            "price_mdl": 1000 + i % 700,
+            "price_eur": round((1000 + i % 700) / 19.242, 2),
+            "link": f"https://maximum.md/ro/p/{i}/",
+        }
+        for i in range(count)
+    ]
+
+
+def run(name, count, send):
+    start = time.perf_counter()
+    send()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<22} {count / elapsed:>10.1f} rows/s")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rows = make_rows(count)
+    client = app.test_client()
+
+    def single():
+        for row in rows:
+            assert client.post("/product", json=row).status_code == 201
+
+    def bulk_json():
+        response = client.post("/products/bulk", json=rows)
+        assert response.status_code == 201, response.get_json()
+
+    def bulk_ndjson():
+        body = "\n".join(json.dumps(row) for row in rows)
+        response = client.post("/products/bulk", data=body, content_type="application/x-ndjson")
+        assert response.status_code == 201, response.get_json()
+
+    print(f"{count} rows, {app.config['SQLALCHEMY_DATABASE_URI']}")
+    run("single-row POST", count, single)
+    run("bulk, JSON array", count, bulk_json)
+    run("bulk, NDJSON", count, bulk_ndjson)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# broadcast throughput and delivery latency of the chat server with thousands of local websocket
+# clients in one room, a few of them sending and some never reading (slow consumers). the
+# server's CHAT_* settings are taken from the environment, BENCH_SEND_INTERVAL sets the pace
+#
+#   python bench_chat.py [clients] [messages per sender] [slow clients] [server script]
+#
+# the server (chat.py by default) runs as its own process on a free port
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from websockets.asyncio.client import connect
+
+SENDERS = 10
+# seconds between two messages of one sender: SENDERS / SEND_INTERVAL messages/s into the room,
+# kept under what the clients can take so latency measures delivery rather than a backlog
+SEND_INTERVAL = float(os.environ.get("BENCH_SEND_INTERVAL", 2.0))
+ROOM = "bench"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def joined(url):
+    websocket = await connect(url, max_queue=None)
+    await websocket.send(json.dumps({"action": "join", "room": ROOM}))
+    await websocket.recv()
+    return websocket
+
+
+async def receive(websocket, expected, latencies, frames, deadline):
+    # latency of every broadcast this client gets, until it has them all or time is up;
+    # frames counts the websocket frames they came in (fewer than messages with CHAT_BATCH_WINDOW)
+    received = 0
+    try:
+        while received < expected:
+            frame = json.loads(await asyncio.wait_for(websocket.recv(), deadline - time.perf_counter()))
+            now = time.perf_counter()
+            frames[0] += 1
+            for message in frame.get("batch") or [frame]:
+                latencies.append(now - float(message["message"]))
+                received += 1
+    except (asyncio.TimeoutError, ValueError):
+        pass
+    return received
+
+
+async def run(url, clients, messages, slow):
+    # the websockets client reads frames in the background until max_queue is full, then stops,
+    # so a connection nobody calls recv() on backs up like a slow reader over a bad network
+    async with connect(url) as owner:
+        await owner.send(json.dumps({"action": "create", "room": ROOM}))
+        await owner.recv()
+
+        readers = []
+        for first in range(0, clients, 200):
+            readers += await asyncio.gather(*(joined(url) for _ in range(first, min(first + 200, clients))))
+        stalled = []
+        for _ in range(slow):
+            websocket = await connect(url, max_queue=1)
+            await websocket.send(json.dumps({"action": "join", "room": ROOM}))
+            stalled.append(websocket)
+
+        senders, readers = readers[:SENDERS], readers[SENDERS:]
+        latencies = []
+        frames = [0]
+        start = time.perf_counter()
+        deadline = start + messages * SEND_INTERVAL + 60
+        receiving = [asyncio.create_task(receive(r, SENDERS * messages, latencies, frames, deadline)) for r in readers]
+
+        async def send(websocket):
+            for _ in range(messages):
+                await websocket.send(json.dumps({"action": "message", "message": repr(time.perf_counter())}))
+                await asyncio.sleep(SEND_INTERVAL)
+
+        await asyncio.gather(*(send(s) for s in senders))
+        sent = time.perf_counter() - start
+        received = sum(await asyncio.gather(*receiving))
+        elapsed = time.perf_counter() - start
+
+        # a late joiner gets the room's recent messages in one frame
+        async with connect(url) as late:
+            await late.send(json.dumps({"action": "join", "room": ROOM}))
+            history = None
+            while history is None:
+                # the join reply and the history may come batched in one frame
+                frame = json.loads(await asyncio.wait_for(late.recv(), 5))
+                for message in frame.get("batch") or [frame]:
+                    history = message.get("history", history)
+
+        await asyncio.gather(*(websocket.close() for websocket in senders + readers))
+        for websocket in stalled:
+            websocket.transport.abort()
+
+    latencies.sort()
+    expected = len(readers) * SENDERS * messages
+    print(f"{clients} clients ({slow} slow), {SENDERS} senders x {messages} messages")
+    print(f"  messages sent in {sent:.2f} s, all delivered in {elapsed:.2f} s")
+    print(f"  {received}/{expected} deliveries in {frames[0]} frames, {received / elapsed:.0f} deliveries/s")
+    if latencies:
+        print(f"  latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms, "
+              f"max {latencies[-1] * 1000:.1f} ms")
+    print(f"  late joiner got {len(history)} messages of history")
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    slow = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    script = sys.argv[4] if len(sys.argv) > 4 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat.py")
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, script], env={**os.environ, "CHAT_HOST": "127.0.0.1", "CHAT_PORT": str(port)},
+                              stdout=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port)).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        asyncio.run(run(f"ws://127.0.0.1:{port}", clients, messages, slow))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
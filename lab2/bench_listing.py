@@ -0,0 +1,97 @@
+# responses/sec and peak python memory of GET /product at limit=10k in each format, against the
+# old ORM-instances-to-dicts path, on a throwaway SQLite database, or on DATABASE_URL when it is set
+#
+#   python bench_listing.py [rows] [requests]
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+directory = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(directory, 'bench.db')}")
+# every request below has to reach the database, not the page cache
+os.environ.setdefault("PRODUCT_CACHE_TTL", "0")
+
+from flask import jsonify  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from lab2 import Product, app, db, product_to_dict  # noqa: E402  (the app reads DATABASE_URL at import)
+
+LIMIT = 10000
+
+
+def populate(count):
+    with app.app_context():
+        db.session.execute(insert(Product), [
+            {
+                "name": f"Karcher K{i % 1000} \"Compact\" {i}",
+                "weight": 1 + i % 40 / 4,
+                "price_mdl": 500 + i % 2500,
+                "price_eur": round((500 + i % 2500) / 19.242, 2),
+                "link": f"https://maximum.md/ro/p/{i}/",
+            }
+            for i in range(count)
+        ])
+        db.session.commit()
+
+
+# the way GET /product used to build a page, returns the body size
+def old_page():
+    with app.test_request_context():
+        products = Product.query.order_by(Product.id).limit(LIMIT).all()
+        return len(jsonify({"products": [product_to_dict(product) for product in products]}).get_data())
+
+
+def run(name, requests, get):
+    get()  # warm up
+    start = time.perf_counter()
+    for _ in range(requests):
+        get()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    size = get()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:<14} {requests / elapsed:>8.1f} responses/s {peak / 1e6:>8.1f} MB peak {size / 1e6:>6.2f} MB body")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    with app.app_context():
+        existing = db.session.query(Product).count()
+    if existing < count:
+        populate(count - existing)
+
+    client = app.test_client()
+
+    def get(response_format):
+        # iterates the streamed body the way a WSGI server would, without joining it; returns its size
+        def fetch():
+            response = client.get(f"/product?limit={LIMIT}&format={response_format}", buffered=False)
+            size = 0
+            for chunk in response.response:
+                size += len(chunk)
+            response.close()
+            return size
+        return fetch
+
+    # all formats carry the same products as the old path
+    with app.test_request_context():
+        old = [product_to_dict(product) for product in Product.query.order_by(Product.id).limit(LIMIT)]
+    assert client.get(f"/product?limit={LIMIT}").get_json()["products"] == old
+    ndjson = client.get(f"/product?limit={LIMIT}&format=ndjson").get_data(as_text=True)
+    assert [json.loads(line) for line in ndjson.splitlines()] == old
+    columnar = client.get(f"/product?limit={LIMIT}&format=columnar").get_json()
+    assert [dict(zip(columnar["columns"], row)) for row in zip(*(columnar[c] for c in columnar["columns"]))] == old
+
+    print(f"{count} rows, limit={LIMIT}, {app.config['SQLALCHEMY_DATABASE_URI']}")
+    run("old ORM+dicts", requests, old_page)
+    for response_format in ("json", "ndjson", "columnar"):
+        run(response_format, requests, get(response_format))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# load test of the product endpoints of a running lab2 server: a fixed number of keep-alive
+# clients hit a mix of requests for a while, then req/s and p50/p99 latency per endpoint are printed
+#
+#   python bench_load.py [url] [seconds] [clients]
+#
+# e.g. against gunicorn -c gunicorn.conf.py lab2:app, or python lab2.py for comparison
+import base64
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+SEED_PRODUCTS = 5000
+
+
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+
+def encode_cursor(product_id):
+    # the cursor of the page after product_id, like lab2.encode_cursor without importing the app
+    return base64.urlsafe_b64encode(json.dumps(product_id).encode()).decode()
+
+
+def seed(host, port):
+    # enough products for the listing and lookup requests to do real work; returns the known ids
+    connection = http.client.HTTPConnection(host, port)
+    connection.request("GET", f"/product?limit={SEED_PRODUCTS}&format=columnar")
+    ids = json.loads(connection.getresponse().read())["id"]
+    if len(ids) < SEED_PRODUCTS:
+        rows = [
+            {
+                "name": f"Karcher K{i} Compact",
+                "weight": 1 + i % 40 / 4,
+                "price_mdl": 500 + i % 2500,
+                "price_eur": round((500 + i % 2500) / 19.242, 2),
+                "link": f"https://maximum.md/ro/p/{i}/",
+            }
+            for i in range(SEED_PRODUCTS - len(ids))
+        ]
+        connection.request("POST", "/products/bulk", json.dumps(rows), {"Content-Type": "application/json"})
+        results = json.loads(connection.getresponse().read())["results"]
+        ids += [row["id"] for row in results if row["status"] == "created"]
+    connection.close()
+    return ids
+
+
+def make_requests(ids):
+    # (endpoint label, method, path, body) generators, picked at random in proportion to their weight
+    def listing():
+        return "GET /product?limit=100", "GET", f"/product?limit=100&cursor={encode_cursor(random.choice(ids))}", None
+
+    def filtered():
+        low = random.randrange(500, 3000)
+        return "GET /product filtered", "GET", f"/product?limit=50&min_price_mdl={low}&max_price_mdl={low + 50}", None
+
+    def lookup():
+        return "GET /product/<id>", "GET", f"/product/{random.choice(ids)}", None
+
+    def update():
+        product_id = random.choice(ids)
+        return "PUT /product/<id>", "PUT", f"/product/{product_id}", json.dumps({"price_mdl": random.randrange(500, 3000)})
+
+    return [(listing, 4), (filtered, 2), (lookup, 6), (update, 1)]
+
+
+def client(host, port, requests, deadline, results, lock):
+    connection = http.client.HTTPConnection(host, port)
+    generators = [generator for generator, _ in requests]
+    weights = [weight for _, weight in requests]
+    local = {}
+    while time.perf_counter() < deadline:
+        label, method, path, body = random.choices(generators, weights)[0]()
+        headers = {"Content-Type": "application/json"} if body else {}
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection(host, port)
+            ok = False
+        latencies, errors = local.setdefault(label, ([], [0]))
+        latencies.append(time.perf_counter() - start)
+        if not ok:
+            errors[0] += 1
+    connection.close()
+    with lock:
+        for label, (latencies, errors) in local.items():
+            total = results.setdefault(label, ([], [0]))
+            total[0].extend(latencies)
+            total[1][0] += errors[0]
+
+
+def main():
+    url = urlsplit(sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:5000")
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    clients = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+    host, port = url.hostname, url.port or 80
+
+    requests = make_requests(seed(host, port))
+    results = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=client, args=(host, port, requests, deadline, results, lock))
+               for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f"{url.geturl()}, {clients} clients, {seconds:.0f} s")
+    print(f"{'endpoint':<24} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    total = 0
+    for label, (latencies, errors) in sorted(results.items()):
+        latencies.sort()
+        total += len(latencies)
+        print(f"{label:<24} {len(latencies):>9} {len(latencies) / seconds:>8.1f} "
+              f"{percentile(latencies, 0.5) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} {errors[0]:>7}")
+    print(f"{'total':<24} {total:>9} {total / seconds:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
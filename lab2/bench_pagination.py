@@ -0,0 +1,111 @@
+# offset vs keyset pagination of GET /product on a large table, plus the query plans behind them
+# on a throwaway SQLite database, or on the database in DATABASE_URL when it is set
+#
+#   python bench_pagination.py [rows]
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+directory = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(directory, 'bench.db')}")
+
+from sqlalchemy import insert, text  # noqa: E402
+from werkzeug.datastructures import MultiDict  # noqa: E402
+
+from lab2 import Product, app, db, encode_cursor, filtered_products, product_filters  # noqa: E402  (the app reads DATABASE_URL at import)
+
+INSERT_BATCH = 50000
+
+
+def populate(count):
+    start = datetime(2024, 1, 1)
+    with app.app_context():
+        for first in range(0, count, INSERT_BATCH):
+            db.session.execute(insert(Product), [
+                {
+                    "name": f"Karcher K{i % 1000} Compact {i}",
+                    "weight": 1 + i % 40 / 4,
+                    "price_mdl": 500 + i % 2500,
+                    "price_eur": round((500 + i % 2500) / 19.242, 2),
+                    "link": f"https://maximum.md/ro/p/{i}/",
+                    "created_at": start + timedelta(seconds=i),
+                }
+                for i in range(first, min(first + INSERT_BATCH, count))
+            ])
+            db.session.commit()
+
+
+def timed_get(client, url):
+    start = time.perf_counter()
+    response = client.get(url)
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.get_json()
+    return elapsed, response.get_json()
+
+
+def explain(args, after_id, index=None):
+    # plan of the keyset query GET /product would run for these filters, and whether it uses the
+    # index named (the primary key when there is none: the unfiltered walk is an id range scan)
+    with app.app_context():
+        query = filtered_products(product_filters(MultiDict(args))).filter(Product.id > after_id).order_by(Product.id).limit(100)
+        sql = str(query.statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+        prefix = "EXPLAIN QUERY PLAN " if db.engine.dialect.name == "sqlite" else "EXPLAIN "
+        rows = db.session.execute(text(prefix + sql)).all()
+    plan = "\n".join("    " + " ".join(str(column) for column in row) for row in rows)
+    if index is None:
+        index = "primary key"
+        uses_index = "PRIMARY KEY" in plan or "products_pkey" in plan
+    else:
+        uses_index = index in plan
+    print(f"  {args or 'no filters'}: {'uses ' + index if uses_index else 'does NOT use ' + index}\n{plan}")
+    return uses_index
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    limit = 100
+    with app.app_context():
+        existing = db.session.query(Product).count()
+    if existing < count:
+        print(f"inserting {count - existing} rows ...")
+        populate(count - existing)
+
+    client = app.test_client()
+    print(f"{count} rows, limit={limit}, {app.config['SQLALCHEMY_DATABASE_URI']}")
+    print(f"{'depth':>10} {'offset ms':>10} {'keyset ms':>10}")
+    for depth in (0, count // 10, count // 2, count - 2 * limit):
+        offset_time, offset_page = timed_get(client, f"/product?limit={limit}&offset={depth}")
+        # the cursor of a page is just the last id on the previous one
+        last_id = offset_page["products"][0]["id"] - 1
+        cursor = encode_cursor(last_id)
+        keyset_time, keyset_page = timed_get(client, f"/product?limit={limit}&cursor={cursor}")
+        assert keyset_page["products"] == offset_page["products"]
+        print(f"{depth:>10} {offset_time * 1000:>10.1f} {keyset_time * 1000:>10.1f}")
+
+    # walking the whole catalog with cursors, like the dashboards do
+    pages = 0
+    url = "/product?limit=1000"
+    start = time.perf_counter()
+    while url:
+        _, page = timed_get(client, url)
+        pages += 1
+        url = f"/product?limit=1000&cursor={page['next_cursor']}" if page["next_cursor"] else None
+    print(f"full keyset walk: {pages} pages in {time.perf_counter() - start:.1f} s")
+
+    print("query plans:")
+    results = [
+        explain({}, count // 2),
+        explain({"min_price_mdl": "1000", "max_price_mdl": "1010"}, 0, "ix_products_price_mdl"),
+        # a lone lower bound matching a good part of the table is rightly planned as the id walk:
+        # ORDER BY id LIMIT finds a page of matches long before the index range would be sorted
+        explain({"min_weight": "10.5", "max_weight": "10.75"}, 0, "ix_products_weight"),
+        explain({"name_prefix": "Karcher K99"}, 0, "ix_products_name_prefix"),
+    ]
+    if not all(results):
+        sys.exit("a filter is not served by its index")
+
+
+if __name__ == "__main__":
+    main()
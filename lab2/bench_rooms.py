@@ -0,0 +1,77 @@
+# join / leave churn and broadcast iteration in one big room: the old dict of lists against
+# chat.RoomRegistry, with plain objects standing in for connections
+#
+#   python bench_rooms.py [members] [churn operations]
+import random
+import sys
+import time
+
+from chat import RoomRegistry
+
+
+class ListRooms:
+    # the way chat_rooms used to work
+    def __init__(self):
+        self.rooms = {}
+
+    def create(self, name):
+        self.rooms[name] = []
+
+    def join(self, name, client):
+        self.rooms[name].append(client)
+
+    def leave(self, name, client):
+        self.rooms[name].remove(client)
+
+    def members(self, name):
+        return self.rooms[name]
+
+
+class Registry(RoomRegistry):
+    # rooms exist as soon as someone joins
+    def create(self, name):
+        pass
+
+    def members(self, name):
+        return self.rooms[name].members
+
+
+def run(name, rooms, members, operations):
+    clients = [object() for _ in range(members)]
+    rooms.create("big")
+    start = time.perf_counter()
+    for client in clients:
+        rooms.join("big", client)
+    joined = time.perf_counter() - start
+
+    random.seed(1)
+    inside = list(clients)
+    start = time.perf_counter()
+    for _ in range(operations):
+        client = inside[random.randrange(len(inside))]
+        rooms.leave("big", client)
+        rooms.join("big", client)
+    churn = time.perf_counter() - start
+
+    sender = clients[0]
+    start = time.perf_counter()
+    for _ in range(100):
+        for user in rooms.members("big"):
+            if user is not sender:
+                pass
+    broadcast = (time.perf_counter() - start) / 100
+
+    print(f"{name:<14} join {joined * 1000:>8.1f} ms   churn {operations / churn:>12.0f} ops/s   "
+          f"broadcast loop {broadcast * 1000:>6.2f} ms")
+
+
+def main():
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    operations = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    print(f"{members} members, {operations} leave + join")
+    run("list", ListRooms(), members, operations)
+    run("RoomRegistry", Registry(), members, operations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# rows/sec and peak python memory of POST /upload?mode=import against the old save-parse-echo
+# /upload, for a generated product dump, on a throwaway SQLite database or on DATABASE_URL
+#
+#   python bench_upload.py [products]
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+directory = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(directory, 'bench.db')}")
+
+from lab2 import app  # noqa: E402  (the app reads DATABASE_URL at import)
+
+
+def write_dump(path, count):
+    # written one product at a time, the dump is never in memory here either
+    with open(path, "w") as f:
+        f.write("[")
+        for i in range(count):
+            f.write(("," if i else "") + json.dumps({
+                "name": f"Karcher K{i} Compact",
+                "weight": 4.1 + i % 5,
+                "price_mdl": 1000 + i % 700,
+                "price_eur": round((1000 + i % 700) / 19.242, 2),
+                "link": f"https://maximum.md/ro/p/{i}/",
+            }))
+        f.write("]")
+
+
+def run(name, count, path, url):
+    client = app.test_client()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        response = client.post(url, data={"file": (f, "dump.json")})
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert response.status_code == 201, response.get_json()
+    print(f"{name:<22} {count / elapsed:>10.1f} rows/s {peak / 1e6:>8.1f} MB peak "
+          f"{len(response.get_data()) / 1e6:>8.2f} MB response")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    path = os.path.join(directory, "dump.json")
+    write_dump(path, count)
+    print(f"{count} products, {os.path.getsize(path) / 1e6:.1f} MB file")
+    run("old /upload", count, path, "/upload")
+    run("/upload?mode=import", count, path, "/upload?mode=import")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+from pubsub import (CREATE, EXISTS, HISTORY, MESSAGE, PUBLISH, REPLY, ROOMS, SUBSCRIBE, UNSUBSCRIBE,
+                    encode_frame, read_frame)
+
+# the chat pub/sub broker: knows which rooms exist, keeps their recent history and forwards every
+# message published in a room to the other chat processes subscribed to it. one asyncio loop, no
+# persistence.
+#
+#   python broker.py                              # CHAT_BROKER_ADDRESS=tcp://0.0.0.0:5002
+#   CHAT_BROKER_ADDRESS=unix:///tmp/chat.sock python broker.py
+#
+# chat processes connect to it with CHAT_PUBSUB=<the same address>
+BROKER_ADDRESS = os.environ.get("CHAT_BROKER_ADDRESS", "tcp://0.0.0.0:5002")
+
+# a subscriber with this much unsent data is too slow and is disconnected (it reconnects and
+# subscribes again) rather than letting the broker buffer without bound
+MAX_SUBSCRIBER_BUFFER = int(os.environ.get("CHAT_BROKER_MAX_BUFFER", 16 * 1024 * 1024))
+
+ROOM_IDLE_TIMEOUT = float(os.environ.get("CHAT_ROOM_IDLE_TIMEOUT", 600))
+ROOM_CLEANUP_INTERVAL = float(os.environ.get("CHAT_ROOM_CLEANUP_INTERVAL", 60))
+# messages kept per room for members joining later
+HISTORY_SIZE = int(os.environ.get("CHAT_HISTORY_SIZE", 50))
+
+
+class Broker:
+    def __init__(self, idle_timeout=ROOM_IDLE_TIMEOUT, history_size=HISTORY_SIZE):
+        self.idle_timeout = idle_timeout
+        self.history_size = history_size
+        self.rooms = {}  # name -> last time used
+        self.subscribers = {}  # name -> {writer: None}
+        self.histories = {}  # name -> deque of the last history_size messages, as bytes
+
+    def reply(self, writer, value):
+        writer.write(encode_frame(REPLY, data=json.dumps(value).encode()))
+
+    def forward(self, room, frame, publisher):
+        for writer in self.subscribers.get(room, ()):
+            if writer is publisher:
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_SUBSCRIBER_BUFFER:
+                writer.transport.abort()
+                continue
+            writer.write(frame)
+
+    def drop(self, writer):
+        for room, writers in list(self.subscribers.items()):
+            writers.pop(writer, None)
+            if not writers:
+                del self.subscribers[room]
+                self.rooms[room] = time.monotonic()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                op, room, data = await read_frame(reader)
+                name = room.decode()
+                if op == PUBLISH:
+                    self.rooms[name] = time.monotonic()
+                    self.forward(name, encode_frame(MESSAGE, room, data), writer)
+                    if self.history_size:
+                        history = self.histories.get(name)
+                        if history is None:
+                            history = self.histories[name] = deque(maxlen=self.history_size)
+                        history.append(data)
+                elif op == SUBSCRIBE:
+                    self.rooms.setdefault(name, time.monotonic())
+                    self.subscribers.setdefault(name, {})[writer] = None
+                elif op == UNSUBSCRIBE:
+                    writers = self.subscribers.get(name, {})
+                    writers.pop(writer, None)
+                    if not writers:
+                        self.subscribers.pop(name, None)
+                        if name in self.rooms:
+                            self.rooms[name] = time.monotonic()
+                elif op == CREATE:
+                    created = name not in self.rooms
+                    self.rooms.setdefault(name, time.monotonic())
+                    self.reply(writer, created)
+                elif op == EXISTS:
+                    self.reply(writer, name in self.rooms)
+                elif op == ROOMS:
+                    self.reply(writer, list(self.rooms))
+                elif op == HISTORY:
+                    self.reply(writer, [data.decode() for data in self.histories.get(name, ())])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.drop(writer)
+            writer.close()
+
+    def remove_idle(self, now=None):
+        now = now if now is not None else time.monotonic()
+        idle = [room for room, last_used in self.rooms.items()
+                if room not in self.subscribers and now - last_used >= self.idle_timeout]
+        for room in idle:
+            del self.rooms[room]
+            self.histories.pop(room, None)
+        return idle
+
+    async def clean_up(self, interval=ROOM_CLEANUP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            for room in self.remove_idle():
+                print(f"Removed idle room {room}")
+
+
+async def serve_broker(address=BROKER_ADDRESS):
+    broker = Broker()
+    if address.startswith('unix://'):
+        path = address[len('unix://'):]
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(broker.handle, path)
+    else:
+        host, port = address.removeprefix('tcp://').rsplit(':', 1)
+        server = await asyncio.start_server(broker.handle, host, int(port))
+    cleanup = asyncio.create_task(broker.clean_up())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        cleanup.cancel()
+
+
+def run_broker(address=BROKER_ADDRESS):
+    asyncio.run(serve_broker(address))
+
+
+if __name__ == "__main__":
+    run_broker()
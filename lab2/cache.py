@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ReadCache:
+    # in-process LRU cache with a per-entry ttl, safe to share between request threads.
+    # shared is an optional multiprocessing.Value('q') made before worker processes fork: every
+    # invalidation bumps it, and a process that finds it moved by another clears its entries, as
+    # it can't know which ones that process' write changed
+    def __init__(self, max_entries=10000, ttl=60, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self.shared_seen = shared.value if shared is not None else 0
+        self.entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # bumped by every invalidation: a reader notes it before computing a value and passes it to
+        # set(), which drops the value if a write invalidated the cache in between
+        self.generation = 0
+
+    def get(self, key):
+        # the cached value, or None on a miss (so None itself can't be cached)
+        now = time.monotonic()
+        with self.lock:
+            self.sync()
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, generation=None):
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return  # computed before a write that may have changed it
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def sync(self):
+        # with self.lock held. a value set from a query that ran before another process' write is
+        # dropped here, by the next get after that write
+        if self.shared is not None:
+            value = self.shared.value
+            if value != self.shared_seen:
+                self.shared_seen = value
+                self.generation += 1
+                self.invalidations += len(self.entries)
+                self.entries.clear()
+
+    def bump(self):
+        # with self.lock held
+        self.generation += 1
+        if self.shared is not None:
+            with self.shared.get_lock():
+                self.shared.value += 1
+                # when another process bumped it too since the last sync, leave that to sync
+                if self.shared.value == self.shared_seen + 1:
+                    self.shared_seen = self.shared.value
+
+    def delete(self, key):
+        with self.lock:
+            self.bump()
+            if self.entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def delete_where(self, predicate):
+        # drops every entry for which predicate(key, value) is true. the predicate runs outside the
+        # lock on a snapshot of the entries, so reads aren't held up while it goes through them
+        with self.lock:
+            self.bump()
+            entries = list(self.entries.items())
+        stale = [(key, entry) for key, entry in entries if predicate(key, entry[1])]
+        with self.lock:
+            for key, entry in stale:
+                # an entry set again since the snapshot was filled after this write started
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.bump()
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
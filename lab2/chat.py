@@ -0,0 +1,393 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+import zlib
+
+from websockets import ConnectionClosed, serve
+
+import metrics
+from broker import run_broker
+from pubsub import make_pubsub
+
+# chat room websocket server, run on its own with python chat.py (lab2.py still starts it on a
+# thread for local development), scaled separately from the web workers
+CHAT_HOST = os.environ.get("CHAT_HOST", "0.0.0.0")
+CHAT_PORT = int(os.environ.get("CHAT_PORT", 5001))
+
+# outbound messages buffered per connection before it counts as a slow consumer, and what happens
+# then: "drop" skips the messages it can't take, "disconnect" closes it
+OUTBOUND_QUEUE_SIZE = int(os.environ.get("CHAT_QUEUE_SIZE", 256))
+SLOW_CLIENT_POLICY = os.environ.get("CHAT_SLOW_CLIENT_POLICY", "drop")
+
+# where rooms and cross-process messages live: "local" (this process only) or a broker.py
+# address, tcp://host:port or unix:///path, shared by every chat process
+CHAT_PUBSUB = os.environ.get("CHAT_PUBSUB", "local")
+# processes (one event loop each) serving the same port, see the bottom of the file
+CHAT_WORKERS = int(os.environ.get("CHAT_WORKERS", 1))
+
+# messages each room keeps for members joining later, sent to them as one
+# {"history": [message, ...]} frame
+HISTORY_SIZE = int(os.environ.get("CHAT_HISTORY_SIZE", 50))
+
+# micro-batching: with a window > 0 a connection's writer waits that many seconds after a message
+# and sends it together with whatever else was queued meanwhile (up to BATCH_MAX) as one
+# {"batch": [message, ...]} frame. every frame is a batch then, even of a single message, so
+# clients only deal with one shape. off by default, it trades that much latency for fewer frames
+BATCH_WINDOW = float(os.environ.get("CHAT_BATCH_WINDOW", 0))
+BATCH_MAX = int(os.environ.get("CHAT_BATCH_MAX", 64))
+
+# empty rooms are removed once they have been idle this long, checked every ROOM_CLEANUP_INTERVAL
+ROOM_IDLE_TIMEOUT = float(os.environ.get("CHAT_ROOM_IDLE_TIMEOUT", 600))
+ROOM_CLEANUP_INTERVAL = float(os.environ.get("CHAT_ROOM_CLEANUP_INTERVAL", 60))
+
+# rooms are partitioned over CHAT_SHARDS servers by a stable hash of their name; this one owns
+# shard CHAT_SHARD and sends clients asking for other rooms to CHAT_SHARD_URLS[shard]
+# (default: ws://CHAT_PUBLIC_HOST:CHAT_PORT + shard). the public host is the name clients reach the
+# servers by; it defaults to CHAT_HOST, which can't be used when that is a wildcard bind address
+CHAT_SHARDS = int(os.environ.get("CHAT_SHARDS", 1))
+CHAT_SHARD = int(os.environ.get("CHAT_SHARD", 0))
+CHAT_SHARD_URLS = [url for url in os.environ.get("CHAT_SHARD_URLS", "").split(",") if url]
+CHAT_PUBLIC_HOST = os.environ.get("CHAT_PUBLIC_HOST") or (CHAT_HOST if CHAT_HOST not in ("", "0.0.0.0", "::") else None)
+
+
+CONNECTIONS = metrics.Gauge('lab2_chat_connections', 'Open chat websocket connections.')
+MESSAGES = metrics.Counter('lab2_chat_messages_total', 'Chat messages sent by clients to this process.')
+DELIVERIES = metrics.Counter('lab2_chat_deliveries_total', 'Messages queued to members of this process.')
+DROPPED = metrics.Counter('lab2_chat_dropped_total', 'Messages dropped because a member was too slow.')
+SLOW_DISCONNECTS = metrics.Counter('lab2_chat_slow_disconnects_total', 'Members closed because they were too slow.')
+BROADCAST_SECONDS = metrics.Histogram(
+    'lab2_chat_broadcast_duration_seconds',
+    'Time to queue a message to the members of this process and publish it to the others.',
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5))
+FANOUT = metrics.Histogram('lab2_chat_broadcast_fanout', 'Members of this process a message is queued to.',
+                           buckets=(0, 1, 10, 100, 1000, 10000, 100000))
+
+
+def room_metrics():
+    # read at scrape time from the registry, nothing to maintain on join / leave
+    sizes = [len(room.members) for room in chat_rooms.rooms.values()]
+    return [
+        '# TYPE lab2_chat_rooms gauge', f'lab2_chat_rooms {len(sizes)}',
+        '# TYPE lab2_chat_members gauge', f'lab2_chat_members {sum(sizes)}',
+    ] + metrics.histogram_lines('lab2_chat_room_members', 'Members of this process per room.',
+                                (1, 10, 100, 1000, 10000, 100000), sizes)
+
+
+metrics.collectors.append(room_metrics)
+
+
+def shard_of(room, shards):
+    # crc32 rather than hash(), which differs between processes
+    return zlib.crc32(str(room).encode()) % shards
+
+
+class Room:
+    def __init__(self, name):
+        self.name = name
+        # client -> None, an insertion ordered set; while a client joins its value is its Joining
+        self.members = {}
+
+
+class Joining:
+    # the messages held back for a client while it joins a room, see join_room
+    def __init__(self):
+        self.held = []
+        self.history_taken = False
+
+    def take_history(self):
+        self.history_taken = True
+
+
+class RoomRegistry:
+    # the members this process has in the rooms of its shard: O(1) join / leave whatever the room
+    # size. which rooms exist, and members in other processes, are the pub/sub backend's business
+    def __init__(self, shard=0, shards=1):
+        self.shard = shard
+        self.shards = shards
+        self.rooms = {}
+
+    def owns(self, name):
+        return self.shards == 1 or shard_of(name, self.shards) == self.shard
+
+    def get(self, name):
+        return self.rooms.get(name)
+
+    def join(self, name, client, joining=None):
+        # True when client is the room's first member here, so the process has to subscribe to it
+        room = self.rooms.get(name)
+        first = room is None
+        if first:
+            room = self.rooms[name] = Room(name)
+        room.members[client] = joining
+        return first
+
+    def leave(self, name, client):
+        # False when client wasn't in the room; a room left without members here is dropped
+        room = self.rooms.get(name)
+        if room is None or client not in room.members:
+            return False
+        del room.members[client]
+        if not room.members:
+            del self.rooms[name]
+        return True
+
+
+chat_rooms = RoomRegistry(CHAT_SHARD, CHAT_SHARDS)
+pubsub = None
+
+
+def shard_url(shard):
+    if shard < len(CHAT_SHARD_URLS):
+        return CHAT_SHARD_URLS[shard]
+    return f"ws://{CHAT_PUBLIC_HOST}:{CHAT_PORT - CHAT_SHARD + shard}"
+
+
+def check_shard_urls():
+    # at startup rather than in the first redirect, which would send clients to 0.0.0.0
+    if CHAT_SHARDS > 1 and len(CHAT_SHARD_URLS) < CHAT_SHARDS and CHAT_PUBLIC_HOST is None:
+        raise ValueError(f"CHAT_SHARDS={CHAT_SHARDS} needs CHAT_SHARD_URLS (one per shard) or CHAT_PUBLIC_HOST "
+                         f"when CHAT_HOST={CHAT_HOST!r} is a wildcard address")
+
+
+# tasks nothing else holds a reference to, kept until they are done so they aren't collected first
+background_tasks = set()
+
+
+def run_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+class Client:
+    # one connection with its own writer task, so sending to it never waits on its socket
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(OUTBOUND_QUEUE_SIZE)
+        self.dropped = 0
+        self.closing = False
+        self.writer = asyncio.create_task(self.write())
+
+    async def write(self):
+        queue = self.queue
+        try:
+            while True:
+                payload = await queue.get()
+                if BATCH_WINDOW:
+                    await asyncio.sleep(BATCH_WINDOW)
+                    payloads = [payload]
+                    while len(payloads) < BATCH_MAX and not queue.empty():
+                        payloads.append(queue.get_nowait())
+                    payload = '{"batch":[' + ','.join(payloads) + ']}'
+                await self.websocket.send(payload)
+        except ConnectionClosed:
+            pass
+
+    def send(self, payload):
+        # queues an already encoded message, never blocks; False when the client is too slow for it
+        if self.closing:
+            return False
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if SLOW_CLIENT_POLICY == "disconnect":
+            self.closing = True
+            self.writer.cancel()
+            run_in_background(self.websocket.close(1013, "too slow to keep up"))
+            SLOW_DISCONNECTS.inc()
+        else:
+            self.dropped += 1
+            DROPPED.inc()
+        return False
+
+    def close(self):
+        self.writer.cancel()
+
+
+async def chat_handler(websocket):
+    room_name = None
+    client = Client(websocket)
+    CONNECTIONS.inc()
+
+    try:
+        async for message in websocket:
+            data = json.loads(message)
+            action = data.get("action")
+
+            if action in ("join", "create") and not chat_rooms.owns(data.get("room")):
+                # the room lives on another shard, the client reconnects there
+                shard = shard_of(data.get("room"), chat_rooms.shards)
+                client.send(json.dumps({"message": "Room is on another server", "redirect": shard_url(shard)}))
+
+            elif action == "join":
+                if room_name:
+                    await leave_room(room_name, client)
+                room_name = data.get("room")
+                if await pubsub.exists(room_name):
+                    await join_room(room_name, client)
+                    print(f"User joined room {room_name}")
+                else:
+                    room_name = None
+                    client.send(json.dumps({"message": "Room does not exist"}))
+
+            elif action == "create" and not room_name:
+                new_room = data.get('room')
+                if await pubsub.create(new_room):
+                    client.send(json.dumps({"message": f"Room '{new_room}' created"}, default=str))
+                else:
+                    client.send(json.dumps({"message": f"Room '{new_room}' already created"}, default=str))
+
+            elif action == "rooms":
+                client.send(json.dumps({"rooms": await pubsub.names()}))
+
+            elif action == "message" and room_name:
+                message_text = data.get("message")
+                if message_text:
+                    await broadcast(room_name, message_text, client)
+
+            elif action == "leave" and room_name:
+                await leave_room(room_name, client)
+                room_name = None
+                client.send(json.dumps({"message": "Left the room"}))
+
+    finally:
+        if room_name:
+            await leave_room(room_name, client)
+        client.close()
+        CONNECTIONS.dec()
+
+
+async def broadcast(room, message, sender):
+    # encodes once, queues to every member here (the writer tasks deliver concurrently, so a slow
+    # member only ever fills its own queue) and publishes for the members in other processes
+    start = time.perf_counter()
+    MESSAGES.inc()
+    message_data = json.dumps({"message": message})
+    deliver(room, message_data, sender)
+    await pubsub.publish(room, message_data)
+    BROADCAST_SECONDS.observe(time.perf_counter() - start)
+
+
+def deliver(room, message_data, sender=None):
+    # sender is None for messages of other processes
+    room = chat_rooms.get(room)
+    if room is not None:
+        for user, joining in room.members.items():
+            if user is sender:
+                continue
+            if joining is None:
+                user.send(message_data)
+            elif sender is not None or joining.history_taken:
+                joining.held.append(message_data)
+        fanout = len(room.members) - (sender in room.members)
+        FANOUT.observe(fanout)
+        DELIVERIES.inc(amount=fanout)
+
+
+async def join_room(room, client):
+    # the history first, then the live messages, none of them twice and none missing. the broker
+    # answers on the same connection it forwards messages on, in order: messages of other
+    # processes that arrive before the answer are in the history and skipped, the later ones are
+    # held back until it is sent. messages of members here are in it when published before the
+    # request, which goes out after them, and held back otherwise
+    joining = Joining()
+    if chat_rooms.join(room, client, joining):
+        await pubsub.subscribe(room)
+    try:
+        client.send(json.dumps({"message": f"Joined room '{room}'"}))
+        del joining.held[:]  # published before the request below, so in the history
+        history = await pubsub.history(room, joining.take_history)
+        if history:
+            # the stored messages are already encoded, so no json round trip
+            client.send('{"history":[' + ','.join(history) + ']}')
+    finally:
+        for message_data in joining.held:
+            client.send(message_data)
+        joined = chat_rooms.get(room)
+        if joined is not None and client in joined.members:
+            joined.members[client] = None
+
+
+async def leave_room(room, client):
+    if chat_rooms.leave(room, client):
+        print(f"User left room {room}")
+        if chat_rooms.get(room) is None:
+            await pubsub.unsubscribe(room)
+
+
+def metrics_request(connection, request):
+    # plain http GET /metrics on the chat port answers with this process' metrics
+    if request.path == "/metrics":
+        response = connection.respond(200, metrics.render())
+        del response.headers["Content-Type"]
+        response.headers["Content-Type"] = metrics.CONTENT_TYPE
+        return response
+    return None
+
+
+async def start_websocket_server(host=CHAT_HOST, port=CHAT_PORT, pubsub_url=None, reuse_port=False):
+    global pubsub
+    check_shard_urls()
+    pubsub = make_pubsub(pubsub_url or CHAT_PUBSUB, ROOM_IDLE_TIMEOUT, ROOM_CLEANUP_INTERVAL, HISTORY_SIZE)
+    await pubsub.start(deliver)
+    try:
+        async with serve(chat_handler, host, port, process_request=metrics_request, reuse_port=reuse_port or None):
+            await asyncio.Future()
+    finally:
+        await pubsub.close()
+
+
+def start_websocket_server_thread():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(start_websocket_server())
+
+
+def run_server(shard, pubsub_url, reuse_port):
+    # one chat process serving shard on CHAT_PORT + shard, next to the other workers of the shard
+    global CHAT_SHARD, CHAT_PORT, chat_rooms
+    CHAT_PORT, CHAT_SHARD = CHAT_PORT + shard - CHAT_SHARD, shard
+    chat_rooms = RoomRegistry(shard, CHAT_SHARDS)
+    asyncio.run(start_websocket_server(CHAT_HOST, CHAT_PORT, pubsub_url, reuse_port))
+
+
+if __name__ == "__main__":
+    # the chat server on its own, independent of how many web workers run. with CHAT_SHARDS > 1
+    # and no CHAT_SHARD set it starts every shard; each shard runs CHAT_WORKERS processes, one
+    # event loop each, sharing the port and their rooms through CHAT_PUBSUB (a broker.py on a unix
+    # socket is started for them when that is left at local)
+    try:
+        check_shard_urls()
+    except ValueError as e:
+        sys.exit(str(e))
+    pubsub_url = CHAT_PUBSUB
+    processes = []
+    if CHAT_WORKERS > 1 and pubsub_url == "local":
+        pubsub_url = f"unix://{os.path.join(tempfile.gettempdir(), f'lab2-chat-{CHAT_PORT}.sock')}"
+        processes.append(multiprocessing.Process(target=run_broker, args=(pubsub_url,)))
+    shards = range(CHAT_SHARDS) if CHAT_SHARDS > 1 and "CHAT_SHARD" not in os.environ else [CHAT_SHARD]
+    for shard in shards:
+        processes += [multiprocessing.Process(target=run_server, args=(shard, pubsub_url, CHAT_WORKERS > 1))
+                      for _ in range(CHAT_WORKERS)]
+
+    if len(processes) == 1:
+        asyncio.run(start_websocket_server())
+    else:
+        for process in processes:
+            process.start()
+        # stopping this process stops the others too
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            for process in processes:
+                process.join()
+        finally:
+            for process in processes:
+                process.terminate()
@@ -0,0 +1,58 @@
+# production serving of the product api: gunicorn -c gunicorn.conf.py lab2:app
+# (the chat server runs separately, python chat.py)
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+
+# processes for cpu bound work (json, sqlalchemy), threads per process to overlap database waits.
+# every worker has its own connection pool, so workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) has
+# to stay under the postgres max_connections
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("WEB_THREADS", 4))
+worker_class = "gthread"
+keepalive = 5
+timeout = 60
+graceful_timeout = 30
+
+# recycle workers now and then so slow leaks can't build up
+max_requests = 10000
+max_requests_jitter = 1000
+
+# import the app (and run create_all) once in the master instead of racing in every worker. this
+# is also what lets the workers share the product cache's invalidations (see product_cache in
+# lab2.py): without it a write leaves the other workers' caches stale for up to PRODUCT_CACHE_TTL
+preload_app = True
+
+# the workers write their metrics here and GET /metrics, whichever worker answers it, adds them up.
+# the default is per master, so it holds across reloads
+metrics_dir = os.environ.get("METRICS_DIR") or os.path.join(tempfile.gettempdir(), f"lab2-metrics-{os.getpid()}")
+
+accesslog = os.environ.get("ACCESS_LOG")  # off unless set, e.g. ACCESS_LOG=-
+errorlog = "-"
+
+
+def on_starting(server):
+    # counters of an earlier run would be added to this one's
+    import metrics
+    metrics.reset(metrics_dir)
+
+
+def post_fork(server, worker):
+    # connections opened by the master during create_app must not be shared across forks
+    import metrics
+    from lab2 import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
+    metrics.share(metrics_dir)
+
+
+def worker_exit(server, worker):
+    import metrics
+    metrics.write_snapshot()
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.process_dead(metrics_dir, worker.pid)
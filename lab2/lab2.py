@@ -1,13 +1,23 @@
+import base64
+import codecs
+import multiprocessing
 import os
 import threading
-import asyncio
+import time
 import json
+from bisect import bisect_right
 from datetime import datetime
 
 from dotenv import load_dotenv
-from flask import Flask, Blueprint, request
+from flask import Flask, Blueprint, Response, g, has_request_context, request
 from flask_sqlalchemy import SQLAlchemy
-from websockets import serve
+from sqlalchemy import event, insert, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+import metrics
+from cache import ReadCache
+from chat import start_websocket_server_thread
 
 load_dotenv()
 
@@ -15,7 +25,54 @@ db = SQLAlchemy()
 
 queries = Blueprint('queries', __name__)
 
-chat_rooms = {}
+# rows per INSERT transaction for bulk ingest
+BULK_BATCH_SIZE = 1000
+
+# /upload?mode=import and NDJSON bodies are read in chunks of this size; one product record
+# (array element or line) may not be larger than MAX_UPLOAD_ITEM_BYTES, and at most
+# MAX_UPLOAD_ERRORS rejected records are listed in the response
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_ITEM_BYTES = 1024 * 1024
+MAX_UPLOAD_ERRORS = 100
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/jsonl')
+
+# upper bound for GET /product?limit=
+MAX_PAGE_SIZE = 10000
+
+# single products and GET /product pages; writes invalidate exactly the entries they can change.
+# the gunicorn workers fork after this import (preload_app), so they share the generation counter
+# and a write in one clears the caches of the others. processes that don't share it (other hosts,
+# a server started without preload) only see each other's writes once the ttl expires
+product_cache = ReadCache(
+    max_entries=int(os.environ.get("PRODUCT_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("PRODUCT_CACHE_TTL", 60)),
+    shared=multiprocessing.Value('q', 0)
+)
+
+REQUEST_SECONDS = metrics.Histogram(
+    'lab2_http_request_duration_seconds', 'Time to handle a request, including streaming the body.',
+    ['method', 'route', 'status'])
+DB_QUERIES = metrics.Counter('lab2_db_queries_total', 'SQL statements executed.', ['route'])
+DB_QUERY_SECONDS = metrics.Histogram('lab2_db_query_duration_seconds', 'Time per SQL statement.', ['route'])
+DB_QUERIES_PER_REQUEST = metrics.Histogram(
+    'lab2_db_queries_per_request', 'SQL statements per request.', ['route'], buckets=(0, 1, 2, 3, 5, 10, 25, 100))
+DB_SECONDS_PER_REQUEST = metrics.Histogram(
+    'lab2_db_duration_per_request_seconds', 'Time spent in SQL per request.', ['route'])
+
+
+def cache_metrics():
+    stats = product_cache.stats()
+    lines = []
+    for name, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'),
+                       ('invalidations', 'counter'), ('size', 'gauge')):
+        metric = f'lab2_product_cache_{name}' + ('_total' if kind == 'counter' else '')
+        lines += [f'# TYPE {metric} {kind}', f'{metric} {stats[name]}']
+    return lines
+
+
+metrics.collectors.append(cache_metrics)
+
 
 class Product(db.Model):
     __tablename__ = 'products'
@@ -28,21 +85,104 @@ class Product(db.Model):
     link = db.Column(db.String(500), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+    # back the GET /product filters and the created_at keyset order;
+    # text_pattern_ops lets postgres use the name index for LIKE 'prefix%' under any collation
+    __table_args__ = (
+        db.Index('ix_products_price_mdl', 'price_mdl'),
+        db.Index('ix_products_price_eur', 'price_eur'),
+        db.Index('ix_products_weight', 'weight'),
+        db.Index('ix_products_name_prefix', 'name', postgresql_ops={'name': 'text_pattern_ops'}),
+        db.Index('ix_products_created_at_id', 'created_at', 'id'),
+    )
+
     def __repr__(self):
         return f'<Product {self.name}>'
 
 
+def engine_options(url):
+    # connection pool per process: pool_size kept connections plus max_overflow extra under bursts,
+    # checked with a cheap ping before use and replaced after DB_POOL_RECYCLE seconds, so
+    # connections dropped by the server or a proxy never reach a request
+    options = {
+        'pool_pre_ping': True,
+        'pool_recycle': int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+    }
+    if not url.startswith('sqlite'):
+        options.update(
+            pool_size=int(os.environ.get("DB_POOL_SIZE", 10)),
+            max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 20)),
+            pool_timeout=int(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        )
+    return options
+
+
+def current_route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append((context, time.perf_counter()))
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()[1]
+    route = current_route() if has_request_context() else 'none'
+    DB_QUERIES.inc(route)
+    DB_QUERY_SECONDS.observe(elapsed, route)
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        g.db_seconds = g.get('db_seconds', 0.0) + elapsed
+
+
+def handle_error(context):
+    # a statement that raised never reaches after_cursor_execute, drop its start time so the
+    # stack on the (pooled, reused) connection stays paired with the queries still running.
+    # errors while fetching come here too, after the pop, hence the check whose entry it is
+    if context.connection is not None and context.execution_context is not None:
+        starts = context.connection.info.get('query_start')
+        if starts and starts[-1][0] is context.execution_context:
+            starts.pop()
+
+
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+def record_request(response):
+    # observed when the response is closed, so a streamed body counts in full
+    start, method, route = g.request_start, request.method, current_route()
+    queries, seconds = g.get('db_queries', 0), g.get('db_seconds', 0.0)
+    status = str(response.status_code)
+
+    def observe():
+        REQUEST_SECONDS.observe(time.perf_counter() - start, method, route, status)
+        DB_QUERIES_PER_REQUEST.observe(queries, route)
+        DB_SECONDS_PER_REQUEST.observe(seconds, route)
+    response.call_on_close(observe)
+    return response
+
+
 def create_app():
     app = Flask(__name__)
+    # DATABASE_URL overrides the postgres settings, e.g. sqlite:///lab2.db for local benchmarks
     app.config[
-        'SQLALCHEMY_DATABASE_URI'] = f'postgresql://{os.environ.get("POSTGRES_USERNAME")}:{os.environ.get("POSTGRES_PASSWORD")}@{os.environ.get("POSTGRES_URL")}/{os.environ.get("POSTGRES_DATABASE")}'
+        'SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL") or f'postgresql://{os.environ.get("POSTGRES_USERNAME")}:{os.environ.get("POSTGRES_PASSWORD")}@{os.environ.get("POSTGRES_URL")}/{os.environ.get("POSTGRES_DATABASE")}'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 
     db.init_app(app)
     app.register_blueprint(queries, url_prefix='/')
+    app.before_request(start_timer)
+    app.after_request(record_request)
 
     with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(db.engine, 'handle_error', handle_error)
         db.create_all()
+        # create_all skips tables that already exist, so indexes added later are created here
+        for index in Product.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
 
     return app
 
@@ -59,31 +199,501 @@ def create_product():
     )
     db.session.add(new_product)
     db.session.commit()
+    invalidate_products([product_values(new_product)])
     return {"message": "Product added successfully"}, 201
 
 
+def parse_product(data):
+    # validated column values for one product record, ValueError explains what is wrong
+    if not isinstance(data, dict):
+        raise ValueError("product must be a JSON object")
+    missing = [field for field in ('name', 'weight', 'price_mdl', 'price_eur', 'link') if data.get(field) is None]
+    if missing:
+        raise ValueError(f"missing fields: {', '.join(missing)}")
+    try:
+        values = {
+            'name': str(data['name']),
+            'weight': float(data['weight']),
+            'price_mdl': float(data['price_mdl']),
+            'price_eur': float(data['price_eur']),
+            'link': str(data['link']),
+        }
+    except (TypeError, ValueError):
+        raise ValueError("weight, price_mdl and price_eur must be numbers")
+    if len(values['name']) > 255 or len(values['link']) > 500:
+        raise ValueError("name or link too long")
+    return values
+
+
+def insert_products(rows):
+    # one multi-row INSERT ... RETURNING id in a single transaction, returns the new ids in row order
+    created_at = datetime.utcnow()
+    result = db.session.execute(
+        insert(Product).returning(Product.id, sort_by_parameter_order=True),
+        [{**row, 'created_at': created_at} for row in rows]
+    )
+    ids = result.scalars().all()
+    db.session.commit()
+    invalidate_products([{**row, 'id': product_id, 'created_at': created_at} for row, product_id in zip(rows, ids)])
+    return ids
+
+
+def insert_batch(batch):
+    # (index, new id, None) for each (index, values) in one transaction, or (index, None, error) for all of them
+    try:
+        ids = insert_products([values for _, values in batch])
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        error = str(getattr(e, "orig", None) or e)
+        return [(index, None, error) for index, _ in batch]
+    return [(index, product_id, None) for (index, _), product_id in zip(batch, ids)]
+
+
+def insert_records(records):
+    # (index, new id or None, error or None) for each (index, record or parse error), validated and
+    # inserted BULK_BATCH_SIZE rows per transaction. a ValueError from the records iterator itself
+    # (a malformed stream) is left to the caller, the batches before it stay committed
+    batch = []  # (index, values)
+    for index, record in records:
+        try:
+            if isinstance(record, ValueError):
+                raise record
+            batch.append((index, parse_product(record)))
+        except ValueError as e:
+            yield index, None, str(e)
+            continue
+        if len(batch) >= BULK_BATCH_SIZE:
+            yield from insert_batch(batch)
+            batch = []
+    if batch:
+        yield from insert_batch(batch)
+
+
+def iter_chunks(stream, chunk_size=UPLOAD_CHUNK_SIZE):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_lines(chunks, max_length=None):
+    # lines of a body given as byte chunks (readline on the wsgi stream is slow)
+    partial = b''
+    for chunk in chunks:
+        lines = (partial + chunk).split(b'\n')
+        partial = lines.pop()
+        if max_length is not None and len(partial) > max_length:
+            raise ValueError(f"line longer than {max_length} bytes")
+        yield from lines
+    if partial:
+        yield partial
+
+
+def iter_ndjson_records(chunks, max_length=None):
+    # (index, record or parse error) for each non-blank line
+    for index, line in enumerate(line for line in iter_lines(chunks, max_length) if line.strip()):
+        try:
+            yield index, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield index, ValueError(f"invalid JSON: {e.msg}")
+
+
+def iter_json_items(chunks, max_item_bytes=None):
+    # elements of a top-level JSON array given as byte chunks, decoded one at a time so only the
+    # current element is buffered; ValueError when the array is malformed or an element too large
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer, position, eof = '', 0, False
+    expect = '['  # then 'first' (an element or ']'), then ',' and 'element' in turn, then 'end'
+
+    def read():
+        chunk = next(chunks, None)
+        return text.decode(chunk or b'', final=chunk is None), chunk is None
+
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n':
+            position += 1
+        if position == len(buffer):
+            if eof:
+                if expect != 'end':
+                    raise ValueError("unexpected end of JSON array")
+                return
+            buffer, eof = read()
+            position = 0
+            continue
+
+        char = buffer[position]
+        if expect == '[':
+            if char != '[':
+                raise ValueError("expected a JSON array")
+            position += 1
+            expect = 'first'
+        elif expect in ('first', ',') and char == ']':
+            position += 1
+            expect = 'end'
+        elif expect == ',':
+            if char != ',':
+                raise ValueError("expected ',' or ']' after an array element")
+            position += 1
+            expect = 'element'
+        elif expect == 'end':
+            raise ValueError("unexpected data after the JSON array")
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError(f"invalid JSON: {e.msg}")
+                end = None
+            # an element not followed by a delimiter yet may be cut off (1 of 1.5, say), so read on
+            if end is None or (not eof and (end == len(buffer) or buffer[end] not in ' \t\r\n,]')):
+                if max_item_bytes is not None and len(buffer) - position > max_item_bytes:
+                    raise ValueError(f"array element larger than {max_item_bytes} bytes")
+                more, eof = read()
+                buffer, position = buffer[position:] + more, 0
+                continue
+            position = end
+            expect = ','
+            yield item
+
+
+def open_multipart_file(stream, boundary, field='file'):
+    # (filename, byte chunks) of one file field of a multipart/form-data body, read straight off
+    # the request stream instead of being spooled to a temp file; (None, None) when it is missing
+    decoder = MultipartDecoder(boundary.encode())
+
+    def events():
+        done = False
+        while True:
+            part_event = decoder.next_event()
+            if isinstance(part_event, NeedData):
+                if done:
+                    raise ValueError("truncated multipart body")
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                done = not chunk
+                decoder.receive_data(chunk or None)
+            elif isinstance(part_event, Epilogue):
+                return
+            else:
+                yield part_event
+
+    events = events()
+    for part_event in events:
+        if isinstance(part_event, File) and part_event.name == field:
+            break
+    else:
+        return None, None
+
+    def chunks():
+        for part_event in events:
+            if isinstance(part_event, Data):
+                if part_event.data:
+                    yield part_event.data
+                if not part_event.more_data:
+                    return
+
+    return part_event.filename, chunks()
+
+
+def iter_bulk_records():
+    # (index, record or parse error) from a JSON array body or an NDJSON stream
+    if request.mimetype in NDJSON_TYPES:
+        yield from iter_ndjson_records(iter_chunks(request.stream))
+        return
+
+    records = request.get_json(silent=True)
+    if not isinstance(records, list):
+        raise ValueError("expected a JSON array or an application/x-ndjson body")
+    yield from enumerate(records)
+
+
+@queries.route('/products/bulk', methods=['POST'])
+def bulk_create_products():
+    results = []
+    try:
+        for index, product_id, error in insert_records(iter_bulk_records()):
+            if error is None:
+                results.append({"index": index, "status": "created", "id": product_id})
+            else:
+                results.append({"index": index, "status": "error", "error": error})
+    except ValueError as e:
+        return {"message": str(e)}, 400
+
+    results.sort(key=lambda row: row["index"])
+    created = sum(1 for row in results if row["status"] == "created")
+    return {
+        "created": created,
+        "failed": len(results) - created,
+        "results": results,
+    }, 201 if created == len(results) else 207
+
+
+def encode_cursor(values):
+    # opaque page cursor: the sort key of the last row on the page
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor")
+
+
+def product_filters(args):
+    # the GET /product filters present in the query string, normalized
+    filters = {}
+    for name in ('price_mdl', 'price_eur', 'weight'):
+        for bound in ('min', 'max'):
+            value = args.get(f'{bound}_{name}', type=float)
+            if value is not None:
+                filters[f'{bound}_{name}'] = value
+    if args.get('name_prefix'):
+        filters['name_prefix'] = args.get('name_prefix')
+    return filters
+
+
+def filtered_products(filters):
+    # Product query with the price / weight / name prefix filters of GET /product applied
+    query = Product.query
+    for column, name in ((Product.price_mdl, 'price_mdl'), (Product.price_eur, 'price_eur'), (Product.weight, 'weight')):
+        if f'min_{name}' in filters:
+            query = query.filter(column >= filters[f'min_{name}'])
+        if f'max_{name}' in filters:
+            query = query.filter(column <= filters[f'max_{name}'])
+    if filters.get('name_prefix'):
+        prefix = filters['name_prefix']
+        if db.engine.dialect.name == 'sqlite':
+            # sqlite uses no index for LIKE with ESCAPE, nor with its case insensitive default, but
+            # does for a range on name, and compares bytewise: the range is exactly the prefix
+            query = query.filter(Product.name >= prefix)
+            upper = prefix_upper_bound(prefix)
+            if upper is not None:
+                query = query.filter(Product.name < upper)
+        else:
+            # postgres serves a prefix LIKE from the text_pattern_ops index; a range would follow
+            # the column's collation there, which needn't be bytewise
+            escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            query = query.filter(Product.name.like(f'{escaped}%', escape='\\'))
+    return query
+
+
+def prefix_upper_bound(prefix):
+    # the smallest string after every string starting with prefix, None when there is none
+    while prefix:
+        code = ord(prefix[-1]) + 1
+        if code == 0xD800:
+            code = 0xE000  # surrogates can't be encoded
+        if code <= 0x10FFFF:
+            return prefix[:-1] + chr(code)
+        prefix = prefix[:-1]
+    return None
+
+
+def product_matches(filters, values):
+    # python side of filtered_products, used to find the cached pages a write can change
+    for name in ('price_mdl', 'price_eur', 'weight'):
+        if f'min_{name}' in filters and values[name] < filters[f'min_{name}']:
+            return False
+        if f'max_{name}' in filters and values[name] > filters[f'max_{name}']:
+            return False
+    if filters.get('name_prefix') and not values['name'].startswith(filters['name_prefix']):
+        return False
+    return True
+
+
+def sort_key(order, values):
+    return values['id'] if order == 'id' else (values['created_at'], values['id'])
+
+
+def product_to_dict(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'weight': product.weight,
+        'price_mdl': product.price_mdl,
+        'price_eur': product.price_eur,
+        'link': product.link
+    }
+
+
+def product_values(product):
+    # what invalidation needs to know about a product: its filter columns and sort keys
+    return {
+        'id': product.id,
+        'name': product.name,
+        'weight': product.weight,
+        'price_mdl': product.price_mdl,
+        'price_eur': product.price_eur,
+        'created_at': product.created_at,
+    }
+
+
+def invalidate_products(changed):
+    # changed: product_values() of every written row, before and after the write.
+    # a cached page can only change when a matching row's sort key is past the page's start and
+    # either inside the page or the page was not full (a row appended to the last page)
+    for values in changed:
+        product_cache.delete(('product', values['id']))
+
+    # sort keys of the changed rows matching each (order, filters) of the cached pages, sorted once
+    # per combination, so every page takes one bisect instead of a test against every row
+    positions = {}
+
+    def page_affected(key, page):
+        if key[0] != 'page':
+            return False
+        group = (page['order'], key[5])
+        keys = positions.get(group)
+        if keys is None:
+            keys = positions[group] = sorted(sort_key(page['order'], values) for values in changed
+                                             if product_matches(page['filters'], values))
+        first = bisect_right(keys, page['after']) if page['after'] is not None else 0
+        return first < len(keys) and (not page['full'] or keys[first] <= page['last'])
+
+    product_cache.delete_where(page_affected)
+
+
+# the columns GET /product selects, as plain row tuples rather than Product instances;
+# created_at is only read for the cursor and isn't sent
+PAGE_COLUMNS = (Product.id, Product.name, Product.weight, Product.price_mdl, Product.price_eur, Product.link,
+                Product.created_at)
+PAGE_FIELDS = ('id', 'name', 'weight', 'price_mdl', 'price_eur', 'link')
+
+# rows per chunk of a streamed GET /product body
+STREAM_BATCH = 500
+
+RESPONSE_FORMATS = ('json', 'ndjson', 'columnar')
+
+encode_string = json.encoder.encode_basestring_ascii
+
+
+def row_json(row):
+    # one product object, same keys and values as product_to_dict, without building the dict
+    return (f'{{"id":{row[0]},"name":{encode_string(row[1])},"weight":{row[2]!r},'
+            f'"price_mdl":{row[3]!r},"price_eur":{row[4]!r},"link":{encode_string(row[5])}}}')
+
+
+def iter_json_page(rows, next_cursor):
+    # {"products": [...], "next_cursor": ...} written STREAM_BATCH rows at a time
+    yield '{"products":['
+    for first in range(0, len(rows), STREAM_BATCH):
+        pieces = [row_json(row) for row in rows[first:first + STREAM_BATCH]]
+        yield (',' if first else '') + ','.join(pieces)
+    yield f'],"next_cursor":{json.dumps(next_cursor)}}}'
+
+
+def iter_ndjson_page(rows):
+    # one product object per line; the next cursor goes in the X-Next-Cursor header
+    for first in range(0, len(rows), STREAM_BATCH):
+        yield ''.join([row_json(row) + '\n' for row in rows[first:first + STREAM_BATCH]])
+
+
+def columnar_page(rows, next_cursor):
+    # {"columns": [...], "id": [...], "name": [...], ...}: one array per column, for internal consumers
+    columns = list(zip(*rows)) if rows else [()] * len(PAGE_COLUMNS)
+    page = {"columns": PAGE_FIELDS, "count": len(rows), "next_cursor": next_cursor}
+    page.update(zip(PAGE_FIELDS, columns))
+    return json.dumps(page, separators=(',', ':'))
+
+
 @queries.route('/product', methods=['GET'])
 def get_products():
+    # keyset pagination: pass the next_cursor of a page as ?cursor= to get the following page,
+    # ordered by id (default) or by created_at with ?order=created_at. offset still works, but
+    # costs a scan over every skipped row
     offset = request.args.get('offset', default=0, type=int)
-    limit = request.args.get('limit', default=5, type=int)
-    products = Product.query.offset(offset).limit(limit).all()
-    result = []
-    for product in products:
-        result.append({
-            'id': product.id,
-            'name': product.name,
-            'weight': product.weight,
-            'price_mdl': product.price_mdl,
-            'price_eur': product.price_eur,
-            'link': product.link
-        })
-    return {"products": result}, 200
+    limit = min(max(request.args.get('limit', default=5, type=int), 0), MAX_PAGE_SIZE)
+    order = request.args.get('order', default='id')
+    if order not in ('id', 'created_at'):
+        return {"message": "order must be id or created_at"}, 400
+
+    cursor = request.args.get('cursor')
+    try:
+        position = decode_cursor(cursor) if cursor else None
+        if position is not None:
+            position = int(position) if order == 'id' else (datetime.fromisoformat(position[0]), int(position[1]))
+    except (ValueError, TypeError, IndexError, KeyError):
+        return {"message": "invalid cursor"}, 400
+
+    response_format = request.args.get('format', default='json')
+    if response_format not in RESPONSE_FORMATS:
+        return {"message": f"format must be one of {', '.join(RESPONSE_FORMATS)}"}, 400
+
+    # pages are cached as the selected row tuples, every format is rendered from those
+    filters = product_filters(request.args)
+    cache_key = ('page', order, position, offset, limit, tuple(sorted(filters.items())))
+    page = product_cache.get(cache_key)
+    if page is None:
+        generation = product_cache.generation
+        query = filtered_products(filters).with_entities(*PAGE_COLUMNS)
+        if order == 'id':
+            if position is not None:
+                query = query.filter(Product.id > position)
+            query = query.order_by(Product.id)
+        else:
+            if position is not None:
+                query = query.filter(tuple_(Product.created_at, Product.id) > tuple_(*position))
+            query = query.order_by(Product.created_at, Product.id)
+
+        rows = query.offset(offset).limit(limit).all()
+        last = rows[-1] if rows else None
+        page = {
+            'rows': rows,
+            'order': order,
+            'filters': filters,
+            'after': position,
+            'last': (last.id if order == 'id' else (last.created_at, last.id)) if last else None,
+            'full': len(rows) == limit,
+        }
+        product_cache.set(cache_key, page, generation)
+
+    next_cursor = None
+    if page['full'] and page['rows']:
+        last = page['rows'][-1]
+        next_cursor = encode_cursor(last.id if order == 'id' else [last.created_at.isoformat(), last.id])
+
+    if response_format == 'columnar':
+        return Response(columnar_page(page['rows'], next_cursor), mimetype='application/json')
+    if response_format == 'ndjson':
+        response = Response(iter_ndjson_page(page['rows']), mimetype='application/x-ndjson')
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
+    return Response(iter_json_page(page['rows'], next_cursor), mimetype='application/json')
+
+
+@queries.route('/product/<int:product_id>', methods=['GET'])
+def get_product(product_id):
+    cached = product_cache.get(('product', product_id))
+    if cached is not None:
+        return cached, 200
+    generation = product_cache.generation
+    product = Product.query.get_or_404(product_id)
+    result = product_to_dict(product)
+    product_cache.set(('product', product_id), result, generation)
+    return result, 200
+
+
+@queries.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return product_cache.stats(), 200
+
+
+@queries.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # under gunicorn every worker's, added up (see metrics_dir in gunicorn.conf.py); this process'
+    # otherwise, the chat server's included when it runs on a thread here
+    return Response(metrics.scrape(), content_type=metrics.CONTENT_TYPE)
 
 
 @queries.route('/product/<int:product_id>', methods=['PUT'])
 def update_product(product_id):
     product = Product.query.get_or_404(product_id)
     data = request.get_json()
+    before = product_values(product)
 
     product.name = data.get('name', product.name)
     product.weight = float(data.get('weight', product.weight)) if 'weight' in data else product.weight
@@ -92,19 +702,25 @@ def update_product(product_id):
     product.link = data.get('link', product.link)
 
     db.session.commit()
+    invalidate_products([before, product_values(product)])
     return {"message": "Product updated successfully"}, 200
 
 
 @queries.route('/product/<int:product_id>', methods=['DELETE'])
 def delete_product(product_id):
     product = Product.query.get_or_404(product_id)
+    before = product_values(product)
     db.session.delete(product)
     db.session.commit()
+    invalidate_products([before])
     return {"message": "Product deleted successfully"}, 200
 
 
 @queries.route('/upload', methods=['POST'])
 def upload_file():
+    if request.args.get('mode') == 'import':
+        return import_upload()
+
     if 'file' not in request.files:
         return {"message": "no file part in the request"}, 400
 
@@ -126,82 +742,52 @@ def upload_file():
         return {"message": "only JSON files are allowed!!11!"}, 400
 
 
-# ----------------------------------------
-# chat room functionality
-# ----------------------------------------
-async def chat_handler(websocket):
-    room_name = None
-
-    try:
-        async for message in websocket:
-            data = json.loads(message)
-            action = data.get("action")
-
-            if action == "join":
-                room_name = data.get("room")
-                if room_name in chat_rooms:
-                    chat_rooms[room_name].append(websocket)
-                    await websocket.send(json.dumps({"message": f"Joined room '{room_name}'"}))
-                    print(f"User joined room {room_name}")
-                else:
-                    room_name = None
-                    await websocket.send(json.dumps({"message": "Room does not exist"}))
-
-            elif action == "create" and not room_name:
-                new_room = data.get('room')
-                if chat_rooms.get(new_room) is not None:
-                    return await websocket.send(
-                        json.dumps({"message": f"Room '{new_room}' already created"}, default=str))
-                chat_rooms[new_room] = []
-                await websocket.send(json.dumps({"message": f"Room '{new_room}' created"}, default=str))
-
-            elif action == "rooms":
-                room_list = list(chat_rooms.keys())
-                await websocket.send(json.dumps({"rooms": room_list}))
-
-            elif action == "message" and room_name:
-                message_text = data.get("message")
-                if message_text:
-                    await broadcast(room_name, message_text, websocket)
-
-            elif action == "leave" and room_name:
-                await leave_room(room_name, websocket)
-                room_name = None
-                await websocket.send(json.dumps({"message": "Left the room"}))
-
-    finally:
-        if room_name:
-            await leave_room(room_name, websocket)
-
-
-async def broadcast(room, message, sender):
-    if room in chat_rooms:
-        message_data = json.dumps({"message": message})
-        for user in chat_rooms[room]:
-            if user != sender:
-                await user.send(message_data)
-
-
-async def leave_room(room, websocket):
-    if room in chat_rooms:
-        chat_rooms[room].remove(websocket)
-        print(f"User left room {room}")
-
-
-async def start_websocket_server():
-    async with serve(chat_handler, "0.0.0.0", 5001):
-        await asyncio.Future()
+def import_upload():
+    # /upload?mode=import: a JSON array or NDJSON file of products, as the 'file' field of a form or
+    # as the raw body, parsed straight off the request stream and inserted in BULK_BATCH_SIZE
+    # batches. nothing is written to disk or echoed back, so memory stays bounded by one batch and
+    # MAX_UPLOAD_ITEM_BYTES however large the file is; the response only has counts and errors
+    if request.mimetype == 'multipart/form-data':
+        boundary = request.mimetype_params.get('boundary')
+        if not boundary:
+            return {"message": "multipart body without a boundary"}, 400
+        try:
+            filename, chunks = open_multipart_file(request.stream, boundary)
+        except ValueError as e:
+            return {"message": str(e)}, 400
+        if chunks is None:
+            return {"message": "no file part in the request"}, 400
+    else:
+        filename, chunks = None, iter_chunks(request.stream)
 
+    if request.mimetype in NDJSON_TYPES or (filename or '').endswith(('.ndjson', '.jsonl')):
+        records = iter_ndjson_records(chunks, MAX_UPLOAD_ITEM_BYTES)
+    elif filename is None or filename.endswith('.json'):
+        records = enumerate(iter_json_items(chunks, MAX_UPLOAD_ITEM_BYTES))
+    else:
+        return {"message": "only JSON files are allowed!!11!"}, 400
 
-def start_websocket_server_thread():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(start_websocket_server())
+    created = failed = 0
+    errors = []
+    try:
+        for index, product_id, error in insert_records(records):
+            if error is None:
+                created += 1
+                continue
+            failed += 1
+            if len(errors) < MAX_UPLOAD_ERRORS:
+                errors.append({"index": index, "error": error})
+    except ValueError as e:
+        # a malformed file stops the import; what was inserted before it stays
+        return {"message": str(e), "created": created, "failed": failed, "errors": errors}, 400
+    return {"created": created, "failed": failed, "errors": errors}, 201 if failed == 0 else 207
 
 
 app = create_app()
 
 if __name__ == "__main__":
-    websocket_thread = threading.Thread(target=start_websocket_server_thread)
+    # development only: the werkzeug server plus the chat server on a thread. in production run
+    # gunicorn -c gunicorn.conf.py lab2:app and python chat.py as separate processes
+    websocket_thread = threading.Thread(target=start_websocket_server_thread, daemon=True)
     websocket_thread.start()
-    app.run("0.0.0.0", port=5000, debug=True)
+    app.run("0.0.0.0", port=5000, debug=os.environ.get("FLASK_DEBUG") == "1")
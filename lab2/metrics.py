@@ -0,0 +1,265 @@
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# minimal prometheus style metrics: counters, gauges and histograms with labels, rendered in the
+# text exposition format by render(). each process has its own registry: the chat process reports
+# for itself, the gunicorn workers share(directory) theirs and scrape() adds them all up.
+#
+#   requests = Counter("lab2_requests_total", "requests served", ["route"])
+#   requests.inc("/product")
+#   latency = Histogram("lab2_latency_seconds", "request latency", ["route"])
+#   latency.observe(0.012, "/product")
+
+# seconds, from 1 ms to 10 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# a sharing process rewrites its file this often, so scrape() is at most this much behind the
+# other processes
+SNAPSHOT_INTERVAL = float(os.environ.get("METRICS_SNAPSHOT_INTERVAL", 1))
+
+registry = []
+collectors = []  # callables returning extra exposition lines, run at scrape time
+
+directory = None  # set by share()
+snapshot_lock = threading.Lock()
+
+
+def label_text(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def lines(self):
+        with self.lock:
+            values = list(self.values.items())
+        return [f'{self.name}{label_text(self.labels, key)} {number(value)}' for key, value in values]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # label values -> [count per bucket (last one +Inf), sum]
+
+    def observe(self, value, *label_values):
+        # one bisect and two additions under the lock, cheap enough for every request
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def lines(self):
+        with self.lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        lines = []
+        names = self.labels + ('le',)
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{label_text(names, key + (number(bound),))} {cumulative}')
+            labels = label_text(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {number(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def histogram_lines(name, help, buckets, values):
+    # a histogram of values taken at scrape time (room sizes, say), without keeping a metric
+    counts = [0] * (len(buckets) + 1)
+    for value in values:
+        counts[bisect_left(buckets, value)] += 1
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+    cumulative = 0
+    for bound, count in zip(tuple(buckets) + (math.inf,), counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{le="{number(bound)}"}} {cumulative}')
+    lines.append(f'{name}_sum {number(sum(values))}')
+    lines.append(f'{name}_count {cumulative}')
+    return lines
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines += metric.header()
+        lines += metric.lines()
+    for collect in collectors:
+        lines += collect()
+    return '\n'.join(lines) + '\n'
+
+
+# processes that can't each have their own port (gunicorn workers behind one) share a directory:
+# every process writes its render() to <pid>.prom there, any of them adds the files up. when a
+# process exits its counters and histograms are folded into dead.prom so the totals never go back,
+# its gauges are dropped. the directory is cleared before the processes start
+DEAD_FILE = 'dead.prom'
+
+
+@contextmanager
+def locked(path, exclusive):
+    # folding a dead process' file and reading all of them exclude each other, so no scrape counts
+    # one twice or misses it. only here: sharing is for gunicorn, which is unix only
+    import fcntl
+    with open(os.path.join(path, '.lock'), 'a') as file:
+        fcntl.flock(file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def reset(path):
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith('.prom'):
+            os.unlink(os.path.join(path, name))
+
+
+def write_file(path, text):
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as file:
+        file.write(text)
+    os.replace(temporary, path)
+
+
+def read_file(path):
+    try:
+        with open(path) as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def share(path, interval=SNAPSHOT_INTERVAL):
+    # called in each process after it forks
+    global directory
+    directory = path
+    write_snapshot()
+
+    def write_snapshots():
+        while True:
+            time.sleep(interval)
+            write_snapshot()
+
+    threading.Thread(target=write_snapshots, daemon=True).start()
+
+
+def write_snapshot():
+    if directory is not None:
+        with snapshot_lock:
+            write_file(os.path.join(directory, f'{os.getpid()}.prom'), render())
+
+
+def process_dead(path, pid):
+    # called by the parent once the process has exited
+    with locked(path, exclusive=True):
+        text = read_file(os.path.join(path, f'{pid}.prom'))
+        if text is None:
+            return
+        dead = read_file(os.path.join(path, DEAD_FILE))
+        texts = [text] if dead is None else [dead, text]
+        write_file(os.path.join(path, DEAD_FILE), merge(texts, kinds=('counter', 'histogram')))
+        os.unlink(os.path.join(path, f'{pid}.prom'))
+
+
+def scrape():
+    # the metrics of every process sharing the directory, or of this one when not shared
+    if directory is None:
+        return render()
+    write_snapshot()
+    with locked(directory, exclusive=False):
+        texts = [read_file(os.path.join(directory, name)) for name in sorted(os.listdir(directory))
+                 if name.endswith('.prom')]
+    return merge([text for text in texts if text is not None])
+
+
+def merge(texts, kinds=None):
+    # adds up the samples with the same name and labels, of the families of the given kinds (all
+    # by default): counters, gauges and the buckets, sums and counts of histograms alike
+    families = {}  # name -> {'help', 'type', 'kind', 'samples': {sample: value}}, in order
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                name = line.split(' ', 3)[2]
+                family = families.setdefault(name, {'help': None, 'type': None, 'kind': None, 'samples': {}})
+                if line.startswith('# HELP '):
+                    family['help'] = family['help'] or line
+                else:
+                    family['type'] = family['type'] or line
+                    family['kind'] = line.split(' ', 3)[3]
+            elif line and family is not None:
+                sample, value = line.rsplit(' ', 1)
+                try:
+                    value = int(value)
+                except ValueError:
+                    value = float(value)
+                family['samples'][sample] = family['samples'].get(sample, 0) + value
+    lines = []
+    for family in families.values():
+        if kinds is not None and family['kind'] not in kinds:
+            continue
+        lines += [line for line in (family['help'], family['type']) if line]
+        lines += [f'{sample} {number(value)}' for sample, value in family['samples'].items()]
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import struct
+import time
+from collections import deque
+
+# room pub/sub for the chat server. a backend knows which rooms exist, keeps the last
+# history_size messages of each and carries every message published in a room to the other chat
+# processes that have members in it; the members themselves stay in each process' RoomRegistry.
+#
+#   LocalPubSub   one chat process, nothing leaves it
+#   BrokerPubSub  any number of chat processes sharing rooms through broker.py, over TCP or a
+#                 unix socket
+#
+# make_pubsub("local"), make_pubsub("tcp://127.0.0.1:5002") or make_pubsub("unix:///tmp/chat.sock")
+
+# broker protocol frames: op, room length, data length, then the room name and the data
+HEADER = struct.Struct('>BHI')
+SUBSCRIBE, UNSUBSCRIBE, PUBLISH, CREATE, EXISTS, ROOMS, MESSAGE, REPLY, HISTORY = range(1, 10)
+
+
+def encode_frame(op, room=b'', data=b''):
+    return HEADER.pack(op, len(room), len(data)) + room + data
+
+
+async def read_frame(reader):
+    # (op, room, data); asyncio.IncompleteReadError when the connection is closed
+    op, room_length, data_length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    body = await reader.readexactly(room_length + data_length)
+    return op, body[:room_length], body[room_length:]
+
+
+async def open_connection(address):
+    # address is host:port or unix:///path
+    if address.startswith('unix://'):
+        return await asyncio.open_unix_connection(address[len('unix://'):])
+    host, port = address.removeprefix('tcp://').rsplit(':', 1)
+    return await asyncio.open_connection(host, int(port))
+
+
+class LocalPubSub:
+    # rooms of a single process: publishing has nobody else to reach. empty rooms are removed
+    # once idle for idle_timeout
+    def __init__(self, idle_timeout=600, cleanup_interval=60, history_size=50):
+        self.idle_timeout = idle_timeout
+        self.cleanup_interval = cleanup_interval
+        self.history_size = history_size
+        self.rooms = {}  # name -> time the room was last used
+        self.histories = {}  # name -> deque of the last history_size encoded messages
+        self.subscribed = set()
+        self.cleanup = None
+
+    async def start(self, deliver):
+        self.cleanup = asyncio.create_task(self.clean_up())
+
+    async def close(self):
+        if self.cleanup:
+            self.cleanup.cancel()
+
+    async def create(self, room):
+        if room in self.rooms:
+            return False
+        self.rooms[room] = time.monotonic()
+        return True
+
+    async def exists(self, room):
+        return room in self.rooms
+
+    async def names(self):
+        return list(self.rooms)
+
+    async def subscribe(self, room):
+        self.subscribed.add(room)
+
+    async def unsubscribe(self, room):
+        self.subscribed.discard(room)
+        if room in self.rooms:
+            self.rooms[room] = time.monotonic()
+
+    async def publish(self, room, payload):
+        self.rooms[room] = time.monotonic()
+        if self.history_size:
+            history = self.histories.get(room)
+            if history is None:
+                history = self.histories[room] = deque(maxlen=self.history_size)
+            history.append(payload)
+
+    async def history(self, room, taken=None):
+        # taken() is called as the history is read, before any later message is delivered
+        if taken:
+            taken()
+        return list(self.histories.get(room, ()))
+
+    def remove_idle(self, now=None):
+        now = now if now is not None else time.monotonic()
+        idle = [room for room, last_used in self.rooms.items()
+                if room not in self.subscribed and now - last_used >= self.idle_timeout]
+        for room in idle:
+            del self.rooms[room]
+            self.histories.pop(room, None)
+        return idle
+
+    async def clean_up(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            for room in self.remove_idle():
+                print(f"Removed idle room {room}")
+
+
+class BrokerPubSub:
+    # rooms shared through a broker.py process. deliver(room, payload) is called for every message
+    # another process publishes in a room this one is subscribed to; a lost broker connection is
+    # re-established and the subscriptions restored
+    def __init__(self, address, reconnect_delay=1.0):
+        self.address = address
+        self.reconnect_delay = reconnect_delay
+        self.subscribed = set()
+        self.deliver = None
+        self.writer = None
+        self.connected = asyncio.Event()
+        # (future, called with the answer) of the requests sent, the broker answers them in order
+        self.replies = []
+        self.reader_task = None
+
+    async def start(self, deliver):
+        self.deliver = deliver
+        while True:
+            # the broker may still be starting up
+            try:
+                reader, self.writer = await open_connection(self.address)
+                break
+            except OSError:
+                await asyncio.sleep(self.reconnect_delay)
+        self.connected.set()
+        self.reader_task = asyncio.create_task(self.read(reader))
+
+    async def close(self):
+        if self.reader_task:
+            self.reader_task.cancel()
+        if self.writer:
+            self.writer.close()
+
+    async def read(self, reader):
+        while True:
+            try:
+                op, room, data = await read_frame(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                reader = await self.reconnect()
+                continue
+            if op == MESSAGE:
+                self.deliver(room.decode(), data.decode())
+            elif op == REPLY and self.replies:
+                future, on_reply = self.replies.pop(0)
+                if on_reply:
+                    on_reply()
+                if not future.done():
+                    future.set_result(json.loads(data))
+
+    async def reconnect(self):
+        self.connected.clear()
+        for future, _ in self.replies:
+            if not future.done():
+                future.set_exception(ConnectionError("lost the chat broker"))
+        self.replies.clear()
+        while True:
+            await asyncio.sleep(self.reconnect_delay)
+            try:
+                reader, self.writer = await open_connection(self.address)
+            except OSError:
+                continue
+            for room in self.subscribed:
+                self.writer.write(encode_frame(SUBSCRIBE, str(room).encode()))
+            self.connected.set()
+            print(f"Reconnected to the chat broker at {self.address}")
+            return reader
+
+    async def send(self, op, room, data=b''):
+        await self.connected.wait()
+        self.writer.write(encode_frame(op, str(room).encode(), data))
+        await self.writer.drain()
+
+    async def request(self, op, room='', on_reply=None):
+        # on_reply() runs as the answer is read, before the messages forwarded after it
+        await self.connected.wait()
+        future = asyncio.get_running_loop().create_future()
+        self.replies.append((future, on_reply))
+        self.writer.write(encode_frame(op, str(room).encode()))
+        return await future
+
+    async def create(self, room):
+        return await self.request(CREATE, room)
+
+    async def exists(self, room):
+        return await self.request(EXISTS, room)
+
+    async def names(self):
+        return await self.request(ROOMS)
+
+    async def history(self, room, taken=None):
+        return await self.request(HISTORY, room, taken)
+
+    async def subscribe(self, room):
+        self.subscribed.add(room)
+        await self.send(SUBSCRIBE, room)
+
+    async def unsubscribe(self, room):
+        self.subscribed.discard(room)
+        await self.send(UNSUBSCRIBE, room)
+
+    async def publish(self, room, payload):
+        await self.send(PUBLISH, room, payload.encode())
+
+
+def make_pubsub(url, idle_timeout=600, cleanup_interval=60, history_size=50):
+    # with a broker, idle rooms and history are the broker's settings
+    if url == 'local':
+        return LocalPubSub(idle_timeout, cleanup_interval, history_size)
+    return BrokerPubSub(url)
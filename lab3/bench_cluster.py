@@ -0,0 +1,93 @@
+# elections as the cluster grows, every node in one process on one loop: how long a new cluster
+# takes to elect its first leader, how long failovers take (as in bench_failover.py), what one
+# heartbeat costs the leader, and how long a membership change that adds a node and removes the
+# leader takes to commit and to get the cluster a new leader
+#
+#   python bench_cluster.py [sizes, comma separated] [failovers per size] [election timeout min] [max] [heartbeat interval]
+import asyncio
+import logging
+import sys
+import time
+
+import lab3
+from bench_failover import Observed, summary, wait_for_leader
+from lab3 import CANDIDATE, LEADER
+
+BASE_PORT = 6000
+
+
+class Timed(Observed):
+    # also times the leader's heartbeats: one APPEND_ENTRIES (or batch) to every follower
+    heartbeats = None
+
+    def send_heartbeat(self):
+        start = time.perf_counter()
+        super().send_heartbeat()
+        if self.state == LEADER:
+            self.heartbeats.append(time.perf_counter() - start)
+
+
+async def run(count, rounds, options):
+    cluster = list(range(count))
+    events = Timed.events = []
+    heartbeats = Timed.heartbeats = []
+    nodes = {nid: Timed(nid, cluster, base_port=BASE_PORT, **options) for nid in cluster}
+    started = time.perf_counter()
+    for n in nodes.values():
+        await n.start()
+
+    results = {"first": [], "detected": [], "elected": []}
+    try:
+        leader = await wait_for_leader(nodes)
+        results["first"].append(time.perf_counter() - started)
+        for _ in range(rounds):
+            await asyncio.sleep(options["heartbeat_interval"] * 3)
+            leader.stop()
+            stopped = time.perf_counter()
+            del events[:]
+            new_leader = await wait_for_leader(nodes, exclude=leader.node_id)
+            results["detected"].append(min(t for t, kind, nid in events if kind == CANDIDATE) - stopped)
+            results["elected"].append(max(t for t, kind, nid in events if kind == LEADER and nid == new_leader.node_id)
+                                      - stopped)
+            nodes[leader.node_id] = Timed(leader.node_id, cluster, base_port=BASE_PORT, **options)
+            await nodes[leader.node_id].start()
+            leader = new_leader
+
+        # node count joins and the leader leaves: C_old,new, then C_new, then an election among the rest
+        await asyncio.sleep(options["heartbeat_interval"] * 3)
+        joining = Timed(count, {}, address=("127.0.0.1", BASE_PORT + count), **options)
+        nodes[count] = joining
+        await joining.start()
+        new = [nid for nid in nodes if nid != leader.node_id]
+        started = time.perf_counter()
+        await asyncio.wait_for(leader.change_membership(new), 30)
+        results["change"] = [time.perf_counter() - started]
+        await wait_for_leader(nodes, exclude=leader.node_id)
+        results["new leader"] = [time.perf_counter() - started]
+    finally:
+        for n in nodes.values():
+            n.stop()
+    results["heartbeat"] = heartbeats
+    return results
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1].split(",")] if len(sys.argv) > 1 else [3, 5, 11, 25, 51, 101]
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    low = float(sys.argv[3]) if len(sys.argv) > 3 else 0.15
+    high = float(sys.argv[4]) if len(sys.argv) > 4 else 0.3
+    heartbeat = float(sys.argv[5]) if len(sys.argv) > 5 else 0.05
+    lab3.logger.setLevel(logging.WARNING)
+
+    options = {"election_timeout": (low, high), "heartbeat_interval": heartbeat, "heartbeat_loss": 0}
+    print(f"election timeout {low * 1000:.0f}-{high * 1000:.0f} ms, heartbeat every {heartbeat * 1000:.0f} ms, "
+          f"{rounds} failovers per size")
+    for count in sizes:
+        results = asyncio.run(run(count, rounds, options))
+        print(f"{count} nodes in one process")
+        for name, values in results.items():
+            print(summary(name, values))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# encode / decode operations per second of every raft message in the old "TYPE|term|id|..." text
+# format (entries as json) against the binary wire.py codec
+#
+#   python bench_codec.py [seconds per case] [entries per APPEND_ENTRIES] [command bytes]
+import json
+import sys
+import time
+
+import wire
+from wire import APPEND_ENTRIES_FORMAT, APPEND_REPLY_FORMAT, MAX_DATAGRAM, REQUEST_VOTE_FORMAT, VOTE_FORMAT
+
+
+# the text format nodes used to speak
+def text_request_vote(term, sender, last_index, last_term):
+    return f"REQUEST_VOTE|{term}|{sender}|{last_index}|{last_term}".encode('utf-8')
+
+
+def text_vote(term, sender, granted):
+    return f"VOTE|{term}|{sender}|{granted}".encode('utf-8')
+
+
+def text_append_reply(term, sender, success, match_index):
+    return f"APPEND_REPLY|{term}|{sender}|{success}|{match_index}".encode('utf-8')
+
+
+def text_append_entries(term, sender, prev_index, prev_term, commit, entries):
+    entries = json.dumps([[entry_term, command.decode()] for entry_term, command in entries], separators=(",", ":"))
+    return f"APPEND_ENTRIES|{term}|{sender}|{prev_index}|{prev_term}|{commit}|{entries}".encode('utf-8')
+
+
+def text_decode(data):
+    msg = data.decode('utf-8')
+    parts = msg.split("|")
+    if parts[0] == "REQUEST_VOTE":
+        return int(parts[1]), int(parts[2]), int(parts[3]), int(parts[4])
+    if parts[0] == "VOTE":
+        return int(parts[1]), int(parts[2]), parts[3] == "True"
+    if parts[0] == "APPEND_REPLY":
+        return int(parts[1]), int(parts[2]), parts[3] == "True", int(parts[4])
+    _, term, leader_id, prev_index, prev_term, commit, entries = msg.split("|", 6)
+    return (int(term), int(leader_id), int(prev_index), int(prev_term), int(commit),
+            [(entry_term, command.encode()) for entry_term, command in json.loads(entries)])
+
+
+# the binary codec, decoding the way the node does: from a view of the receive buffer
+LAYOUTS = {wire.REQUEST_VOTE: REQUEST_VOTE_FORMAT, wire.VOTE: VOTE_FORMAT, wire.APPEND_REPLY: APPEND_REPLY_FORMAT}
+
+
+def binary_decode(view):
+    msg_type = wire.message_type(view)
+    if msg_type == wire.APPEND_ENTRIES:
+        fields = wire.decode(view, APPEND_ENTRIES_FORMAT)
+        return fields[:-1] + (list(wire.iter_entries(view, fields[-1])),)
+    return wire.decode(view, LAYOUTS[msg_type])
+
+
+def rate(function, seconds):
+    count, start = 0, time.perf_counter()
+    while True:
+        for _ in range(1000):
+            function()
+        count += 1000
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return count / elapsed
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+
+    term, sender = 1234, 7
+    entries = [(term, f"key{i}={'x' * size}".encode()) for i in range(batch)]
+    send_buffer = bytearray(MAX_DATAGRAM)
+    recv_buffer = bytearray(MAX_DATAGRAM)
+    recv_view = memoryview(recv_buffer)
+
+    cases = [
+        ("REQUEST_VOTE", lambda: text_request_vote(term, sender, 987654, 1233),
+         lambda: wire.encode_request_vote(term, sender, 987654, 1233)),
+        ("VOTE", lambda: text_vote(term, sender, True), lambda: wire.encode_vote(term, sender, True)),
+        ("APPEND_REPLY", lambda: text_append_reply(term, sender, True, 987654),
+         lambda: wire.encode_append_reply(term, sender, True, 987654)),
+        ("heartbeat", lambda: text_append_entries(term, sender, 987654, 1234, 987650, []),
+         lambda: wire.encode_append_entries(send_buffer, term, sender, 987654, 1234, 987650, [])),
+        (f"{batch} entries", lambda: text_append_entries(term, sender, 987654, 1234, 987650, entries),
+         lambda: wire.encode_append_entries(send_buffer, term, sender, 987654, 1234, 987650, entries)),
+    ]
+
+    print(f"{'message':<14}{'text encode':>14}{'binary encode':>16}{'text decode':>14}{'binary decode':>16}"
+          f"{'text bytes':>12}{'binary bytes':>14}")
+    for name, text_encode, binary_encode in cases:
+        text = text_encode()
+        encoded = binary_encode()
+        if isinstance(encoded, int):  # packed into send_buffer
+            encoded = bytes(send_buffer[:encoded])
+        recv_buffer[:len(encoded)] = encoded
+        view = recv_view[:len(encoded)]
+        assert binary_decode(view) == text_decode(text)
+
+        print(f"{name:<14}{rate(text_encode, seconds):>14,.0f}{rate(binary_encode, seconds):>16,.0f}"
+              f"{rate(lambda: text_decode(text), seconds):>14,.0f}{rate(lambda: binary_decode(view), seconds):>16,.0f}"
+              f"{len(text):>12}{len(encoded):>14}")
+
+
+if __name__ == "__main__":
+    main()
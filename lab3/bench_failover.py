@@ -0,0 +1,92 @@
+# failover time of a cluster hosted in one process: wait for a leader, stop it and time how long
+# the others take to notice (first new candidate) and to elect a new leader, then bring the old
+# leader back as a follower and repeat
+#
+#   python bench_failover.py [nodes] [rounds] [election timeout min] [max] [heartbeat interval]
+import asyncio
+import logging
+import sys
+import time
+
+import lab3
+from lab3 import CANDIDATE, LEADER, Node
+
+
+class Observed(Node):
+    # a node reporting its state changes to the benchmark
+    events = None
+
+    def become_candidate(self):
+        super().become_candidate()
+        self.events.append((time.perf_counter(), CANDIDATE, self.node_id))
+
+    def become_leader(self):
+        super().become_leader()
+        self.events.append((time.perf_counter(), LEADER, self.node_id))
+
+
+async def wait_for_leader(nodes, exclude=None, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        leaders = [n for n in nodes.values() if n.state == LEADER and n.sock and n.node_id != exclude]
+        if leaders:
+            return leaders[0]
+        await asyncio.sleep(0.001)
+    raise TimeoutError("no leader elected")
+
+
+async def run(count, rounds, options):
+    cluster = list(range(count))
+    events = Observed.events = []
+    nodes = {nid: Observed(nid, cluster, base_port=6000, **options) for nid in cluster}
+    for n in nodes.values():
+        await n.start()
+
+    detections, elections = [], []
+    try:
+        leader = await wait_for_leader(nodes)
+        for _ in range(rounds):
+            # let the cluster settle on this leader first
+            await asyncio.sleep(options["heartbeat_interval"] * 3)
+            leader.stop()
+            stopped = time.perf_counter()
+            del events[:]
+            new_leader = await wait_for_leader(nodes, exclude=leader.node_id)
+            detected = min(t for t, kind, nid in events if kind == CANDIDATE)
+            elected = max(t for t, kind, nid in events if kind == LEADER and nid == new_leader.node_id)
+            detections.append(detected - stopped)
+            elections.append(elected - stopped)
+
+            nodes[leader.node_id] = Observed(leader.node_id, cluster, base_port=6000, **options)
+            await nodes[leader.node_id].start()
+            leader = new_leader
+    finally:
+        for n in nodes.values():
+            n.stop()
+    return detections, elections
+
+
+def summary(name, values):
+    values = sorted(values)
+    return (f"  {name:<10} p50 {values[len(values) // 2] * 1000:7.1f} ms   "
+            f"max {values[-1] * 1000:7.1f} ms   mean {sum(values) / len(values) * 1000:7.1f} ms")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    low = float(sys.argv[3]) if len(sys.argv) > 3 else 0.15
+    high = float(sys.argv[4]) if len(sys.argv) > 4 else 0.3
+    heartbeat = float(sys.argv[5]) if len(sys.argv) > 5 else 0.05
+    lab3.logger.setLevel(logging.WARNING)
+
+    options = {"election_timeout": (low, high), "heartbeat_interval": heartbeat, "heartbeat_loss": 0}
+    detections, elections = asyncio.run(run(count, rounds, options))
+    print(f"{count} nodes in one process, election timeout {low * 1000:.0f}-{high * 1000:.0f} ms, "
+          f"heartbeat every {heartbeat * 1000:.0f} ms, {rounds} failovers")
+    print(summary("detected", detections))
+    print(summary("elected", elections))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# committed entries per second through the leader of a cluster hosted in one process, with a
+# window of proposals kept outstanding, for a few batch / pipeline settings. checks at the end
+# that every node applied the same store
+#
+#   python bench_replication.py [nodes] [entries] [outstanding proposals] [command bytes]
+import asyncio
+import logging
+import sys
+import time
+
+import lab3
+from lab3 import LEADER, Node
+
+# (entries per APPEND_ENTRIES, batches in flight per follower)
+SETTINGS = [(1, 1), (1, 4), (128, 1), (128, 4)]
+
+
+async def run(count, total, window, size, append_batch, max_inflight):
+    cluster = list(range(count))
+    options = {"election_timeout": (0.15, 0.3), "heartbeat_interval": 0.05, "heartbeat_loss": 0,
+               "append_batch": append_batch, "max_inflight": max_inflight}
+    nodes = [Node(nid, cluster, base_port=6100, **options) for nid in cluster]
+    for n in nodes:
+        await n.start()
+    try:
+        while not any(n.state == LEADER for n in nodes):
+            await asyncio.sleep(0.01)
+        leader = next(n for n in nodes if n.state == LEADER)
+
+        value = "x" * size
+        slots = asyncio.Semaphore(window)
+        pending = set()
+        start = time.perf_counter()
+        for i in range(total):
+            await slots.acquire()
+            future = leader.propose(f"key{i % 1000}={value}")
+            pending.add(future)
+            # only the outstanding proposals are kept: the nodes share this loop, and gathering
+            # every future at the end would hold it long enough to set off an election
+            future.add_done_callback(pending.discard)
+            future.add_done_callback(lambda _: slots.release())
+        await asyncio.gather(*pending)
+        elapsed = time.perf_counter() - start
+
+        # followers learn the final commit index with the next heartbeat
+        await asyncio.sleep(0.2)
+        stores = [n.store for n in nodes]
+        consistent = all(store == stores[0] for store in stores)
+        return elapsed, consistent
+    finally:
+        for n in nodes:
+            n.stop()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    window = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    size = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+    lab3.logger.setLevel(logging.WARNING)
+
+    print(f"{count} nodes, {total} entries of {size} bytes, {window} proposals outstanding")
+    for append_batch, max_inflight in SETTINGS:
+        elapsed, consistent = asyncio.run(run(count, total, window, size, append_batch, max_inflight))
+        print(f"  batch {append_batch:>4}  in flight {max_inflight}   {total / elapsed:>9.0f} entries/s   "
+              f"stores {'identical' if consistent else 'DIFFER'}")
+
+
+if __name__ == "__main__":
+    main()
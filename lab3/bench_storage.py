@@ -0,0 +1,74 @@
+# the durable log on its own, without the network: how many entries per second it makes durable
+# when every append waits for its own fsync against appends sharing one (group commit), how long
+# a node takes to recover the log when it starts, and how fast a follower that fell behind the
+# in-memory tail is read back through mmap
+#
+#   python bench_storage.py [entries] [command bytes] [directory, default a new one in .]
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from storage import DiskLog
+
+WINDOWS = [1, 16, 256]  # appends waiting for the same fsync
+
+
+async def durable(log):
+    # wait until everything appended so far is on disk
+    synced = asyncio.get_running_loop().create_future()
+    log.after_sync(lambda: synced.set_result(None))
+    await synced
+
+
+async def write(directory, total, command, window):
+    log = DiskLog(directory)
+    start = time.perf_counter()
+    for done in range(0, total, window):
+        for _ in range(min(window, total - done)):
+            log.append(1, command)
+        await durable(log)
+    elapsed = time.perf_counter() - start
+    log.close()
+    return total / elapsed
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    base = sys.argv[3] if len(sys.argv) > 3 else tempfile.mkdtemp(prefix="bench_storage_", dir=".")
+    command = b"k=" + b"x" * (size - 2)
+
+    print(f"{total} entries of {size} bytes in {os.path.abspath(base)}")
+    try:
+        for window in WINDOWS:
+            directory = os.path.join(base, f"window{window}")
+            # an fsync per entry is slow: fewer entries are enough to measure it
+            count = min(total, 2000) if window == 1 else total
+            rate = asyncio.run(write(directory, count, command, window))
+            print(f"  append, {window:>3} per fsync {rate:>12,.0f} entries/s")
+
+        directory = os.path.join(base, f"window{WINDOWS[-1]}")
+        start = time.perf_counter()
+        log = DiskLog(directory)
+        elapsed = time.perf_counter() - start
+        print(f"  recover {log.last_index()} entries   {elapsed * 1000:>9.1f} ms")
+
+        # reading back from the start, as the leader does for a follower that is far behind: all
+        # but the last tail_entries commands come out of the segments
+        start = time.perf_counter()
+        read = 0
+        for first in range(1, log.last_index() + 1, 128):
+            read += len(log.slice(first, min(first + 128, log.last_index() + 1)))
+        elapsed = time.perf_counter() - start
+        print(f"  catch-up reads, 128 per batch {read / elapsed:>12,.0f} entries/s")
+        log.close()
+    finally:
+        if len(sys.argv) <= 3:
+            shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    main()
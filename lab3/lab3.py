@@ -1,10 +1,19 @@
+import asyncio
+import json
+from collections import deque
+import os
 import socket
-import threading
 import time
 import random
 import sys
 import logging
 
+import wire
+from storage import MemoryLog, open_log
+from wire import (APPEND_ENTRIES, APPEND_ENTRIES_FORMAT, APPEND_REPLY, APPEND_REPLY_FORMAT, INSTALL_SNAPSHOT,
+                  INSTALL_SNAPSHOT_FORMAT, MAX_DATAGRAM, REQUEST_VOTE, REQUEST_VOTE_FORMAT, SNAPSHOT_REPLY,
+                  SNAPSHOT_REPLY_FORMAT, VOTE, VOTE_FORMAT)
+
 # Define a custom formatter to handle milliseconds and align thread names
 class CustomFormatter(logging.Formatter):
     def formatTime(self, record, datefmt=None):
@@ -44,107 +53,305 @@ FOLLOWER = "FOLLOWER"
 CANDIDATE = "CANDIDATE"
 LEADER = "LEADER"
 
-# types of messages:
-MSG_REQUEST_VOTE = "REQUEST_VOTE"
-MSG_VOTE = "VOTE"
-MSG_HEARTBEAT = "HEARTBEAT"
+# messages are the binary ones of wire.py: REQUEST_VOTE, VOTE, APPEND_ENTRIES (log entries, or
+# none as a heartbeat), APPEND_REPLY, and INSTALL_SNAPSHOT / SNAPSHOT_REPLY for followers that
+# need entries the leader already compacted
+
+# seconds. the defaults are slow enough to follow the log by eye; the node reacts to its deadlines
+# within a millisecond or so, so tens of milliseconds work just as well (see bench_failover.py)
+ELECTION_TIMEOUT = (float(os.environ.get("RAFT_ELECTION_TIMEOUT_MIN", 2.5)),
+                    float(os.environ.get("RAFT_ELECTION_TIMEOUT_MAX", 4.0)))
+HEARTBEAT_INTERVAL = float(os.environ.get("RAFT_HEARTBEAT_INTERVAL", 1.0))
+# share of heartbeats the leader skips, to simulate network issues
+HEARTBEAT_LOSS = float(os.environ.get("RAFT_HEARTBEAT_LOSS", 0.4))
+
+# replication: at most APPEND_BATCH entries (and about APPEND_BATCH_BYTES of commands) per
+# APPEND_ENTRIES datagram, and up to MAX_INFLIGHT of them sent to a follower ahead of its replies
+APPEND_BATCH = int(os.environ.get("RAFT_APPEND_BATCH", 128))
+APPEND_BATCH_BYTES = int(os.environ.get("RAFT_APPEND_BATCH_BYTES", 32 * 1024))
+MAX_INFLIGHT = int(os.environ.get("RAFT_MAX_INFLIGHT", 4))
+# the largest command that still fits an APPEND_ENTRIES datagram on its own
+MAX_COMMAND = MAX_DATAGRAM - APPEND_ENTRIES_FORMAT.size - wire.ENTRY.size
+# the store is snapshotted and the log compacted every SNAPSHOT_ENTRIES applied entries
+SNAPSHOT_ENTRIES = int(os.environ.get("RAFT_SNAPSHOT_ENTRIES", 100000))
+# a node keeps its term, vote and log in RAFT_DATA_DIR/node-<id>; without it they are lost on restart
+DATA_DIR = os.environ.get("RAFT_DATA_DIR")
+# datagrams handled per wakeup before letting the other nodes on the loop run
+RECV_BATCH = 64
+
+# the members of the cluster, "id=host:port" separated by commas; an id alone means port 5000 + id
+# on 127.0.0.1. RAFT_NODES picks the ones this process runs (all of them by default), so a cluster
+# can span hosts: RAFT_CLUSTER=0=10.0.0.1:5000,1=10.0.0.2:5000,2=10.0.0.3:5000 RAFT_NODES=1
+CLUSTER = os.environ.get("RAFT_CLUSTER", "0,1,2")
+NODES = os.environ.get("RAFT_NODES")
+
+# log entries whose command starts with CONFIG_PREFIX change the membership (see change_membership)
+# instead of the store: the rest is json {"old": members or null, "new": members}, members as
+# {"id": "host:port"}. a configuration is in effect as soon as it is in the log, committed or not
+CONFIG_PREFIX = b"\x00cluster "
+
+
+class NotLeader(Exception):
+    # a proposal went to a node that isn't (or stopped being) the leader; leader_id is the one it
+    # knows about, if any
+    def __init__(self, leader_id):
+        super().__init__(f"not the leader, try {leader_id}")
+        self.leader_id = leader_id
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+def parse_cluster(cluster, base_port=5000):
+    # {node id: (host, port)} from a list of ids (port base_port + id on 127.0.0.1), a dict of ids
+    # to (host, port) or "host:port", or a RAFT_CLUSTER string
+    if isinstance(cluster, str):
+        items = [item.strip().partition("=") for item in cluster.split(",") if item.strip()]
+        cluster = {nid: address or None for nid, _, address in items}
+    if not isinstance(cluster, dict):
+        cluster = dict.fromkeys(cluster)
+    members = {}
+    for nid, address in cluster.items():
+        if address is None:
+            address = ("127.0.0.1", base_port + int(nid))
+        elif isinstance(address, str):
+            address = parse_address(address)
+        members[int(nid)] = tuple(address)
+    return members
+
+
+def members_to_json(members):
+    return {str(nid): f"{host}:{port}" for nid, (host, port) in members.items()}
+
+
+def config_to_json(old, new):
+    return {"old": None if old is None else members_to_json(old), "new": members_to_json(new)}
+
+
+def config_from_json(config):
+    # (old members, new members), old is None unless the configuration is a joint one
+    return None if config["old"] is None else parse_cluster(config["old"]), parse_cluster(config["new"])
+
+
+def encode_config(old, new):
+    return CONFIG_PREFIX + json.dumps(config_to_json(old, new)).encode()
+
+
+def decode_config(command):
+    return config_from_json(json.loads(command[len(CONFIG_PREFIX):]))
 
 
 class Node:
-    def __init__(self, node_id, cluster, base_port=5000):
+    # one raft node driven by an asyncio loop: the loop calls on_readable when datagrams arrive
+    # and the election / heartbeat deadline is a single loop timer, so a node costs no threads and
+    # any number of them can share one process and one loop.
+    #
+    # cluster is the membership the node starts with, anything parse_cluster takes; the log and
+    # snapshot override it once they hold a configuration. a node joining a running cluster
+    # starts with an empty one (and its own address) and waits for the leader to add it
+    def __init__(self, node_id, cluster, base_port=5000, election_timeout=ELECTION_TIMEOUT,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, heartbeat_loss=HEARTBEAT_LOSS,
+                 append_batch=APPEND_BATCH, max_inflight=MAX_INFLIGHT, data_dir=None,
+                 snapshot_entries=SNAPSHOT_ENTRIES, address=None):
         self.node_id = node_id
-        self.cluster = cluster
-        self.port = base_port + node_id
+        self.base_port = base_port
         self.state = FOLLOWER
         self.current_term = 0
         self.voted_for = None
         self.leader_id = None
-
-        self.election_deadline = 0
-        self.reset_election_timeout()
-
-        self.heartbeat_interval = 1.0
-
-        self.votes_received = 0
-
+        self.heard_from_leader = 0.0  # loop time of the last message from the leader
+
+        # membership: base_config is (index, old, new) as of the snapshot (or the one the node
+        # started with), configs the same for every configuration entry in the log after it
+        self.base_config = (0, None, parse_cluster(cluster, base_port))
+        self.configs = []
+        self.address = tuple(address) if address else self.base_config[2][node_id]
+        self.membership_change = None  # future of the change this leader is making
+        self.addresses = {}
+        self.apply_config()
+
+        self.election_timeout = election_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_loss = heartbeat_loss
+
+        self.votes = set()
+
+        # the replicated log (storage.py), persistent when there is a data_dir; indexes start at 1
+        self.data_dir = data_dir
+        self.entries = MemoryLog()
+        self.commit_index = 0
+        self.last_applied = 0
+        self.store = {}  # the state machine, b"key=value" commands applied in log order
+        self.snapshot_entries = snapshot_entries
+        self.receiving = None  # (last_index, last_term, data so far) of a snapshot from the leader
+
+        # leader only, per follower: next index to send, highest index known to be replicated, and
+        # for pipelining the highest index sent so far and the batches awaiting a reply
+        self.append_batch = append_batch
+        self.max_inflight = max_inflight
+        self.next_index = {}
+        self.match_index = {}
+        self.sent_index = {}
+        self.inflight = {}  # where the sends awaiting a reply end: a batch's last index, a chunk's end
+        self.progressed = {}  # whether a follower acknowledged anything since the last heartbeat
+        self.snapshot_sent = {}  # for followers behind the snapshot: bytes of it sent and acknowledged
+        self.snapshot_acked = {}
+        self.proposals = {}  # index -> future of the client waiting for it to commit
+        self.flush_pending = False
+
+        self.loop = None
+        self.sock = None
+        self.receiver = None  # receiving task, on event loops without add_reader
+        self.timer = None  # the pending election or heartbeat deadline
+        # datagrams are received into and sent from these, nothing is allocated per message
+        self.recv_buffer = bytearray(MAX_DATAGRAM)
+        self.recv_view = memoryview(self.recv_buffer)
+        self.sender = None  # address the datagram being handled came from
+        self.send_buffer = bytearray(MAX_DATAGRAM)
+        self.send_view = memoryview(self.send_buffer)
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        # whatever survived the last run: term, vote, snapshot and entries
+        self.entries = open_log(self.data_dir)
+        self.current_term, self.voted_for = self.entries.term, self.entries.voted_for
+        if self.entries.snapshot_index:
+            snapshot = json.loads(self.entries.snapshot)
+            self.store = snapshot["store"]
+            self.base_config = (self.entries.snapshot_index,) + config_from_json(snapshot["cluster"])
+            self.commit_index = self.last_applied = self.entries.snapshot_index
+        self.configs = self.find_configs(self.entries.snapshot_index + 1)
+        self.apply_config()
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.bind(("127.0.0.1", self.port))
-        self.sock.settimeout(0.2)
-
-        # thread for receiving messages
-        self.alive = True
-        self.listener_thread = threading.Thread(target=self.listen)
-        self.listener_thread.start()
+        self.sock.setblocking(False)
+        self.sock.bind(self.address)
+        try:
+            self.loop.add_reader(self.sock, self.on_readable)
+        except NotImplementedError:
+            # the proactor loop (the default on windows) only has the awaitable socket calls
+            self.receiver = self.loop.create_task(self.receive(self.sock))
+        self.reset_election_timeout()
 
-        # thread for main logic (timers, chagning node state)
-        self.logic_thread = threading.Thread(target=self.run)
-        self.logic_thread.start()
+    def stop(self):
+        # a crash as far as the other nodes can tell: no more messages in or out
+        self.leader_id = None
+        self.fail_proposals()
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        if self.receiver:
+            self.receiver.cancel()
+            self.receiver = None
+        elif self.sock:
+            self.loop.remove_reader(self.sock)
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        self.entries.close()
 
     def log(self, message, color=COLOR_RESET):
         logger.info(f"{color}[Node {self.node_id} | Term {self.current_term} | {self.state}] {message}{COLOR_RESET}")
 
+    def schedule(self, delay, callback):
+        if self.timer:
+            self.timer.cancel()
+        self.timer = self.loop.call_later(delay, callback)
+
     def reset_election_timeout(self):
-        self.election_deadline = time.time() + random.uniform(2.5, 4.0)
+        self.schedule(random.uniform(*self.election_timeout), self.on_election_timeout)
 
-    def listen(self):
-        while self.alive:
+    def on_readable(self):
+        for _ in range(RECV_BATCH):
+            if self.sock is None:
+                return
             try:
-                data, addr = self.sock.recvfrom(4096)
-                msg = data.decode('utf-8')
-                self.handle_message(msg)
-            except socket.timeout:
-                pass
-            except Exception as e:
+                size, self.sender = self.sock.recvfrom_into(self.recv_buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
                 self.log(f"Error receiving: {e}", COLOR_ERROR)
+                return
+            self.received(size)
 
-    def handle_message(self, msg):
-        parts = msg.split("|")
-        msg_type = parts[0]
-
-        if msg_type == MSG_REQUEST_VOTE:  # REQUEST_VOTE|term|candidate_id
-            term = int(parts[1])
-            candidate_id = int(parts[2])
-            self.on_request_vote(term, candidate_id)
-
-        elif msg_type == MSG_VOTE:  # VOTE|term|voter_id|vote_granted
-            term = int(parts[1])
-            voter_id = int(parts[2])
-            vote_granted = (parts[3] == "True")
+    async def receive(self, sock):
+        # on_readable for loops without add_reader: one datagram per wakeup
+        while self.sock is sock:
+            try:
+                size, self.sender = await self.loop.sock_recvfrom_into(sock, self.recv_buffer)
+            except OSError as e:
+                # windows reports an earlier datagram's port unreachable here, the socket is fine
+                if self.sock is sock:
+                    self.log(f"Error receiving: {e}", COLOR_ERROR)
+                continue
+            self.received(size)
+
+    def received(self, size):
+        try:
+            self.handle_message(self.recv_view[:size])
+        except Exception as e:
+            self.log(f"Error receiving: {e}", COLOR_ERROR)
+
+    def handle_message(self, view):
+        msg_type = wire.message_type(view)
+
+        if msg_type == REQUEST_VOTE:
+            term, candidate_id, last_log_index, last_log_term = wire.decode(view, REQUEST_VOTE_FORMAT)
+            self.on_request_vote(term, candidate_id, last_log_index, last_log_term)
+
+        elif msg_type == VOTE:
+            term, voter_id, vote_granted = wire.decode(view, VOTE_FORMAT)
             self.on_vote_response(term, voter_id, vote_granted)
 
-        elif msg_type == MSG_HEARTBEAT:  # HEARTBEAT|term|leader_id
-            term = int(parts[1])
-            leader_id = int(parts[2])
-            self.on_heartbeat(term, leader_id)
-
-    def run(self):
-        while self.alive:
-            now = time.time()
-
-            if self.state == FOLLOWER:
-                if now >= self.election_deadline:
-                    self.become_candidate()
-
-            elif self.state == CANDIDATE:
-                # if we're candidate but we haven't become leader by the end of election - become candidate (restart election)
-                if now >= self.election_deadline:
-                    self.become_candidate()
-
-            elif self.state == LEADER:
-                # leader is supposed to send heartbeats
-                if now >= self.election_deadline:
-                    if random.randint(1, 100) > 40: # simulate network issues
-                        self.send_heartbeat()
-                    # reset deadline to next heartbeat send
-                    self.election_deadline = now + self.heartbeat_interval
-
-            time.sleep(0.1)
+        elif msg_type == APPEND_ENTRIES:
+            term, leader_id, prev_index, prev_term, leader_commit, count = wire.decode(view, APPEND_ENTRIES_FORMAT)
+            self.on_append_entries(term, leader_id, prev_index, prev_term, leader_commit,
+                                   list(wire.iter_entries(view, count)))
+
+        elif msg_type == APPEND_REPLY:
+            term, follower_id, success, match_index = wire.decode(view, APPEND_REPLY_FORMAT)
+            self.on_append_reply(term, follower_id, success, match_index)
+
+        elif msg_type == INSTALL_SNAPSHOT:
+            term, leader_id, last_index, last_term, offset, total = wire.decode(view, INSTALL_SNAPSHOT_FORMAT)
+            self.on_install_snapshot(term, leader_id, last_index, last_term, offset, total,
+                                     view[INSTALL_SNAPSHOT_FORMAT.size:])
+
+        elif msg_type == SNAPSHOT_REPLY:
+            term, follower_id, last_index, received = wire.decode(view, SNAPSHOT_REPLY_FORMAT)
+            self.on_snapshot_reply(term, follower_id, last_index, received)
+
+    def on_election_timeout(self):
+        # a follower that heard nothing from a leader starts an election, a candidate that didn't
+        # win by the end of its election starts another one
+        self.timer = None
+        if self.state != LEADER and self.is_voter():
+            self.become_candidate()
+
+    def on_heartbeat_timeout(self):
+        self.timer = None
+        if self.state != LEADER:
+            return
+        if random.random() >= self.heartbeat_loss:  # simulate network issues
+            for n in self.peer_ids:
+                if not self.progressed[n]:
+                    # nothing acknowledged since the last heartbeat: whatever was in flight is
+                    # assumed lost and is sent again from the last index the follower confirmed
+                    self.sent_index[n] = self.next_index[n] - 1
+                    self.snapshot_sent[n] = self.snapshot_acked[n]
+                    self.inflight[n].clear()
+                self.progressed[n] = False
+            self.send_heartbeat()
+        self.schedule(self.heartbeat_interval, self.on_heartbeat_timeout)
 
     def become_candidate(self):
         self.state = CANDIDATE
         self.current_term += 1
         self.voted_for = self.node_id
-        self.votes_received = 1  # voting for itself
+        self.leader_id = None
+        self.votes = {self.node_id}  # voting for itself
+        self.save_state()
         self.log("becoming candidate and starting an election", COLOR_CANDIDATE)
         self.reset_election_timeout()
         self.request_votes()
@@ -153,42 +360,197 @@ class Node:
         self.state = LEADER
         self.leader_id = self.node_id
         self.log("became leader!", COLOR_LEADER)
+        self.next_index.clear()
+        for n in self.peer_ids:
+            self.track(n)
+        # an entry of its own term lets the leader commit whatever earlier terms left uncommitted
+        self.entries.append(self.current_term, b"")
+        if self.old_members is not None and self.config_index <= self.commit_index:
+            # the last leader committed C_old,new but didn't get to C_new
+            self.append_config(None, self.members)
+        self.entries.after_sync(self.advance_commit_index)
         self.send_heartbeat()
+        self.schedule(self.heartbeat_interval, self.on_heartbeat_timeout)
+
+    def track(self, n):
+        # start replicating to follower n, from wherever its log turns out to end
+        self.next_index[n] = self.last_index() + 1
+        self.match_index[n] = 0
+        self.sent_index[n] = self.last_index()
+        self.inflight[n] = deque()
+        self.progressed[n] = True
+        self.snapshot_sent[n] = self.snapshot_acked[n] = 0
 
     def become_follower(self, term):
         self.state = FOLLOWER
+        if term > self.current_term:
+            # the vote is per term: a candidate stepping down keeps the vote it gave itself
+            self.voted_for = None
         self.current_term = term
-        self.voted_for = None
+        self.save_state()
         self.leader_id = None
+        self.fail_proposals()
         self.log("becoming follower", COLOR_FOLLOWER)
         self.reset_election_timeout()
 
     def send(self, node_id, msg):
-        addr = ("127.0.0.1", 5000 + node_id)
-        self.sock.sendto(msg.encode('utf-8'), addr)
+        address = self.addresses.get(node_id)
+        if self.sock is None or address is None:
+            return
+        try:
+            self.sock.sendto(msg, address)
+        except (BlockingIOError, InterruptedError):
+            pass  # socket buffer full: lost like any other datagram, raft sends it again
+        except OSError:
+            pass  # e.g. the last datagram to a stopped peer came back as port unreachable
+
+    def send_many(self, node_ids, msg):
+        # the same datagram to several nodes: a plain loop of sendto on addresses resolved when the
+        # configuration changed (python has no sendmmsg to hand the kernel all of them at once)
+        if self.sock is None:
+            return
+        sendto, addresses = self.sock.sendto, self.addresses
+        for n in node_ids:
+            try:
+                sendto(msg, addresses[n])
+            except OSError:
+                pass  # as in send
 
     def broadcast(self, msg):
-        for n in self.cluster:
-            if n != self.node_id:
-                self.send(n, msg)
+        self.send_many(self.peer_ids, msg)
+
+    def send_durable(self, node_id, msg):
+        # a message promising something about our term, vote or log goes out once that is on disk
+        self.entries.after_sync(lambda: self.send(node_id, msg))
+
+    def save_state(self):
+        self.entries.save_state(self.current_term, self.voted_for)
+
+    def last_index(self):
+        return self.entries.last_index()
+
+    def term_at(self, index):
+        return self.entries.term_at(index)
+
+    # membership (raft 6): a change goes through the joint configuration C_old,new, in which
+    # elections and commits need a majority of the old members and one of the new, then to C_new
+
+    def apply_config(self):
+        # the newest configuration in the log is the one in effect
+        self.config_index, self.old_members, self.members = self.configs[-1] if self.configs else self.base_config
+        # everyone a message may go to, addresses resolved once here rather than per datagram
+        leader_address = self.addresses.get(self.leader_id)
+        self.addresses = {**(self.old_members or {}), **self.members}
+        self.peer_ids = [n for n in self.addresses if n != self.node_id]
+        if leader_address and self.leader_id not in self.addresses:
+            self.addresses[self.leader_id] = leader_address  # a removed leader still gets its replies
+        if self.state == LEADER:
+            for n in list(self.next_index):
+                if n not in self.addresses:
+                    del self.next_index[n]  # replies from removed members are ignored
+            for n in self.peer_ids:
+                if n not in self.next_index:
+                    self.track(n)
+
+    def is_voter(self):
+        return self.node_id in self.members or (self.old_members is not None and self.node_id in self.old_members)
+
+    def voting_groups(self):
+        return [self.members] if self.old_members is None else [self.members, self.old_members]
+
+    def quorum(self, node_ids):
+        return all(sum(n in node_ids for n in group) > len(group) // 2 for group in self.voting_groups())
+
+    def config_at(self, index):
+        # the configuration as of index, for a snapshot up to it
+        for config in reversed(self.configs):
+            if config[0] <= index:
+                return config
+        return self.base_config
+
+    def find_configs(self, start):
+        # the configuration entries of the log from start on, read in chunks
+        configs, last = [], self.last_index()
+        for first in range(start, last + 1, 4096):
+            for index, (_, command) in enumerate(self.entries.slice(first, min(first + 4096, last + 1)), first):
+                if command.startswith(CONFIG_PREFIX):
+                    configs.append((index,) + decode_config(command))
+        return configs
+
+    def append_entry(self, term, command):
+        # every append to the log goes through here, to notice configuration entries
+        index = self.entries.append(term, command)
+        if command.startswith(CONFIG_PREFIX):
+            self.configs.append((index,) + decode_config(command))
+            self.apply_config()
+        return index
+
+    def truncate_log(self, index):
+        self.entries.truncate(index)
+        if self.configs and self.configs[-1][0] >= index:
+            # back to the configuration before the removed entries
+            self.configs = [config for config in self.configs if config[0] < index]
+            self.apply_config()
+
+    def append_config(self, old, new):
+        self.append_entry(self.current_term, encode_config(old, new))
+        self.flush_soon()
+
+    def change_membership(self, cluster):
+        # on the leader: move to the members of cluster (anything parse_cluster takes) through
+        # C_old,new. the returned future resolves to the index of C_new once that is committed;
+        # members left out stop taking part then, a leader left out steps down
+        if self.state != LEADER or self.sock is None:
+            raise NotLeader(self.leader_id if self.sock else None)
+        if self.old_members is not None or self.config_index > self.commit_index:
+            raise RuntimeError("a membership change is already in progress")
+        self.membership_change = self.loop.create_future()
+        self.append_config(self.members, parse_cluster(cluster, self.base_port))
+        return self.membership_change
+
+    def config_committed(self, index):
+        # on the leader, when the configuration entry at index commits: after C_old,new comes
+        # C_new, after C_new the change is done
+        if self.state != LEADER or index != self.config_index:
+            return
+        if self.old_members is not None:
+            self.append_config(None, self.members)
+            return
+        if self.membership_change and not self.membership_change.done():
+            self.membership_change.set_result(index)
+        self.membership_change = None
+        if self.node_id not in self.members:
+            self.log("removed from the cluster, stepping down", COLOR_EVENT)
+            self.become_follower(self.current_term)
 
     def request_votes(self):
         # sending REQUEST_VOTE to other nodes
-        msg = f"{MSG_REQUEST_VOTE}|{self.current_term}|{self.node_id}"
-        self.broadcast(msg)
+        last = self.last_index()
+        msg = wire.encode_request_vote(self.current_term, self.node_id, last, self.term_at(last))
+        self.entries.after_sync(lambda: self.broadcast(msg))
 
     # handle vote requests from other candidates
-    def on_request_vote(self, term, candidate_id):
+    def on_request_vote(self, term, candidate_id, last_log_index, last_log_term):
         # candidate's term < current term -> reject
         if term < self.current_term:
             return
+        if term > self.current_term and (self.state == LEADER or self.leader_id is not None and
+                                         self.loop.time() - self.heard_from_leader < self.election_timeout[0]):
+            # there is a leader: this is a member removed from the cluster (or cut off for a while)
+            # whose elections would only disrupt it, so no vote and no new term (raft 6 / 4.2.3)
+            return
 
         if term > self.current_term:
             self.become_follower(term)
 
+        # only a candidate whose log has everything ours has can win, so no committed entry is lost
+        last = self.last_index()
+        up_to_date = (last_log_term, last_log_index) >= (self.term_at(last), last)
+
         # if we havent' voted or already voted for this cnadidate
-        if (self.voted_for is None or self.voted_for == candidate_id):
+        if up_to_date and (self.voted_for is None or self.voted_for == candidate_id):
             self.voted_for = candidate_id
+            self.save_state()
             self.reset_election_timeout()
             self.send_vote(candidate_id, True)
             self.log(f"voted for candidate {candidate_id}", COLOR_EVENT)
@@ -197,8 +559,8 @@ class Node:
             self.send_vote(candidate_id, False)
 
     def send_vote(self, candidate_id, vote_granted):
-        msg = f"{MSG_VOTE}|{self.current_term}|{self.node_id}|{vote_granted}"
-        self.send(candidate_id, msg)
+        msg = wire.encode_vote(self.current_term, self.node_id, vote_granted)
+        self.send_durable(candidate_id, msg)
 
     def on_vote_response(self, term, voter_id, vote_granted):
         if self.state != CANDIDATE:
@@ -207,45 +569,339 @@ class Node:
             return
 
         if vote_granted:
-            self.votes_received += 1
-            self.log(f"received vote from {voter_id} (total: {self.votes_received})", COLOR_EVENT)
-            # check if majority
-            if self.votes_received > len(self.cluster)//2:
+            self.votes.add(voter_id)
+            self.log(f"received vote from {voter_id} (total: {len(self.votes)})", COLOR_EVENT)
+            # check if majority (of both the old and the new members during a change)
+            if self.quorum(self.votes):
                 self.become_leader()
 
     def send_heartbeat(self):
         if self.state == LEADER:
-            msg = f"{MSG_HEARTBEAT}|{self.current_term}|{self.node_id}"
-            self.broadcast(msg)
+            idle = {}  # next index -> followers with nothing new to send
+            for n in self.peer_ids:
+                if self.replicate(n):
+                    continue
+                if self.next_index[n] <= self.entries.snapshot_index:
+                    # still receiving the snapshot: the first chunk it didn't acknowledge, which is
+                    # answered like any other chunk
+                    self.inflight[n].append(self.send_snapshot_chunk(n, self.snapshot_acked[n]))
+                else:
+                    idle.setdefault(self.next_index[n], []).append(n)
+            # an empty APPEND_ENTRIES keeps them following; it is the same for every follower at the
+            # same index (all of them, once caught up), so it is encoded once for all of them
+            for next_index, followers in idle.items():
+                self.send_many(followers, self.send_view[:self.encode_append(next_index - 1, 0)])
             self.log("sending heartbeat", COLOR_EVENT)
 
-    def on_heartbeat(self, term, leader_id):
-        # if term > current_term, follow this leader
-        if term > self.current_term:
+    # client API, on the leader
+    def propose(self, command):
+        # append a "key=value" command to the log; the returned future resolves to its log index
+        # once a majority has it, or fails with NotLeader if this node loses the leadership first
+        if self.state != LEADER or self.sock is None:
+            raise NotLeader(self.leader_id if self.sock else None)
+        if isinstance(command, str):
+            command = command.encode()
+        if len(command) > MAX_COMMAND:
+            raise ValueError(f"command of {len(command)} bytes, at most {MAX_COMMAND} fit in a datagram")
+        if command.startswith(CONFIG_PREFIX):
+            raise ValueError("membership changes go through change_membership")
+        if b"=" not in command:
+            raise ValueError(f"not a key=value command: {command!r}")
+        try:
+            command.decode()
+        except UnicodeDecodeError:
+            raise ValueError(f"command is not utf-8: {command!r}") from None
+        self.entries.append(self.current_term, command)
+        future = self.loop.create_future()
+        self.proposals[self.last_index()] = future
+        self.flush_soon()
+        return future
+
+    def fail_proposals(self):
+        for future in self.proposals.values():
+            if not future.done():
+                future.set_exception(NotLeader(self.leader_id))
+        self.proposals.clear()
+        if self.membership_change and not self.membership_change.done():
+            # the change itself goes on under the next leader
+            self.membership_change.set_exception(NotLeader(self.leader_id))
+        self.membership_change = None
+
+    def flush_soon(self):
+        # entries appended in the same loop iteration go out together
+        if not self.flush_pending:
+            self.flush_pending = True
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        self.flush_pending = False
+        if self.state == LEADER:
+            for n in self.peer_ids:
+                self.replicate(n)
+        # the leader's own copy counts once it is on disk (a one node cluster commits on its own)
+        self.entries.after_sync(self.advance_commit_index)
+
+    def replicate(self, n):
+        # send the follower batches of the entries it hasn't been sent yet, without waiting for
+        # replies, until max_inflight batches are outstanding. returns whether anything was sent
+        if self.next_index[n] <= self.entries.snapshot_index:
+            return self.send_snapshot(n)
+        sent = False
+        while len(self.inflight[n]) < self.max_inflight and self.sent_index[n] < self.last_index():
+            prev_index = self.sent_index[n]
+            count = self.batch_size(prev_index + 1)
+            self.send_append(n, prev_index, count)
+            self.sent_index[n] = prev_index + count
+            self.inflight[n].append(prev_index + count)
+            sent = True
+        return sent
+
+    def batch_size(self, first):
+        # entries from first on that fit in one datagram
+        count, size = 0, 0
+        for term, command in self.entries.slice(first, first + self.append_batch):
+            size += len(command) + wire.ENTRY.size
+            if count and size > APPEND_BATCH_BYTES:
+                break
+            count += 1
+        return count
+
+    def send_append(self, n, prev_index, count):
+        self.send(n, self.send_view[:self.encode_append(prev_index, count)])
+
+    def encode_append(self, prev_index, count):
+        # an APPEND_ENTRIES of count entries after prev_index into send_buffer, returns its size
+        return wire.encode_append_entries(self.send_buffer, self.current_term, self.node_id, prev_index,
+                                          self.term_at(prev_index), self.commit_index,
+                                          self.entries.slice(prev_index + 1, prev_index + 1 + count))
+
+    def send_snapshot(self, n):
+        # the snapshot in chunks, pipelined like batches of entries
+        sent = False
+        total = len(self.entries.snapshot)
+        while len(self.inflight[n]) < self.max_inflight and self.snapshot_sent[n] < total:
+            self.snapshot_sent[n] = self.send_snapshot_chunk(n, self.snapshot_sent[n])
+            self.inflight[n].append(self.snapshot_sent[n])
+            sent = True
+        return sent
+
+    def send_snapshot_chunk(self, n, offset):
+        snapshot = self.entries.snapshot
+        chunk = snapshot[offset:offset + APPEND_BATCH_BYTES]
+        size = wire.encode_install_snapshot(self.send_buffer, self.current_term, self.node_id,
+                                            self.entries.snapshot_index, self.entries.snapshot_term,
+                                            offset, len(snapshot), chunk)
+        self.send(n, self.send_view[:size])
+        return offset + len(chunk)
+
+    def on_append_entries(self, term, leader_id, prev_index, prev_term, leader_commit, entries):
+        # entries: (term, command) pairs, commands as views of the receive buffer
+        if term < self.current_term:
+            # a leader of an old term: the reply tells it to step down
+            self.send_append_reply(leader_id, False, 0)
+            return
+        # if term > current_term, or we were competing in this term, follow this leader
+        if term > self.current_term or self.state != FOLLOWER:
             self.become_follower(term)
+        self.follow(leader_id)
+        if not entries:
+            self.log(f"heartbeat received from Leader {leader_id}", COLOR_EVENT)
+        self.reset_election_timeout()
+
+        # entries up to the snapshot are committed, so they agree with the leader's
+        if prev_index > self.last_index() or (prev_index >= self.entries.snapshot_index
+                                              and self.term_at(prev_index) != prev_term):
+            # a gap or a conflict before this batch: the leader goes back to what we have
+            self.send_append_reply(leader_id, False, min(self.last_index(), prev_index - 1))
+            return
+
+        index, last = prev_index, self.last_index()
+        for entry_term, command in entries:
+            index += 1
+            if index <= self.entries.snapshot_index:
+                continue
+            if index <= last:
+                if self.term_at(index) == entry_term:
+                    continue  # a batch sent again, already have it
+                self.truncate_log(index)  # entries of a deposed leader, never committed
+            last = self.append_entry(entry_term, bytes(command))  # out of the receive buffer
+
+        if leader_commit > self.commit_index:
+            self.commit_index = min(leader_commit, index)
+            self.apply_committed()
+        self.send_append_reply(leader_id, True, index)
+
+    def follow(self, leader_id):
         self.leader_id = leader_id
-        if self.state != FOLLOWER:
+        self.heard_from_leader = self.loop.time()
+        if leader_id not in self.addresses:
+            # a leader not in our configuration: we are being added to the cluster, or the leader is
+            # one just removed from it. either way the replies go back where it sent from
+            self.addresses[leader_id] = self.sender
+
+    def send_append_reply(self, leader_id, success, match_index):
+        msg = wire.encode_append_reply(self.current_term, self.node_id, success, match_index)
+        self.send_durable(leader_id, msg)
+
+    def on_append_reply(self, term, follower_id, success, match_index):
+        if term > self.current_term:
             self.become_follower(term)
+            return
+        if self.state != LEADER or term < self.current_term or follower_id not in self.next_index:
+            return
+
+        if success:
+            # the batches this acknowledges, replies to earlier ones may have been lost; a reply to
+            # an empty heartbeat acknowledges nothing new and frees no slot in the pipeline
+            inflight = self.inflight[follower_id]
+            while inflight and inflight[0] <= match_index:
+                inflight.popleft()
+            if match_index > self.match_index[follower_id]:
+                # only acknowledgements of something new count as progress: a follower answering
+                # heartbeats while the replies to its batches got lost has to be sent them again
+                self.progressed[follower_id] = True
+                self.match_index[follower_id] = match_index
+                self.next_index[follower_id] = max(self.next_index[follower_id], match_index + 1)
+                self.advance_commit_index()
         else:
-            self.log(f"heartbeat received from Leader {leader_id}", COLOR_EVENT)
-            self.reset_election_timeout()
+            # the follower is missing entries before what was sent (or lost a batch): start over
+            # from the last index it has, dropping the batches in flight after it
+            self.progressed[follower_id] = True
+            self.next_index[follower_id] = max(match_index, self.match_index[follower_id]) + 1
+            self.sent_index[follower_id] = self.next_index[follower_id] - 1
+            self.inflight[follower_id].clear()
+        self.replicate(follower_id)
+
+    def advance_commit_index(self):
+        if self.state != LEADER:
+            return
+        # the highest index stored on a majority, counting the leader itself if it is a member,
+        # of the new members and during a change of the old ones too
+        majority = min(self.replicated(group) for group in self.voting_groups())
+        # only entries of the current term are committed by counting replicas (raft 5.4.2)
+        if majority > self.commit_index and self.term_at(majority) == self.current_term:
+            self.commit_index = majority
+            self.apply_committed()
+
+    def replicated(self, members):
+        durable = self.entries.durable_index()
+        matched = sorted([durable if n == self.node_id else self.match_index.get(n, 0) for n in members], reverse=True)
+        return matched[len(members) // 2]
+
+    def apply_committed(self):
+        if self.last_applied >= self.commit_index:
+            return
+        for _, command in self.entries.slice(self.last_applied + 1, self.commit_index + 1):
+            # decoded before the entry counts as applied; one propose() wouldn't have taken (from
+            # an older log) changes nothing, the same on every node, and fails its proposal
+            error = None
+            if command and not command.startswith(CONFIG_PREFIX):
+                try:
+                    key, _, value = command.decode().partition("=")
+                except UnicodeDecodeError as e:
+                    error = e
+            self.last_applied += 1
+            if command.startswith(CONFIG_PREFIX):
+                self.config_committed(self.last_applied)
+            elif command and error is None:
+                self.store[key] = value
+            future = self.proposals.pop(self.last_applied, None)
+            if future and not future.done():
+                if error is None:
+                    future.set_result(self.last_applied)
+                else:
+                    future.set_exception(ValueError(f"command at {self.last_applied} is not utf-8"))
+        if (self.last_applied - self.entries.snapshot_index >= self.snapshot_entries
+                and not self.entries.snapshotting):
+            # the store and the membership as of last_applied replace the log up to it; not while
+            # the last one is still being written, snapshot_index only moves once it is on disk
+            self.base_config = self.config_at(self.last_applied)
+            self.configs = [config for config in self.configs if config[0] > self.last_applied]
+            snapshot = {"store": self.store, "cluster": config_to_json(*self.base_config[1:])}
+            self.entries.save_snapshot(self.last_applied, self.term_at(self.last_applied),
+                                       json.dumps(snapshot).encode())
+
+    def on_install_snapshot(self, term, leader_id, last_index, last_term, offset, total, chunk):
+        if term < self.current_term:
+            self.send_durable(leader_id, wire.encode_snapshot_reply(self.current_term, self.node_id, last_index, 0))
+            return
+        if term > self.current_term or self.state != FOLLOWER:
+            self.become_follower(term)
+        self.follow(leader_id)
+        self.reset_election_timeout()
 
+        if last_index <= self.commit_index:
+            received = total  # we have all of it already
+        else:
+            if offset == 0 and (self.receiving is None or self.receiving[:2] != (last_index, last_term)):
+                self.receiving = (last_index, last_term, bytearray())
+            received = 0
+            if self.receiving and self.receiving[:2] == (last_index, last_term):
+                data = self.receiving[2]
+                if offset == len(data):
+                    data += chunk
+                received = len(data)
+            if received == total:
+                self.receiving = None
+                self.entries.install_snapshot(last_index, last_term, bytes(data))
+                snapshot = json.loads(data)
+                self.store = snapshot["store"]
+                self.base_config = (last_index,) + config_from_json(snapshot["cluster"])
+                # configuration entries after the snapshot survive if the log was kept
+                self.configs = [config for config in self.configs if last_index < config[0] <= self.last_index()]
+                self.apply_config()
+                self.commit_index = self.last_applied = last_index
+                self.log(f"installed snapshot up to {last_index} from Leader {leader_id}", COLOR_EVENT)
+        self.send_durable(leader_id, wire.encode_snapshot_reply(self.current_term, self.node_id, last_index, received))
+
+    def on_snapshot_reply(self, term, follower_id, last_index, received):
+        if term > self.current_term:
+            self.become_follower(term)
+            return
+        if self.state != LEADER or term < self.current_term or follower_id not in self.next_index:
+            return
+        self.progressed[follower_id] = True
+        if self.inflight[follower_id]:
+            self.inflight[follower_id].popleft()  # every chunk gets one reply
+        if last_index != self.entries.snapshot_index or self.next_index[follower_id] > last_index:
+            return  # about a snapshot since replaced, or already done with
+        self.snapshot_acked[follower_id] = max(self.snapshot_acked[follower_id], received)
+        if received >= len(self.entries.snapshot):
+            # installed: on with the entries after it
+            self.match_index[follower_id] = max(self.match_index[follower_id], last_index)
+            self.next_index[follower_id] = last_index + 1
+            self.sent_index[follower_id] = last_index
+            self.snapshot_sent[follower_id] = self.snapshot_acked[follower_id] = 0
+            self.inflight[follower_id].clear()
+            self.advance_commit_index()
+        elif not self.inflight[follower_id]:
+            # every chunk in flight was answered but some went missing: go back to the first of them
+            self.snapshot_sent[follower_id] = self.snapshot_acked[follower_id]
+        self.replicate(follower_id)
+
+
+async def run_cluster(cluster, data_dir=DATA_DIR, nodes=None, **options):
+    # the nodes of the cluster this process runs (all of them by default) on one loop
+    cluster = parse_cluster(cluster)
+    nodes = [Node(nid, cluster, data_dir=data_dir and os.path.join(data_dir, f"node-{nid}"), **options)
+             for nid in (cluster if nodes is None else nodes)]
+    for n in nodes:
+        await n.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for n in nodes:
+            n.stop()
 
-def main():
-    cluster = [0, 1, 2]
-    nodes = []
-    for nid in cluster:
-        n = Node(nid, cluster)
-        nodes.append(n)
 
+def main():
+    nodes = NODES and [int(nid) for nid in NODES.split(",")]
     try:
-        while True:
-            time.sleep(1)
+        asyncio.run(run_cluster(CLUSTER, nodes=nodes))
     except KeyboardInterrupt:
         print("shutting down...")
-        for n in nodes:
-            n.alive = False
         sys.exit(0)
 
 
-main()
+if __name__ == "__main__":
+    main()
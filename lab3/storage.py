@@ -0,0 +1,511 @@
+import asyncio
+import mmap
+import os
+import struct
+import zlib
+from array import array
+
+# a raft node's log and persistent state (current term, vote). a log holds the entries after the
+# last snapshot:
+#
+#   MemoryLog  nothing survives a restart, for nodes without a data directory
+#   DiskLog    term, vote and entries appended to segment files, written in group commits
+#
+# both keep the term of every entry in memory; MemoryLog keeps the commands too, DiskLog only
+# those of the last entries and reads older ones (a follower catching up) through mmap.
+#
+# durability is asynchronous: records are buffered and the buffer is written and fsynced from a
+# thread once per loop iteration, or as soon as the previous fsync is done, so every append,
+# term or vote change made meanwhile shares one fsync. after_sync(callback) runs the callback
+# once everything written so far is on disk: a node replies to a vote request or an
+# APPEND_ENTRIES only then.
+#
+# data directory layout:
+#
+#   0000000001.log ...  segments, every record: crc32 (of the rest), type, payload length, payload
+#   snapshot            index, term, crc32 of the data, then the data (replaced atomically)
+
+SEGMENT_BYTES = int(os.environ.get("RAFT_SEGMENT_BYTES", 64 * 1024 * 1024))
+# commands of the newest entries DiskLog keeps in memory, for replication and applying
+TAIL_ENTRIES = int(os.environ.get("RAFT_TAIL_ENTRIES", 8192))
+
+RECORD = struct.Struct('!IBI')
+ENTRY, STATE, TRUNCATE = range(1, 4)
+ENTRY_RECORD = struct.Struct('!QQ')  # index, term, then the command
+STATE_RECORD = struct.Struct('!Qq')  # term, voted_for (-1 for nobody)
+TRUNCATE_RECORD = struct.Struct('!Q')  # the first index removed
+SNAPSHOT_HEADER = struct.Struct('!QQI')
+NOBODY = -1
+
+
+# fdatasync skips the metadata a later read doesn't need; windows and macos only have fsync
+fdatasync = getattr(os, "fdatasync", os.fsync)
+
+
+class StorageError(Exception):
+    pass
+
+
+def sync_directory(directory):
+    # makes files created, renamed or removed in it durable. windows can't open a directory, and
+    # NTFS doesn't need it: its metadata is journaled
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def encode_record(kind, payload):
+    body = struct.pack('!BI', kind, len(payload)) + payload
+    return struct.pack('!I', zlib.crc32(body)) + body
+
+
+def iter_records(data):
+    # (type, payload offset, payload length, record end) of every intact record in data; stops at
+    # the first torn or corrupt one, whose offset is then the end of the last good record
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        crc, kind, length = RECORD.unpack_from(data, offset)
+        end = offset + RECORD.size + length
+        if end > len(data) or zlib.crc32(data[offset + 4:end]) != crc:
+            return
+        yield kind, offset + RECORD.size, length, end
+        offset = end
+
+
+class MemoryLog:
+    def __init__(self):
+        self.term = 0
+        self.voted_for = None
+        self.snapshot_index = 0
+        self.snapshot_term = 0
+        self.snapshot = b''  # the state machine as of snapshot_index
+        self.terms = array('Q')  # term of each entry after snapshot_index
+        self.commands = []
+        self.snapshotting = False
+
+    def last_index(self):
+        return self.snapshot_index + len(self.terms)
+
+    def durable_index(self):
+        return self.last_index()
+
+    def term_at(self, index):
+        # None for entries compacted into the snapshot
+        if index == self.snapshot_index:
+            return self.snapshot_term
+        if index < self.snapshot_index:
+            return None
+        return self.terms[index - self.snapshot_index - 1]
+
+    def slice(self, start, end):
+        # (term, command) of the entries from start up to, not including, end
+        first, last = start - self.snapshot_index - 1, end - self.snapshot_index - 1
+        return list(zip(self.terms[first:last], self.commands[first:last]))
+
+    def save_state(self, term, voted_for):
+        self.term, self.voted_for = term, voted_for
+
+    def append(self, term, command):
+        self.terms.append(term)
+        self.commands.append(command)
+        return self.last_index()
+
+    def truncate(self, index):
+        # remove the entry at index and every one after it
+        del self.terms[index - self.snapshot_index - 1:]
+        del self.commands[index - self.snapshot_index - 1:]
+
+    def after_sync(self, callback):
+        callback()
+
+    def save_snapshot(self, index, term, data):
+        # the state machine as of index replaces the entries up to it
+        self.compact(index, term, data)
+
+    def install_snapshot(self, index, term, data):
+        # a snapshot from the leader: entries after it are kept only if the log agrees with it
+        keep = self.term_at(index) == term if index <= self.last_index() else False
+        if not keep:
+            self.terms, self.commands = array('Q'), []
+            self.snapshot_index = index
+        self.compact(index, term, data)
+
+    def compact(self, index, term, data):
+        drop = index - self.snapshot_index
+        if drop > 0:
+            del self.terms[:drop]
+            del self.commands[:drop]
+        self.snapshot_index, self.snapshot_term, self.snapshot = index, term, data
+
+    def close(self):
+        pass
+
+
+class Segment:
+    def __init__(self, directory, number):
+        self.number = number
+        self.path = os.path.join(directory, f"{number:010d}.log")
+        self.fd = None  # open while the segment is written to
+        self.map = None
+
+    def read(self, offset, length):
+        if self.map is None or offset + length > len(self.map):
+            # the segment grew since it was mapped (or was never mapped)
+            if self.map is not None:
+                self.map.close()
+            with open(self.path, 'rb') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map[offset:offset + length]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class DiskLog(MemoryLog):
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, tail_entries=TAIL_ENTRIES):
+        super().__init__()
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.tail_entries = tail_entries
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = {}  # number -> Segment
+        self.entry_segments = array('I')  # segment of each entry after snapshot_index
+        self.offsets = array('Q')  # offset of each entry's command in its segment
+        self.tail_start = 1  # index of self.commands[0]
+        self.file_index = 0  # entries up to this one are written to their segment, not just buffered
+
+        self.buffer = bytearray()  # records not written to the active segment yet
+        self.size = 0  # bytes of the active segment, buffer included
+        self.written = 0  # bytes of records produced since opening
+        self.synced = 0  # of which are known to be on disk
+        self.synced_index = 0
+        self.sync_index = 0  # entries up to this one are in what the running sync writes
+        self.waiting = []  # (bytes that must be synced, callback)
+        self.syncing = False
+        self.sync_scheduled = False
+        self.unsynced_fds = []  # sealed segments to fsync with the next sync
+        self.new_files = False  # segments created since the last directory fsync
+        self.installing = False  # a snapshot from the leader is not on disk yet, nothing else goes
+
+        self.recover()
+        self.synced_index = self.file_index = self.last_index()
+        self.active = self.open_segment(max(self.segments, default=0) + 1)
+
+    # recovery
+
+    def recover(self):
+        path = os.path.join(self.directory, "snapshot")
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+            index, term, crc = SNAPSHOT_HEADER.unpack_from(data)
+            snapshot = data[SNAPSHOT_HEADER.size:]
+            if zlib.crc32(snapshot) != crc:
+                raise StorageError(f"corrupt snapshot in {self.directory}")
+            self.snapshot_index, self.snapshot_term, self.snapshot = index, term, snapshot
+
+        numbers = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".log"))
+        for position, number in enumerate(numbers):
+            segment = self.segments[number] = Segment(self.directory, number)
+            with open(segment.path, 'rb') as f:
+                data = f.read()
+            end = self.replay(segment, data)
+            if end < len(data):
+                # a write torn by a crash: it was never acknowledged, nor was anything after it. that
+                # can be in a sealed segment too, when the crash came between a roll and the fsync
+                # shared with the new segment: the log ends here
+                self.cut(segment, end, numbers[position + 1:])
+                break
+
+    def cut(self, segment, end, later):
+        fd = os.open(segment.path, os.O_WRONLY)
+        try:
+            os.ftruncate(fd, end)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        if later:
+            for number in later:
+                os.unlink(Segment(self.directory, number).path)
+            sync_directory(self.directory)
+
+    def replay(self, segment, data):
+        end = 0
+        for kind, offset, length, end in iter_records(data):
+            if kind == STATE:
+                self.term, voted_for = STATE_RECORD.unpack_from(data, offset)
+                self.voted_for = None if voted_for == NOBODY else voted_for
+            elif kind == TRUNCATE:
+                index, = TRUNCATE_RECORD.unpack_from(data, offset)
+                if index <= self.last_index():
+                    self.drop_from(max(index, self.snapshot_index + 1))
+            elif kind == ENTRY:
+                index, term = ENTRY_RECORD.unpack_from(data, offset)
+                if index <= self.snapshot_index:
+                    continue
+                if index <= self.last_index():
+                    self.drop_from(index)
+                if index != self.last_index() + 1:
+                    raise StorageError(f"entry {index} after {self.last_index()} in {segment.path}")
+                self.terms.append(term)
+                self.entry_segments.append(segment.number)
+                self.offsets.append(offset + ENTRY_RECORD.size)
+        self.tail_start = self.last_index() + 1
+        return end
+
+    # reads
+
+    def slice(self, start, end):
+        result = []
+        for index in range(start, min(end, self.tail_start)):
+            # older than the commands kept in memory: read from the segment
+            position = index - self.snapshot_index - 1
+            segment = self.segments[self.entry_segments[position]]
+            length = self.command_length(position)
+            result.append((self.terms[position], segment.read(self.offsets[position], length)))
+        first = max(start, self.tail_start)
+        if first < end:
+            terms = self.terms[first - self.snapshot_index - 1:end - self.snapshot_index - 1]
+            result += zip(terms, self.commands[first - self.tail_start:end - self.tail_start])
+        return result
+
+    def command_length(self, position):
+        segment = self.segments[self.entry_segments[position]]
+        header = segment.read(self.offsets[position] - ENTRY_RECORD.size - RECORD.size, RECORD.size)
+        return RECORD.unpack(header)[2] - ENTRY_RECORD.size
+
+    def durable_index(self):
+        return min(self.synced_index, self.last_index())
+
+    # writes
+
+    def write(self, kind, payload):
+        if self.size >= self.segment_bytes and not self.installing:
+            self.roll()
+        record = encode_record(kind, payload)
+        self.buffer += record
+        self.size += len(record)
+        self.written += len(record)
+        self.sync_soon()
+
+    def save_state(self, term, voted_for):
+        if (term, voted_for) == (self.term, self.voted_for):
+            return
+        super().save_state(term, voted_for)
+        self.write(STATE, STATE_RECORD.pack(term, NOBODY if voted_for is None else voted_for))
+
+    def append(self, term, command):
+        index = self.last_index() + 1
+        self.write(ENTRY, ENTRY_RECORD.pack(index, term) + command)
+        self.terms.append(term)
+        self.entry_segments.append(self.active.number)
+        self.offsets.append(self.size - len(command))
+        self.commands.append(command)
+        if len(self.commands) > 2 * self.tail_entries and self.file_index >= self.tail_start + self.tail_entries:
+            # forget the oldest commands, they can be read from the segments now
+            del self.commands[:self.tail_entries]
+            self.tail_start += self.tail_entries
+        return index
+
+    def truncate(self, index):
+        self.write(TRUNCATE, TRUNCATE_RECORD.pack(index))
+        self.drop_from(index)
+
+    def drop_from(self, index):
+        position = index - self.snapshot_index - 1
+        del self.terms[position:]
+        del self.entry_segments[position:]
+        del self.offsets[position:]
+        if index < self.tail_start:
+            self.commands = []
+            self.tail_start = index
+        else:
+            del self.commands[index - self.tail_start:]
+        self.synced_index = min(self.synced_index, index - 1)
+        # entries appended again at index are not in a sync that was already running
+        self.sync_index = min(self.sync_index, index - 1)
+        self.file_index = min(self.file_index, index - 1)
+
+    def open_segment(self, number):
+        # every segment starts with the current state, so it survives the older segments being
+        # compacted away
+        segment = self.segments[number] = Segment(self.directory, number)
+        segment.fd = os.open(segment.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.new_files = True
+        record = encode_record(STATE, STATE_RECORD.pack(self.term, NOBODY if self.voted_for is None else self.voted_for))
+        self.buffer += record
+        self.size = len(record)
+        self.written += len(record)
+        return segment
+
+    def roll(self):
+        # seal the active segment and continue in a new one
+        self.write_buffer()
+        self.unsynced_fds.append(self.active)
+        self.active = self.open_segment(self.active.number + 1)
+
+    def write_buffer(self):
+        if self.buffer:
+            os.write(self.active.fd, self.buffer)
+            self.buffer = bytearray()
+            self.file_index = self.last_index()
+
+    # group commit
+
+    def after_sync(self, callback):
+        if self.synced == self.written and not self.installing:
+            callback()
+        else:
+            self.waiting.append((self.written, callback))
+            self.sync_soon()
+
+    def sync_soon(self):
+        if not self.sync_scheduled and not self.syncing and not self.installing:
+            self.sync_scheduled = True
+            asyncio.get_running_loop().call_soon(self.sync)
+
+    def sync(self):
+        self.sync_scheduled = False
+        if self.active.fd is None or self.installing:
+            return  # closed, or held back until the installed snapshot is on disk
+        self.write_buffer()
+        sealed, self.unsynced_fds = self.unsynced_fds, []
+        new_files, self.new_files = self.new_files, False
+        target, self.sync_index = self.written, self.last_index()
+        self.syncing = True
+        future = asyncio.get_running_loop().run_in_executor(
+            None, self.flush_to_disk, [s.fd for s in sealed] + [self.active.fd], new_files)
+        future.add_done_callback(lambda f: self.synced_to(f, target, sealed))
+
+    def flush_to_disk(self, fds, new_files):
+        for fd in fds:
+            fdatasync(fd)
+        if new_files:
+            # the names of new segments are in the directory, not in the files
+            sync_directory(self.directory)
+
+    def synced_to(self, future, target, sealed):
+        self.syncing = False
+        if future.cancelled() or future.exception() or self.active.fd is None:
+            return  # closed while syncing, as good as a crash
+        self.synced = target
+        self.synced_index = max(self.synced_index, min(self.sync_index, self.last_index()))
+        for segment in sealed:
+            os.close(segment.fd)
+            segment.fd = None
+        self.remove_obsolete()
+        ready = [callback for written, callback in self.waiting if written <= target]
+        self.waiting = [(written, callback) for written, callback in self.waiting if written > target]
+        for callback in ready:
+            callback()
+        if self.written > self.synced:
+            self.sync_soon()
+
+    # snapshots
+
+    def write_snapshot(self, index, term, data):
+        path = os.path.join(self.directory, "snapshot")
+        with open(path + ".tmp", 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(index, term, zlib.crc32(data)))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        sync_directory(self.directory)
+
+    def save_snapshot(self, index, term, data):
+        # written from a thread; entries up to index are dropped once the snapshot is on disk
+        if self.snapshotting:
+            return
+        self.snapshotting = True
+        future = asyncio.get_running_loop().run_in_executor(None, self.write_snapshot, index, term, data)
+        future.add_done_callback(lambda f: self.snapshot_saved(f, index, term, data))
+
+    def snapshot_saved(self, future, index, term, data):
+        self.snapshotting = False
+        if self.active.fd is None:
+            return
+        if self.installing:
+            self.write_installed()  # the leader's snapshot came in meanwhile and replaces this one
+        elif not future.cancelled() and not future.exception() and index > self.snapshot_index:
+            self.compact(index, term, data)
+
+    def install_snapshot(self, index, term, data):
+        # also written from a thread, and until it is on disk nothing else is: not the TRUNCATE,
+        # not the entries appended meanwhile, and the callbacks (the reply to the leader) wait.
+        # so a crash in between loses nothing that was acknowledged
+        self.installing = True
+        keep = self.term_at(index) == term if index <= self.last_index() else False
+        if not keep:
+            self.truncate(self.snapshot_index + 1)
+            self.tail_start = index + 1
+            self.snapshot_index = index
+            self.synced_index = max(self.synced_index, index)
+        self.compact(index, term, data)
+        if not self.snapshotting:
+            self.write_installed()
+
+    def write_installed(self):
+        index = self.snapshot_index
+        self.snapshotting = True
+        future = asyncio.get_running_loop().run_in_executor(
+            None, self.write_snapshot, index, self.snapshot_term, self.snapshot)
+        future.add_done_callback(lambda f: self.snapshot_installed(f, index))
+
+    def snapshot_installed(self, future, index):
+        self.snapshotting = False
+        if future.cancelled() or future.exception() or self.active.fd is None:
+            return  # nothing is made durable any more, as good as a crash
+        if index != self.snapshot_index:
+            self.write_installed()  # another one was installed meanwhile
+            return
+        self.installing = False
+        self.sync_soon()  # what was held back, then the waiting callbacks
+
+    def compact(self, index, term, data):
+        drop = index - self.snapshot_index
+        if drop > 0:
+            del self.terms[:drop]
+            del self.entry_segments[:drop]
+            del self.offsets[:drop]
+            if index >= self.tail_start:
+                del self.commands[:index + 1 - self.tail_start]
+                self.tail_start = index + 1
+        self.snapshot_index, self.snapshot_term, self.snapshot = index, term, data
+        if self.synced == self.written:
+            self.remove_obsolete()
+        # otherwise once the next sync is done
+
+    def remove_obsolete(self):
+        # segments older than every entry after the snapshot hold nothing recovery needs any more,
+        # as long as the newer ones, each starting with the state, are on disk (and the snapshot)
+        if self.installing:
+            return
+        oldest = self.entry_segments[0] if self.entry_segments else self.active.number
+        for number in [n for n in self.segments if n < oldest]:
+            segment = self.segments[number]
+            if segment.fd is not None:
+                continue  # sealed but not synced yet
+            segment.close()
+            os.unlink(segment.path)
+            del self.segments[number]
+
+    def close(self):
+        # without writing what is still buffered: like a crash, to whoever reopens the directory
+        for segment in self.segments.values():
+            segment.close()
+        self.waiting = []
+
+
+def open_log(directory=None):
+    return DiskLog(directory) if directory else MemoryLog()
@@ -0,0 +1,112 @@
+import struct
+
+# the raft wire protocol: every message is one datagram starting with the same fixed header
+#
+#   version  u8    WIRE_VERSION, a node drops datagrams of any other version
+#   type     u8    REQUEST_VOTE, VOTE, APPEND_ENTRIES, APPEND_REPLY, INSTALL_SNAPSHOT or SNAPSHOT_REPLY
+#   term     u64
+#   sender   u16   node id
+#
+# followed by the fixed fields of the type, all big endian. APPEND_ENTRIES ends with its entries,
+# each a u64 term, a u32 length and that many bytes of command, INSTALL_SNAPSHOT with a chunk of
+# the snapshot that runs to the end of the datagram.
+#
+# decoding reads straight out of the buffer the datagram was received into (recvfrom_into): the
+# fields with unpack_from and the commands as memoryview slices of it, so nothing is copied until
+# an entry is actually appended to the log. the slices are only valid until the next datagram is
+# received into the same buffer.
+
+WIRE_VERSION = 1
+
+REQUEST_VOTE, VOTE, APPEND_ENTRIES, APPEND_REPLY, INSTALL_SNAPSHOT, SNAPSHOT_REPLY = range(1, 7)
+
+HEADER = struct.Struct('!BBQH')
+# header + last_log_index, last_log_term
+REQUEST_VOTE_FORMAT = struct.Struct('!BBQHQQ')
+# header + vote_granted
+VOTE_FORMAT = struct.Struct('!BBQH?')
+# header + prev_index, prev_term, leader_commit, entry count
+APPEND_ENTRIES_FORMAT = struct.Struct('!BBQHQQQH')
+# header + success, match_index
+APPEND_REPLY_FORMAT = struct.Struct('!BBQH?Q')
+ENTRY = struct.Struct('!QI')
+# header + last_index, last_term, offset of the chunk, size of the whole snapshot
+INSTALL_SNAPSHOT_FORMAT = struct.Struct('!BBQHQQQQ')
+# header + last_index, bytes of the snapshot received so far
+SNAPSHOT_REPLY_FORMAT = struct.Struct('!BBQHQQ')
+
+MAX_DATAGRAM = 65507  # the most a UDP datagram can carry
+
+
+class WireError(ValueError):
+    pass
+
+
+def encode_request_vote(term, sender, last_log_index, last_log_term):
+    return REQUEST_VOTE_FORMAT.pack(WIRE_VERSION, REQUEST_VOTE, term, sender, last_log_index, last_log_term)
+
+
+def encode_vote(term, sender, vote_granted):
+    return VOTE_FORMAT.pack(WIRE_VERSION, VOTE, term, sender, vote_granted)
+
+
+def encode_append_reply(term, sender, success, match_index):
+    return APPEND_REPLY_FORMAT.pack(WIRE_VERSION, APPEND_REPLY, term, sender, success, match_index)
+
+
+def encode_append_entries(buffer, term, sender, prev_index, prev_term, leader_commit, entries):
+    # packs the message into buffer (a preallocated bytearray) and returns its length; entries is
+    # a sequence of (term, command bytes)
+    APPEND_ENTRIES_FORMAT.pack_into(buffer, 0, WIRE_VERSION, APPEND_ENTRIES, term, sender,
+                                    prev_index, prev_term, leader_commit, len(entries))
+    offset = APPEND_ENTRIES_FORMAT.size
+    for entry_term, command in entries:
+        end = offset + ENTRY.size + len(command)
+        if end > len(buffer):
+            raise WireError("entries don't fit in one datagram")
+        ENTRY.pack_into(buffer, offset, entry_term, len(command))
+        buffer[offset + ENTRY.size:end] = command
+        offset = end
+    return offset
+
+
+def encode_install_snapshot(buffer, term, sender, last_index, last_term, offset, total, chunk):
+    INSTALL_SNAPSHOT_FORMAT.pack_into(buffer, 0, WIRE_VERSION, INSTALL_SNAPSHOT, term, sender,
+                                      last_index, last_term, offset, total)
+    end = INSTALL_SNAPSHOT_FORMAT.size + len(chunk)
+    if end > len(buffer):
+        raise WireError("snapshot chunk doesn't fit in one datagram")
+    buffer[INSTALL_SNAPSHOT_FORMAT.size:end] = chunk
+    return end
+
+
+def encode_snapshot_reply(term, sender, last_index, received):
+    return SNAPSHOT_REPLY_FORMAT.pack(WIRE_VERSION, SNAPSHOT_REPLY, term, sender, last_index, received)
+
+
+def message_type(view):
+    # the type of the message in view, after checking it's one this node can read
+    if len(view) < HEADER.size:
+        raise WireError(f"short datagram of {len(view)} bytes")
+    if view[0] != WIRE_VERSION:
+        raise WireError(f"wire version {view[0]}, expected {WIRE_VERSION}")
+    return view[1]
+
+
+def decode(view, layout):
+    # the fields of a message after version and type
+    if len(view) < layout.size:
+        raise WireError(f"short datagram of {len(view)} bytes")
+    return layout.unpack_from(view)[2:]
+
+
+def iter_entries(view, count):
+    # (term, command) of each entry of an APPEND_ENTRIES in view, commands as memoryview slices
+    offset = APPEND_ENTRIES_FORMAT.size
+    for _ in range(count):
+        entry_term, length = ENTRY.unpack_from(view, offset)
+        offset += ENTRY.size
+        if offset + length > len(view):
+            raise WireError("truncated entry")
+        yield entry_term, view[offset:offset + length]
+        offset += length